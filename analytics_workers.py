@@ -0,0 +1,675 @@
+import os
+import cv2
+import json
+import time
+import queue
+import argparse
+import logging
+import threading
+import multiprocessing
+import numpy as np
+from datetime import datetime, timedelta
+from typing import List, Optional
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db_configure import SessionLocal
+from db_initialize import Camera, ROI, Counter, Visitor
+from visitor_ingest import VisitorRecord, ingest_visitors, INGEST_MAX_ROWS
+from camera_ingest import CameraReader
+from recording_catalog import parse_recording_start
+from frame_hub import FrameStep, read_frame
+from roi_geometry import RoiSet, DwellState, roi_cache
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+# Analytics pool settings
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", os.cpu_count() or 1))  # Processes, cameras are sharded across them
+ANALYTICS_FPS = float(os.getenv("ANALYTICS_FPS", 5))  # Frames analyzed per camera and second
+ANALYTICS_DETECTOR = os.getenv("ANALYTICS_DETECTOR", "hog")  # 'hog' (people detector) or 'motion' (background subtraction, fixed cameras)
+ANALYTICS_DETECT_WIDTH = int(os.getenv("ANALYTICS_DETECT_WIDTH", 480))  # Frames are scaled down to this width for detection
+ANALYTICS_TRACK_IOU = float(os.getenv("ANALYTICS_TRACK_IOU", 0.3))  # Minimum box overlap to continue a track
+ANALYTICS_TRACK_MAX_AGE_SECONDS = float(os.getenv("ANALYTICS_TRACK_MAX_AGE_SECONDS", 2))  # A person unseen this long has left
+ANALYTICS_MIN_DWELL_SECONDS = float(os.getenv("ANALYTICS_MIN_DWELL_SECONDS", 1))  # Shorter ROI visits are not recorded
+ANALYTICS_BATCH_ROWS = int(os.getenv("ANALYTICS_BATCH_ROWS", 500))  # Visitor rows per database write
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", 2))
+ANALYTICS_METRICS_SECONDS = float(os.getenv("ANALYTICS_METRICS_SECONDS", 5))
+ANALYTICS_MAX_WRITE_FAILURES = int(os.getenv("ANALYTICS_MAX_WRITE_FAILURES", 5))  # Consecutive non-503 failures before a batch is dead-lettered
+ANALYTICS_DEAD_LETTER_FILE = os.getenv("ANALYTICS_DEAD_LETTER_FILE", "analytics_dead_letter.ndjson")  # Replayable with POST /visitors/bulk
+
+# Optional Caffe age/gender classifiers (e.g. the Levi & Hassner age_net/gender_net), run once per person
+ANALYTICS_AGE_MODEL = os.getenv("ANALYTICS_AGE_MODEL")
+ANALYTICS_AGE_PROTO = os.getenv("ANALYTICS_AGE_PROTO")
+ANALYTICS_GENDER_MODEL = os.getenv("ANALYTICS_GENDER_MODEL")
+ANALYTICS_GENDER_PROTO = os.getenv("ANALYTICS_GENDER_PROTO")
+
+ANALYTICS_STAGES = ("read", "detect", "track", "classify", "roi")
+
+# Age buckets of the classifier mapped to the age groups of the reports (service_functions.AGE_GROUPS)
+AGE_BUCKET_GROUPS = ['Child', 'Child', 'Child', 'Teenager', 'Young', 'Adult', 'Middle Age', 'Elderly']
+GENDER_LABELS = ['male', 'female']
+CLASSIFIER_MEAN = (78.4263377603, 87.7689143744, 114.895847746)
+
+
+###########################################################################################
+################################### Cameras ###############################################
+###########################################################################################
+
+# Analysis settings of the enabled cameras with a stream: feature toggles, ROIs, counter and the next person id
+def load_analytics_cameras(db: Session, camera_ids: Optional[List[int]] = None) -> List[dict]:
+    query = db.query(Camera).filter(Camera.cam_enable.is_(True), Camera.cam_rtsp.isnot(None))
+    if camera_ids:
+        query = query.filter(Camera.id.in_(camera_ids))
+
+    cameras = []
+    for camera in query.order_by(Camera.id):
+        counter_id = db.query(Counter.counter_id).filter(Counter.counter_cam_id == camera.id).order_by(Counter.counter_id).scalar()
+        last_person_id = db.query(func.max(Visitor.person_id)).filter(Visitor.cam_id == camera.id).scalar()
+        cameras.append({
+            "id": camera.id,
+            "source": camera.cam_rtsp.strip(),
+            "exhibition_id": camera.exhibition_id,
+            "counter_id": counter_id,
+            "rois": [(roi.roi_id, roi.roi_coor) for roi in db.query(ROI).filter(ROI.camera_id == camera.id).order_by(ROI.roi_id)],
+            "rois_from_db": True,
+            "person_counting": camera.person_counting_status is not False,
+            "time_duration": camera.time_duration_calculation_status is not False,
+            "age_detect": camera.age_detect_status is not False,
+            "gender_detect": camera.gender_detect_status is not False,
+            "person_id_start": last_person_id or 0,
+        })
+    return cameras
+
+
+# Cameras of one worker: round robin over the id order, so every process gets a similar share
+def shard_cameras(cameras: List[dict], workers: int) -> List[List[dict]]:
+    shards = [[] for _ in range(max(1, min(workers, len(cameras))))]
+    for index, camera in enumerate(sorted(cameras, key=lambda camera: camera["id"])):
+        shards[index % len(shards)].append(camera)
+    return shards
+
+
+###########################################################################################
+################################### Pipeline stages #######################################
+###########################################################################################
+
+# Time spent per stage, shipped to the parent every ANALYTICS_METRICS_SECONDS
+class StageMetrics:
+    def __init__(self):
+        self.seconds = dict.fromkeys(ANALYTICS_STAGES, 0.0)
+        self.calls = dict.fromkeys(ANALYTICS_STAGES, 0)
+        self.frames = 0
+        self.rows = 0
+
+    def add(self, stage: str, started: float) -> float:
+        now = time.perf_counter()
+        self.seconds[stage] += now - started
+        self.calls[stage] += 1
+        return now
+
+    def snapshot(self) -> dict:
+        return {"frames": self.frames, "rows": self.rows, "seconds": dict(self.seconds), "calls": dict(self.calls)}
+
+
+# Boxes (x1, y1, x2, y2) in frame pixels, at most ANALYTICS_DETECT_WIDTH wide for the detector
+def _detection_scale(frame) -> float:
+    return min(1.0, ANALYTICS_DETECT_WIDTH / frame.shape[1])
+
+
+def _scaled(frame, scale: float):
+    if scale >= 1.0:
+        return frame
+    return cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+
+
+class HogPersonDetector:
+    def __init__(self):
+        self.hog = cv2.HOGDescriptor()
+        self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+
+    def detect(self, frame) -> np.ndarray:
+        scale = _detection_scale(frame)
+        rects, weights = self.hog.detectMultiScale(_scaled(frame, scale), winStride=(8, 8), padding=(8, 8), scale=1.05)
+        if len(rects) == 0:
+            return np.empty((0, 4), dtype=np.float32)
+        keep = cv2.dnn.NMSBoxes(rects.tolist(), np.asarray(weights, dtype=np.float32).ravel().tolist(), 0.3, 0.4)
+        rects = np.asarray(rects, dtype=np.float32)[np.asarray(keep, dtype=np.int64).ravel()]
+        rects[:, 2:] += rects[:, :2]
+        return rects / scale
+
+
+# Moving blobs of a fixed camera; much cheaper than HOG, but counts anything that moves
+class MotionPersonDetector:
+    MIN_AREA_FRACTION = 0.002
+
+    def __init__(self):
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(history=500, detectShadows=False)
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+    def detect(self, frame) -> np.ndarray:
+        scale = _detection_scale(frame)
+        small = _scaled(frame, scale)
+        mask = cv2.morphologyEx(self.subtractor.apply(small), cv2.MORPH_OPEN, self.kernel)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        min_area = self.MIN_AREA_FRACTION * small.shape[0] * small.shape[1]
+        boxes = [cv2.boundingRect(contour) for contour in contours if cv2.contourArea(contour) >= min_area]
+        if not boxes:
+            return np.empty((0, 4), dtype=np.float32)
+        boxes = np.asarray(boxes, dtype=np.float32)
+        boxes[:, 2:] += boxes[:, :2]
+        return boxes / scale
+
+
+def make_detector():
+    return MotionPersonDetector() if ANALYTICS_DETECTOR == "motion" else HogPersonDetector()
+
+
+# IoU matrix of two box arrays
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+# Greedy IoU tracker: a detection continues the track it overlaps most, unmatched detections start new
+# people, tracks unseen for ANALYTICS_TRACK_MAX_AGE_SECONDS are over
+class IouTracker:
+    def __init__(self, first_id: int):
+        self.next_id = first_id
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.last_seen = np.empty(0, dtype=np.float64)
+
+    # Returns (ids of the tracks seen in this frame, their boxes, ids of new tracks, ids of finished tracks)
+    def update(self, boxes: np.ndarray, now: float):
+        matched_tracks, matched_boxes = [], []
+        if len(self.ids) and len(boxes):
+            iou = box_iou(self.boxes, boxes)
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                track, box = divmod(int(flat), len(boxes))
+                if iou[track, box] < ANALYTICS_TRACK_IOU:
+                    break
+                if track in matched_tracks or box in matched_boxes:
+                    continue
+                matched_tracks.append(track)
+                matched_boxes.append(box)
+
+        if matched_tracks:
+            self.boxes[matched_tracks] = boxes[matched_boxes]
+            self.last_seen[matched_tracks] = now
+        new_boxes = np.setdiff1d(np.arange(len(boxes)), matched_boxes)
+        new_ids = np.arange(self.next_id, self.next_id + len(new_boxes), dtype=np.int64)
+        self.next_id += len(new_boxes)
+
+        seen_ids = np.concatenate([self.ids[matched_tracks], new_ids])
+        seen_boxes = np.concatenate([self.boxes[matched_tracks], boxes[new_boxes]])
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.boxes = np.concatenate([self.boxes, boxes[new_boxes]])
+        self.last_seen = np.concatenate([self.last_seen, np.full(len(new_ids), now)])
+
+        expired = now - self.last_seen > ANALYTICS_TRACK_MAX_AGE_SECONDS
+        finished_ids = self.ids[expired]
+        self.ids, self.boxes, self.last_seen = self.ids[~expired], self.boxes[~expired], self.last_seen[~expired]
+        return seen_ids, seen_boxes, new_ids, finished_ids
+
+    # Every open track, at the end of a video or on shutdown
+    def finish_all(self) -> np.ndarray:
+        finished_ids, self.ids = self.ids, np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.last_seen = np.empty(0, dtype=np.float64)
+        return finished_ids
+
+
+# Age group and gender from the head region of a person box; a classifier without model files answers None
+class AgeGenderClassifier:
+    def __init__(self):
+        self.age_net = self._load(ANALYTICS_AGE_PROTO, ANALYTICS_AGE_MODEL, "age")
+        self.gender_net = self._load(ANALYTICS_GENDER_PROTO, ANALYTICS_GENDER_MODEL, "gender")
+
+    @staticmethod
+    def _load(proto: Optional[str], model: Optional[str], name: str):
+        if not proto or not model:
+            return None
+        try:
+            return cv2.dnn.readNet(model, proto)
+        except cv2.error as e:
+            logging.error(f"Analytics: unable to load the {name} classifier: {e}")
+            return None
+
+    def _blob(self, frame, box):
+        x1, y1, x2, y2 = box.astype(int)
+        side = max(1, x2 - x1)
+        head = frame[max(0, y1):max(0, y1) + side, max(0, x1):max(0, x2)]
+        if head.size == 0:
+            return None
+        return cv2.dnn.blobFromImage(head, 1.0, (227, 227), CLASSIFIER_MEAN, swapRB=False)
+
+    def classify(self, frame, box, age: bool, gender: bool):
+        age_group = person_gender = None
+        if not ((age and self.age_net is not None) or (gender and self.gender_net is not None)):
+            return age_group, person_gender
+        blob = self._blob(frame, box)
+        if blob is None:
+            return age_group, person_gender
+        if age and self.age_net is not None:
+            self.age_net.setInput(blob)
+            age_group = AGE_BUCKET_GROUPS[int(self.age_net.forward()[0].argmax())]
+        if gender and self.gender_net is not None:
+            self.gender_net.setInput(blob)
+            person_gender = GENDER_LABELS[int(self.gender_net.forward()[0].argmax())]
+        return age_group, person_gender
+
+
+###########################################################################################
+################################### Camera analyzer #######################################
+###########################################################################################
+
+# Detection, tracking, classification and ROI dwell time of one camera, producing visitor rows.
+# ROI membership and dwell time are array operations over all tracked people (roi_geometry).
+# Stages the camera's toggles turn off are skipped: no classifier runs without age/gender detection,
+# no dwell timing without time_duration_calculation_status (a row per ROI entry with duration 0).
+class CameraAnalyzer:
+    def __init__(self, camera: dict, classifier: AgeGenderClassifier, metrics: StageMetrics):
+        self.camera = camera
+        self.camera_id = camera["id"]
+        self.classifier = classifier
+        self.metrics = metrics
+        self.classify_age = camera["age_detect"] and classifier.age_net is not None
+        self.classify_gender = camera["gender_detect"] and classifier.gender_net is not None
+        self.time_duration = camera["time_duration"]
+
+        self.rois_from_db = camera.get("rois_from_db", False)
+        self.roi_set = RoiSet.from_rows(camera["rois"], self.camera_id)
+
+        self.detector = make_detector()
+        self.tracker = IouTracker(camera["person_id_start"] + 1)
+        self.attributes = {}  # person id -> (age group, gender)
+        self.dwell = DwellState(self.roi_set.roi_ids)  # Visits per person and ROI
+        self.presence = DwellState([0])  # First/last time each person was seen, for cameras without ROIs
+        self.rows = []
+
+    # Whether this camera needs analyzing at all
+    @staticmethod
+    def wanted(camera: dict) -> bool:
+        return camera["person_counting"] or camera["time_duration"]
+
+    def _row(self, person_id: int, roi_id: Optional[int], entered_at: float, duration: float) -> dict:
+        age_group, gender = self.attributes.get(person_id, (None, None))
+        return {
+            "person_id": int(person_id),
+            "roi_id": roi_id,
+            "counter_id": self.camera["counter_id"],
+            "cam_id": self.camera_id,
+            "person_duration_in_roi": round(float(duration), 2) if self.time_duration else 0.0,
+            "person_age_group": age_group,
+            "person_gender": gender,
+            "current_datetime": datetime.fromtimestamp(entered_at),
+            "exhibition_id": self.camera["exhibition_id"],
+        }
+
+    # Pick up ROI edits (roi_cache re-reads tbl_rois every ROI_CACHE_REVALIDATE_SECONDS)
+    def _refresh_rois(self):
+        try:
+            roi_set = roi_cache.get(self.camera_id)
+        except Exception as e:
+            logging.warning(f"Analytics: camera {self.camera_id} keeps its ROIs, reloading failed: {e}")
+            self.rois_from_db = False
+            return
+        if roi_set is not self.roi_set:
+            self._visits_ended(self.dwell.remap(roi_set.roi_ids))
+            self.roi_set = roi_set
+
+    def process(self, frame, now: float):
+        started = time.perf_counter()
+        boxes = self.detector.detect(frame)
+        started = self.metrics.add("detect", started)
+
+        seen_ids, seen_boxes, new_ids, finished_ids = self.tracker.update(boxes, now)
+        started = self.metrics.add("track", started)
+
+        if len(new_ids) and (self.classify_age or self.classify_gender):
+            new_boxes = seen_boxes[len(seen_ids) - len(new_ids):]
+            for person_id, box in zip(new_ids, new_boxes):
+                self.attributes[int(person_id)] = self.classifier.classify(frame, box, self.classify_age, self.classify_gender)
+            started = self.metrics.add("classify", started)
+
+        if self.rois_from_db:
+            self._refresh_rois()
+        if len(seen_ids):
+            # Foot point (bottom centre of the box) decides which ROIs a person stands in, all people against all ROIs at once
+            feet = np.stack([(seen_boxes[:, 0] + seen_boxes[:, 2]) / 2, seen_boxes[:, 3]], axis=1)
+            frame_size = (frame.shape[1], frame.shape[0]) if frame is not None else None
+            entered, ended = self.dwell.update(seen_ids, self.roi_set.contains(feet, frame_size), now)
+            self.presence.update(seen_ids, np.ones((len(seen_ids), 1), dtype=bool), now)
+            if not self.time_duration:
+                # No dwell timing: a row as soon as someone enters an ROI
+                for person_id, roi_id, entered_at, _ in zip(*entered):
+                    self.rows.append(self._row(person_id, int(roi_id), entered_at, 0.0))
+            self._visits_ended(ended)
+        if len(finished_ids):
+            self._end_persons(finished_ids)
+        self.metrics.add("roi", started)
+        self.metrics.frames += 1
+
+    def _visits_ended(self, ended):
+        if not self.time_duration:
+            return
+        for person_id, roi_id, entered_at, last_inside_at in zip(*ended):
+            if last_inside_at - entered_at >= ANALYTICS_MIN_DWELL_SECONDS:
+                self.rows.append(self._row(person_id, int(roi_id), entered_at, last_inside_at - entered_at))
+
+    def _end_persons(self, person_ids: np.ndarray):
+        self._visits_ended(self.dwell.end_persons(person_ids))
+        person_ids, _, first_seen, last_seen = self.presence.end_persons(person_ids)
+        if not len(self.roi_set):
+            # No ROIs configured: one row per person, with the time the camera saw them
+            for person_id, first, last in zip(person_ids, first_seen, last_seen):
+                self.rows.append(self._row(person_id, None, first, last - first))
+        for person_id in person_ids:
+            self.attributes.pop(int(person_id), None)
+
+    # Close every open track and visit
+    def finish(self):
+        finished_ids = self.tracker.finish_all()
+        if len(finished_ids):
+            self._end_persons(finished_ids)
+
+    def take_rows(self) -> List[dict]:
+        rows, self.rows = self.rows, []
+        self.metrics.rows += len(rows)
+        return rows
+
+
+###########################################################################################
+################################### Worker process ########################################
+###########################################################################################
+
+def _ship(out_queue, worker_index: int, analyzers, metrics: StageMetrics):
+    rows = [row for analyzer in analyzers for row in analyzer.take_rows()]
+    if rows:
+        out_queue.put(("rows", worker_index, rows))
+    out_queue.put(("metrics", worker_index, metrics.snapshot()))
+
+
+# Live cameras: each one has its own reader thread (no recording) and is analyzed at ANALYTICS_FPS
+# from its latest frame; a camera slower than that is analyzed on every new frame.
+# The reader is the worker's own, so a camera also ingested by the API (CAMERA_INGEST_ENABLED=1) is
+# pulled over two RTSP sessions. Cameras that cap their sessions need a restreaming proxy in front
+# (e.g. mediamtx), or the analytics run offline on the recorded segments instead (--offline).
+def _run_live(worker_index: int, analyzers, out_queue, stop_event, metrics: StageMetrics):
+    readers = {}
+    for analyzer in analyzers:
+        readers[analyzer.camera_id] = CameraReader(analyzer.camera_id, analyzer.camera["source"], record=False)
+        readers[analyzer.camera_id].start()
+    sequences = dict.fromkeys(readers, 0)
+    interval = 1 / ANALYTICS_FPS
+    next_tick = time.monotonic()
+    shipped_at = time.monotonic()
+    try:
+        while not stop_event.is_set():
+            for analyzer in analyzers:
+                started = time.perf_counter()
+                latest = readers[analyzer.camera_id].latest()
+                metrics.add("read", started)
+                if latest is None or latest[2] == sequences[analyzer.camera_id]:
+                    continue
+                frame, timestamp, sequences[analyzer.camera_id] = latest
+                analyzer.process(frame, timestamp)
+
+            if time.monotonic() - shipped_at >= ANALYTICS_METRICS_SECONDS:
+                _ship(out_queue, worker_index, analyzers, metrics)
+                shipped_at = time.monotonic()
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                stop_event.wait(delay)
+            else:
+                # Behind: the shard has more cameras than this core can analyze at ANALYTICS_FPS
+                next_tick = time.monotonic()
+    finally:
+        for reader in readers.values():
+            reader.stop()
+
+
+# Video files (recordings, or a stand-in for a camera): read as fast as the stages allow, sampling
+# ANALYTICS_FPS frames per second of video; timestamps come from the recording's name when it has one
+def _run_files(worker_index: int, analyzers, out_queue, stop_event, metrics: StageMetrics):
+    shipped_at = time.monotonic()
+    for analyzer in analyzers:
+        source = analyzer.camera["source"]
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            logging.error(f"Analytics: unable to open {source}")
+            continue
+        fps = capture.get(cv2.CAP_PROP_FPS) or ANALYTICS_FPS
+        start = parse_recording_start(os.path.basename(source)) or datetime.now()
+        step = FrameStep(fps, ANALYTICS_FPS)
+        position = -1
+        try:
+            while not stop_event.is_set():
+                started = time.perf_counter()
+                count = step.next()
+                frame = read_frame(capture, count)
+                metrics.add("read", started)
+                if frame is None:
+                    break
+                position += count
+                analyzer.process(frame, (start + timedelta(seconds=position / fps)).timestamp())
+                if time.monotonic() - shipped_at >= ANALYTICS_METRICS_SECONDS:
+                    _ship(out_queue, worker_index, analyzers, metrics)
+                    shipped_at = time.monotonic()
+        finally:
+            capture.release()
+        analyzer.finish()
+
+
+def _worker_main(worker_index: int, cameras: List[dict], out_queue, stop_event, offline: bool):
+    # One OpenCV thread per process: throughput scales with processes, not with threads fighting over cores
+    cv2.setNumThreads(1)
+    metrics = StageMetrics()
+    classifier = AgeGenderClassifier()
+    analyzers = [CameraAnalyzer(camera, classifier, metrics) for camera in cameras if CameraAnalyzer.wanted(camera)]
+    logging.info(f"Analytics worker {worker_index}: cameras {[analyzer.camera_id for analyzer in analyzers]}")
+    try:
+        if offline:
+            _run_files(worker_index, analyzers, out_queue, stop_event, metrics)
+        else:
+            _run_live(worker_index, analyzers, out_queue, stop_event, metrics)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for analyzer in analyzers:
+            analyzer.finish()
+        _ship(out_queue, worker_index, analyzers, metrics)
+        out_queue.put(("done", worker_index, None))
+
+
+###########################################################################################
+################################### Pool ##################################################
+###########################################################################################
+
+# Default sink of the pool: one ingest transaction per batch (COPY and rollups, see visitor_ingest)
+def write_visitor_rows(rows: List[dict]) -> int:
+    db = SessionLocal()
+    try:
+        return ingest_visitors(db, [VisitorRecord(**row) for row in rows])
+    finally:
+        db.close()
+
+
+# Cameras sharded over worker processes; the parent batches their visitor rows into the database
+# and keeps the latest per-stage timings of every worker
+class AnalyticsPool:
+    def __init__(self, cameras: List[dict], workers: int = ANALYTICS_WORKERS, offline: bool = False, write_rows=write_visitor_rows):
+        self.shards = shard_cameras(cameras, workers)
+        self.offline = offline
+        self.write_rows = write_rows
+        self.rows_written = 0
+        self.rows_dead_lettered = 0
+        self.worker_metrics = {}
+        self._write_failures = 0
+
+        self._context = multiprocessing.get_context("spawn")
+        self._queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._processes = []
+        self._pending = []
+        self._done = set()
+        self._collector = None
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.monotonic()
+        for index, shard in enumerate(self.shards):
+            process = self._context.Process(target=_worker_main, name=f"analytics-{index}",
+                                            args=(index, shard, self._queue, self._stop_event, self.offline), daemon=True)
+            process.start()
+            self._processes.append(process)
+        self._collector = threading.Thread(target=self._collect, name="analytics-collector", daemon=True)
+        self._collector.start()
+
+    def _collect(self):
+        flushed_at = time.monotonic()
+        while len(self._done) < len(self._processes):
+            try:
+                kind, worker_index, payload = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                kind = None
+                if not any(process.is_alive() for process in self._processes):
+                    break
+            if kind == "rows":
+                self._pending.extend(payload)
+            elif kind == "metrics":
+                self.worker_metrics[worker_index] = payload
+            elif kind == "done":
+                self._done.add(worker_index)
+
+            if len(self._pending) >= ANALYTICS_BATCH_ROWS or time.monotonic() - flushed_at >= ANALYTICS_FLUSH_SECONDS:
+                self._flush()
+                flushed_at = time.monotonic()
+        self._flush()
+
+    def _flush(self):
+        while self._pending:
+            batch = self._pending[:ANALYTICS_BATCH_ROWS]
+            try:
+                self.rows_written += self.write_rows(batch)
+            except Exception as e:
+                # Busy database (503): keep the rows for the next flush, within INGEST_MAX_ROWS. Any other
+                # error may be the batch itself (e.g. a foreign key violation), it is retried only
+                # ANALYTICS_MAX_WRITE_FAILURES times in a row before it is set aside
+                busy = isinstance(e, HTTPException) and e.status_code == 503
+                if not busy:
+                    self._write_failures += 1
+                    if self._write_failures >= ANALYTICS_MAX_WRITE_FAILURES:
+                        self._dead_letter(batch, e)
+                        del self._pending[:len(batch)]
+                        continue
+                detail = e.detail if isinstance(e, HTTPException) else e
+                logging.warning(f"Analytics: writing {len(batch)} visitor rows failed ({detail}), retrying later")
+                if len(self._pending) > INGEST_MAX_ROWS:
+                    dropped = len(self._pending) - INGEST_MAX_ROWS
+                    del self._pending[:dropped]
+                    logging.error(f"Analytics: dropped the {dropped} oldest visitor rows")
+                return
+            self._write_failures = 0
+            del self._pending[:len(batch)]
+
+    # Append a batch that keeps failing to ANALYTICS_DEAD_LETTER_FILE as NDJSON, so the rows after it can be written
+    def _dead_letter(self, batch: List[dict], error: Exception):
+        self._write_failures = 0
+        self.rows_dead_lettered += len(batch)
+        if not ANALYTICS_DEAD_LETTER_FILE:
+            logging.error(f"Analytics: dropped {len(batch)} visitor rows after {ANALYTICS_MAX_WRITE_FAILURES} failed writes ({error})")
+            return
+        try:
+            with open(ANALYTICS_DEAD_LETTER_FILE, "a") as file:
+                for row in batch:
+                    file.write(json.dumps(row, default=str) + "\n")
+            logging.error(f"Analytics: moved {len(batch)} visitor rows to {ANALYTICS_DEAD_LETTER_FILE} "
+                          f"after {ANALYTICS_MAX_WRITE_FAILURES} failed writes ({error})")
+        except OSError as e:
+            logging.error(f"Analytics: dropped {len(batch)} visitor rows, writing {ANALYTICS_DEAD_LETTER_FILE} failed ({e})")
+
+    # Block until every worker is done (offline runs end by themselves)
+    def wait(self):
+        for process in self._processes:
+            process.join()
+        if self._collector is not None:
+            self._collector.join()
+
+    def stop(self):
+        self._stop_event.set()
+        self.wait()
+
+    # Totals and per-stage mean milliseconds over all workers
+    def metrics(self) -> dict:
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        frames = sum(metrics["frames"] for metrics in self.worker_metrics.values())
+        stages = {}
+        for stage in ANALYTICS_STAGES:
+            seconds = sum(metrics["seconds"][stage] for metrics in self.worker_metrics.values())
+            calls = sum(metrics["calls"][stage] for metrics in self.worker_metrics.values())
+            stages[stage] = {"total_seconds": round(seconds, 3), "mean_ms": round(seconds / calls * 1000, 2) if calls else None}
+        return {
+            "workers": len(self._processes),
+            "cameras": sum(len(shard) for shard in self.shards),
+            "frames": frames,
+            "frames_per_second": round(frames / elapsed, 1) if elapsed else None,
+            "rows_produced": sum(metrics["rows"] for metrics in self.worker_metrics.values()),
+            "rows_written": self.rows_written,
+            "rows_dead_lettered": self.rows_dead_lettered,
+            "rows_pending": len(self._pending),
+            "stages": stages,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the video analytics workers and write visitor rows.")
+    parser.add_argument("--workers", type=int, default=ANALYTICS_WORKERS)
+    parser.add_argument("--camera", action="append", default=[], metavar="ID=SOURCE",
+                        help="Analyze SOURCE as camera ID (all features on, no ROIs) instead of reading tbl_cameras; repeatable")
+    parser.add_argument("--roi", action="append", default=[], metavar="CAMERA_ID:ROI_ID=COORDINATES",
+                        help="ROI of a --camera, e.g. 1:1=[100,200,400,480]; repeatable")
+    parser.add_argument("--offline", action="store_true", help="Sources are video files: analyze them as fast as possible and exit")
+    parser.add_argument("--seconds", type=float, help="Stop a live run after this long")
+    parser.add_argument("--dry-run", action="store_true", help="Count the visitor rows instead of writing them")
+    args = parser.parse_args()
+
+    if args.camera:
+        cameras = {}
+        for item in args.camera:
+            camera_id, _, source = item.partition("=")
+            cameras[int(camera_id)] = {"id": int(camera_id), "source": source, "exhibition_id": None, "counter_id": None,
+                                       "rois": [], "person_counting": True, "time_duration": True,
+                                       "age_detect": True, "gender_detect": True, "person_id_start": 0}
+        for item in args.roi:
+            key, _, coordinates = item.partition("=")
+            camera_id, _, roi_id = key.partition(":")
+            cameras[int(camera_id)]["rois"].append((int(roi_id), coordinates))
+        cameras = list(cameras.values())
+    else:
+        db = SessionLocal()
+        try:
+            cameras = load_analytics_cameras(db)
+        finally:
+            db.close()
+
+    pool = AnalyticsPool(cameras, args.workers, args.offline, (lambda rows: len(rows)) if args.dry_run else write_visitor_rows)
+    pool.start()
+    try:
+        if args.offline:
+            pool.wait()
+        else:
+            started = time.monotonic()
+            while args.seconds is None or time.monotonic() - started < args.seconds:
+                time.sleep(ANALYTICS_METRICS_SECONDS)
+                logging.info(f"Analytics: {pool.metrics()}")
+            pool.stop()
+    except KeyboardInterrupt:
+        pool.stop()
+    logging.info(f"Analytics: {pool.metrics()}")
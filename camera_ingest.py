@@ -0,0 +1,452 @@
+import os
+import cv2
+import time
+import asyncio
+import argparse
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException
+from frame_hub import acquire_stream_slot, release_stream_slot, encode_jpeg, _decode_executor, MJPEG_JPEG_QUALITY, FRAME_HUB_DEFAULT_FPS
+from recording_catalog import recording_catalog
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+# Live camera ingest settings. Readers are opt-in: with several uvicorn workers enable them on one
+# process only, or run this module on its own (python camera_ingest.py)
+CAMERA_INGEST_ENABLED = os.getenv("CAMERA_INGEST_ENABLED", "0") == "1"
+CAMERA_INGEST_RECORD = os.getenv("CAMERA_INGEST_RECORD", "1") != "0"  # Write rolling segments under the recordings directory
+CAMERA_INGEST_SEGMENT_SECONDS = int(os.getenv("CAMERA_INGEST_SEGMENT_SECONDS", 300))
+CAMERA_INGEST_FOURCC = os.getenv("CAMERA_INGEST_FOURCC", "mp4v")
+CAMERA_INGEST_BACKOFF_MIN_SECONDS = float(os.getenv("CAMERA_INGEST_BACKOFF_MIN_SECONDS", 1))
+CAMERA_INGEST_BACKOFF_MAX_SECONDS = float(os.getenv("CAMERA_INGEST_BACKOFF_MAX_SECONDS", 60))
+CAMERA_INGEST_TIMEOUT_SECONDS = float(os.getenv("CAMERA_INGEST_TIMEOUT_SECONDS", 10))  # Open/read timeout of a stream
+CAMERA_INGEST_SYNC_SECONDS = float(os.getenv("CAMERA_INGEST_SYNC_SECONDS", 30))  # Re-read tbl_cameras this often
+
+# RTSP over TCP: no smeared frames from lost UDP packets
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp")
+
+
+###########################################################################################
+################################### Recording #############################################
+###########################################################################################
+
+# Rolling <id>_YYYY-MM-DD_HH-MM-SS.mp4 segments of one camera. A segment is written under .recording/ and moved
+# next to the others when it is closed, so get_most_recent_video, playback and the frame cache only see complete files.
+class SegmentRecorder:
+    def __init__(self, camera_id: int, fps: float, root: Optional[str] = None):
+        self.camera_id = camera_id
+        self.fps = fps
+        self.directory = os.path.join(root or recording_catalog.root, str(camera_id))
+        self.work_directory = os.path.join(self.directory, ".recording")
+        self.path = None
+        self.segments_written = 0
+        self._writer = None
+        self._size = None
+        self._started_at = None
+
+    def write(self, frame, now: float):
+        size = (frame.shape[1], frame.shape[0])
+        if self._writer is not None and (size != self._size or now - self._started_at >= CAMERA_INGEST_SEGMENT_SECONDS):
+            self.close()
+        if self._writer is None:
+            self._open(size, now)
+        self._writer.write(frame)
+
+    def _open(self, size, now: float):
+        os.makedirs(self.work_directory, exist_ok=True)
+        # Names have a one second resolution, a reconnect within the same second takes the next free one
+        start = int(now)
+        while True:
+            name = f"{self.camera_id}_{datetime.fromtimestamp(start).strftime('%Y-%m-%d_%H-%M-%S')}.mp4"
+            self.path = os.path.join(self.directory, name)
+            if not os.path.exists(self.path) and not os.path.exists(self._work_path()):
+                break
+            start += 1
+        writer = cv2.VideoWriter(self._work_path(), cv2.VideoWriter_fourcc(*CAMERA_INGEST_FOURCC), self.fps, size)
+        if not writer.isOpened():
+            raise RuntimeError(f"Unable to write {self._work_path()} with codec {CAMERA_INGEST_FOURCC}")
+        self._writer = writer
+        self._size = size
+        self._started_at = now
+
+    def _work_path(self) -> str:
+        return os.path.join(self.work_directory, os.path.basename(self.path))
+
+    # Segment being written, None between segments
+    @property
+    def recording(self) -> Optional[str]:
+        return self.path if self._writer is not None else None
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.release()
+        self._writer = None
+        try:
+            os.replace(self._work_path(), self.path)
+        except OSError as e:
+            logging.error(f"Camera {self.camera_id}: unable to finish segment {self.path}: {e}")
+            return
+        self.segments_written += 1
+        recording_catalog.register(self.camera_id, self.path)
+
+
+###########################################################################################
+################################### Reader ################################################
+###########################################################################################
+
+# One persistent reader per camera: keeps the stream open, publishes the latest frame, records it and
+# reconnects with exponential backoff. A local file works as a source too (played at its frame rate
+# and reopened at its end), which is how the ingest is tried without a camera.
+class CameraReader(threading.Thread):
+    def __init__(self, camera_id: int, source: str, record: Optional[bool] = None):
+        super().__init__(name=f"camera-ingest-{camera_id}", daemon=True)
+        self.camera_id = camera_id
+        self.source = source
+        self.record = CAMERA_INGEST_RECORD if record is None else record
+        self.is_file = os.path.isfile(source)
+
+        self.state = "starting"
+        self.fps = FRAME_HUB_DEFAULT_FPS
+        self.frames = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.connected_at = None
+        self.recorder = None
+
+        self._stop_event = threading.Event()
+        self._frame_ready = threading.Condition()
+        self._latest = None  # (frame, timestamp, sequence number)
+        self._encoded = {}  # (width, height, quality) -> (sequence number, jpeg), shared by the live viewers
+        self._encoded_lock = threading.Lock()
+
+    def _open(self):
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(CAMERA_INGEST_TIMEOUT_SECONDS * 1000),
+                  cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(CAMERA_INGEST_TIMEOUT_SECONDS * 1000)]
+        capture = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG, params)
+        if not capture.isOpened():
+            capture.release()
+            return None
+        return capture
+
+    def run(self):
+        backoff = CAMERA_INGEST_BACKOFF_MIN_SECONDS
+        while not self._stop_event.is_set():
+            self.state = "connecting"
+            capture = self._open()
+            if capture is None:
+                self.last_error = "Unable to open stream"
+            else:
+                fps = capture.get(cv2.CAP_PROP_FPS)
+                self.fps = fps if fps and 0 < fps <= 120 else FRAME_HUB_DEFAULT_FPS
+                try:
+                    if self._read(capture):
+                        backoff = CAMERA_INGEST_BACKOFF_MIN_SECONDS
+                except Exception as e:
+                    self.last_error = str(e)
+                    logging.error(f"Camera {self.camera_id}: reader failed: {e}")
+                finally:
+                    capture.release()
+                if self.is_file and self.last_error is None:
+                    # End of a local file: loop it right away, into the same segment
+                    continue
+
+            # A gap in the stream is a gap between segments
+            if self.recorder is not None:
+                self.recorder.close()
+            if self._stop_event.is_set():
+                break
+            self.state = "backoff"
+            self.reconnects += 1
+            logging.warning(f"Camera {self.camera_id}: {self.last_error}, reconnecting in {backoff:.0f}s")
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, CAMERA_INGEST_BACKOFF_MAX_SECONDS)
+        if self.recorder is not None:
+            self.recorder.close()
+        self.state = "stopped"
+
+    # Read until the stream ends, fails or the reader is stopped; True once frames came through
+    def _read(self, capture) -> bool:
+        received = False
+        frame_duration = 1 / self.fps
+        next_frame_at = time.monotonic()
+        if self.record and self.recorder is None:
+            self.recorder = SegmentRecorder(self.camera_id, self.fps)
+        elif self.recorder is not None:
+            self.recorder.fps = self.fps
+
+        while not self._stop_event.is_set():
+            success, frame = capture.read()
+            if not success:
+                if not (self.is_file and received):
+                    self.last_error = "Stream ended" if received else "No frames received"
+                return received
+            now = time.time()
+            if not received:
+                received = True
+                self.state = "streaming"
+                self.connected_at = datetime.now()
+                self.last_error = None
+                logging.info(f"Camera {self.camera_id}: streaming at {self.fps:.1f} fps")
+
+            with self._frame_ready:
+                self.frames += 1
+                self._latest = (frame, now, self.frames)
+                self._frame_ready.notify_all()
+            if self.recorder is not None:
+                self.recorder.write(frame, now)
+
+            if self.is_file:
+                # A camera delivers frames in real time, a file has to be paced
+                next_frame_at += frame_duration
+                delay = next_frame_at - time.monotonic()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+                else:
+                    next_frame_at = time.monotonic()
+        return received
+
+    def stop(self):
+        self._stop_event.set()
+        with self._frame_ready:
+            self._frame_ready.notify_all()
+
+    # Latest (frame, timestamp, sequence number), None before the first frame
+    def latest(self):
+        return self._latest
+
+    # Block until a frame newer than `after` arrives; None on timeout or stop
+    def wait_frame(self, after: int = 0, timeout: float = CAMERA_INGEST_TIMEOUT_SECONDS):
+        deadline = time.monotonic() + timeout
+        with self._frame_ready:
+            while not self._stop_event.is_set():
+                latest = self._latest
+                if latest is not None and latest[2] > after:
+                    return latest
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._frame_ready.wait(remaining)
+        return None
+
+    # JPEG of the latest frame, encoded once per frame and size/quality however many viewers ask
+    def latest_jpeg(self, width: int, height: int, quality: int):
+        latest = self._latest
+        if latest is None:
+            return None
+        frame, _, sequence = latest
+        key = (width, height, quality)
+        with self._encoded_lock:
+            encoded = self._encoded.get(key)
+        if encoded is not None and encoded[0] == sequence:
+            return encoded
+        encoded = (sequence, encode_jpeg(frame, width, height, quality))
+        with self._encoded_lock:
+            self._encoded[key] = encoded
+        return encoded
+
+    def status(self) -> dict:
+        latest = self._latest
+        return {
+            "camera_id": self.camera_id,
+            "source": self.source,
+            "state": self.state,
+            "fps": self.fps,
+            "frames": self.frames,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "connected_at": self.connected_at,
+            "last_frame_at": datetime.fromtimestamp(latest[1]) if latest else None,
+            "recording": self.recorder.recording if self.recorder is not None else None,
+            "segments_written": self.recorder.segments_written if self.recorder is not None else 0,
+        }
+
+
+###########################################################################################
+################################### Manager ###############################################
+###########################################################################################
+
+# Keeps one reader per enabled camera with an RTSP URL, in step with tbl_cameras
+class CameraIngestManager:
+    def __init__(self):
+        self.readers = {}
+        self._lock = threading.Lock()
+        self._sync_thread = None
+        self._sync_requested = threading.Event()
+        self._stopped = threading.Event()
+
+    # Start/stop/restart readers to match {camera_id: source} of the enabled cameras
+    def sync(self, sources: dict):
+        with self._lock:
+            for camera_id, reader in list(self.readers.items()):
+                if sources.get(camera_id) != reader.source:
+                    reader.stop()
+                    del self.readers[camera_id]
+                    logging.info(f"Camera {camera_id}: ingest stopped")
+            for camera_id, source in sources.items():
+                if camera_id not in self.readers:
+                    reader = self.readers[camera_id] = CameraReader(camera_id, source)
+                    reader.start()
+                    logging.info(f"Camera {camera_id}: ingest started from {source}")
+
+    def sync_from_db(self):
+        from db_configure import SessionLocal
+        from db_initialize import Camera
+
+        db = SessionLocal()
+        try:
+            cameras = db.query(Camera.id, Camera.cam_rtsp).filter(Camera.cam_enable.is_(True)).all()
+        finally:
+            db.close()
+        self.sync({camera.id: camera.cam_rtsp.strip() for camera in cameras if camera.cam_rtsp and camera.cam_rtsp.strip()})
+
+    # Follow tbl_cameras every CAMERA_INGEST_SYNC_SECONDS, or right away after request_sync()
+    def start(self):
+        if self._sync_thread is not None:
+            return
+        self._stopped.clear()
+        self._sync_thread = threading.Thread(target=self._sync_loop, name="camera-ingest-sync", daemon=True)
+        self._sync_thread.start()
+
+    def _sync_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.sync_from_db()
+            except Exception as e:
+                logging.error(f"Camera ingest: unable to read the camera list: {e}")
+            self._sync_requested.wait(CAMERA_INGEST_SYNC_SECONDS)
+            self._sync_requested.clear()
+
+    # Camera added, edited or deleted: pick it up now instead of at the next periodic sync
+    def request_sync(self):
+        self._sync_requested.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._sync_requested.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join(timeout=5)
+            self._sync_thread = None
+        with self._lock:
+            readers, self.readers = list(self.readers.values()), {}
+        for reader in readers:
+            reader.stop()
+        for reader in readers:
+            reader.join(timeout=CAMERA_INGEST_TIMEOUT_SECONDS)
+
+    def reader(self, camera_id: int) -> Optional[CameraReader]:
+        return self.readers.get(camera_id)
+
+    # Latest (frame, timestamp, sequence number) of a camera for analytics, None when it is not ingested
+    def latest_frame(self, camera_id: int):
+        reader = self.readers.get(camera_id)
+        return reader.latest() if reader is not None else None
+
+    def status(self) -> list:
+        return [reader.status() for reader in list(self.readers.values())]
+
+
+camera_ingest = CameraIngestManager()
+
+
+###########################################################################################
+################################### Live MJPEG ############################################
+###########################################################################################
+
+# Async iterator over a camera's live frames as JPEG, holding a stream slot. Viewers asking for the same
+# size/quality share each frame's encoding; a viewer slower than the camera just skips frames.
+class LiveFrameStream:
+    def __init__(self, reader: CameraReader, width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY,
+                 fps: Optional[float] = None):
+        # Closed until the slot is held, a 503 from acquire_stream_slot leaves nothing to release
+        self._closed = True
+        acquire_stream_slot()
+        self._closed = False
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.fps = fps
+        self._sequence = 0
+        self._next_frame_at = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        if self.fps and not self._closed:
+            if self._next_frame_at is None:
+                self._next_frame_at = loop.time()
+            delay = self._next_frame_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self._next_frame_at = loop.time()
+            self._next_frame_at += 1 / self.fps
+
+        # Poll for a newer frame on the event loop: waiting on the reader's condition would tie up a decode worker per viewer
+        deadline = loop.time() + CAMERA_INGEST_TIMEOUT_SECONDS
+        while not self._closed and loop.time() < deadline:
+            latest = self.reader.latest()
+            if latest is None or latest[2] <= self._sequence:
+                await asyncio.sleep(min(0.5, 0.5 / self.reader.fps))
+                continue
+            encoded = await loop.run_in_executor(_decode_executor, self.reader.latest_jpeg, self.width, self.height, self.quality)
+            if encoded is None or not encoded[1]:
+                continue
+            self._sequence = encoded[0]
+            return encoded[1]
+        self.close()
+        raise StopAsyncIteration
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            release_stream_slot()
+
+    def __del__(self):
+        self.close()
+
+
+# Live frames of a camera, 404 when it is not being ingested
+def live_frame_stream(camera_id: int, width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY,
+                      fps: Optional[float] = None) -> LiveFrameStream:
+    reader = camera_ingest.reader(camera_id)
+    if reader is None or reader.latest() is None:
+        raise HTTPException(status_code=404, detail=f"Camera {camera_id} is not streaming.")
+    return LiveFrameStream(reader, width, height, quality, fps)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the camera ingest: live readers and rolling recordings.")
+    parser.add_argument("--camera", action="append", default=[], metavar="ID=SOURCE",
+                        help="Ingest SOURCE (RTSP URL or local video file) as camera ID instead of reading tbl_cameras; repeatable")
+    parser.add_argument("--seconds", type=float, help="Stop after this long, default run until interrupted")
+    parser.add_argument("--no-record", action="store_true")
+    args = parser.parse_args()
+
+    if args.no_record:
+        CAMERA_INGEST_RECORD = False
+    if args.camera:
+        sources = {}
+        for item in args.camera:
+            camera_id, _, source = item.partition("=")
+            sources[int(camera_id)] = source
+        camera_ingest.sync(sources)
+    else:
+        camera_ingest.start()
+
+    started = time.monotonic()
+    try:
+        while args.seconds is None or time.monotonic() - started < args.seconds:
+            time.sleep(min(5.0, args.seconds or 5.0))
+            for status in camera_ingest.status():
+                logging.info(f"Camera {status['camera_id']}: {status['state']}, {status['frames']} frames, "
+                             f"{status['reconnects']} reconnects, {status['segments_written']} segments")
+    except KeyboardInterrupt:
+        pass
+    camera_ingest.stop()
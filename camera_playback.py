@@ -0,0 +1,167 @@
+import cv2
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException
+from frame_hub import (acquire_stream_slot, release_stream_slot, _decode_executor, FrameStep, AdaptiveLevel,
+                       read_frame, encode_jpeg, adaptive_quality, adaptive_fps, MJPEG_JPEG_QUALITY, FRAME_HUB_DEFAULT_FPS)
+from recording_catalog import recording_catalog, Recording, naive_local_time
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+
+# Recording playing at `moment`, or the first one starting after it when `moment` falls in a gap
+def find_playback_segment(camera_id: int, moment: datetime) -> Optional[Recording]:
+    recording = recording_catalog.covering(camera_id, moment)
+    if recording is not None:
+        return recording
+    following = recording_catalog.between(camera_id, moment, None)
+    return following[0] if following else None
+
+
+# MJPEG frames of a camera from a wall-clock time on: opens the segment covering it, seeks inside it
+# with CAP_PROP_POS_MSEC (keyframe seek plus a short decode, not a decode from frame 0) and carries
+# on into the following segments. Adaptive playback lowers its own quality and frame rate while the client
+# is behind schedule, the encoder is this viewer's alone.
+class CameraPlayback:
+    def __init__(self, camera_id: int, start: datetime, width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY,
+                 fps: Optional[float] = None, adaptive: bool = False):
+        self.camera_id = camera_id
+        self.start = naive_local_time(start)
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.target_fps = fps
+        self.adaptive = AdaptiveLevel() if adaptive else None
+        self.segment = None
+        self.fps = FRAME_HUB_DEFAULT_FPS
+        self._step = FrameStep(self.fps, fps)
+
+        self._capture = None
+        # Capture calls run in the decode executor; the lock keeps a release from racing a read
+        self._capture_lock = threading.Lock()
+        self._next_frame_at = None
+        self._closed = False
+        self._slot = False
+
+    # Runs in the decode executor
+    def _open_segment(self, segment: Recording, offset_ms: float) -> bool:
+        capture = cv2.VideoCapture(segment.path)
+        if not capture.isOpened():
+            capture.release()
+            return False
+        if offset_ms > 0:
+            capture.set(cv2.CAP_PROP_POS_MSEC, offset_ms)
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        with self._capture_lock:
+            if self._closed:
+                capture.release()
+                return False
+            if self._capture is not None:
+                self._capture.release()
+            self._capture = capture
+        self.segment = segment
+        self.fps = fps if fps and fps > 0 else FRAME_HUB_DEFAULT_FPS
+        self._step = FrameStep(self.fps, self._level_fps())
+        return True
+
+    # Target frame rate at the current adaptive level, None for the source's
+    def _level_fps(self) -> Optional[float]:
+        level = self.adaptive.level if self.adaptive is not None else 0
+        return adaptive_fps(self.target_fps or self.fps, level) if level or self.target_fps else None
+
+    # Runs in the decode executor
+    def _decode_next(self):
+        with self._capture_lock:
+            if self._capture is None:
+                return None
+            frame = read_frame(self._capture, self._step.next())
+        if frame is None:
+            return None
+        level = self.adaptive.level if self.adaptive is not None else 0
+        return encode_jpeg(frame, self.width, self.height, adaptive_quality(self.quality, level))
+
+    def _release(self):
+        with self._capture_lock:
+            if self._capture is not None:
+                self._capture.release()
+                self._capture = None
+
+    # Locate and open the first segment; 404 when the camera has nothing at or after `start`.
+    # The catalog lookup lists the directory and may probe a file, so it runs in the decode executor too.
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        segment = await loop.run_in_executor(_decode_executor, find_playback_segment, self.camera_id, self.start)
+        if segment is None:
+            raise HTTPException(status_code=404, detail=f"No recording of camera {self.camera_id} at or after {self.start}.")
+
+        acquire_stream_slot()
+        self._slot = True
+        offset_ms = max(0.0, (self.start - segment.start).total_seconds() * 1000)
+        if not await loop.run_in_executor(_decode_executor, self._open_segment, segment, offset_ms):
+            self.close()
+            raise HTTPException(status_code=500, detail="Unable to open video file.")
+
+    # Move on to the segment after the current one, False at the end of the recordings
+    async def _advance(self) -> bool:
+        loop = asyncio.get_running_loop()
+        segment = self.segment
+        while True:
+            segment = await loop.run_in_executor(_decode_executor, recording_catalog.next_after, segment)
+            if segment is None:
+                return False
+            if await loop.run_in_executor(_decode_executor, self._open_segment, segment, 0):
+                return True
+            logging.warning(f"Playback: skipping unreadable segment {segment.path}")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        while not self._closed:
+            jpeg = await loop.run_in_executor(_decode_executor, self._decode_next)
+            if jpeg is None:
+                # End of this segment (or a seek past its end): stitch the next one on
+                if not await self._advance():
+                    break
+                continue
+            if not jpeg:
+                continue
+
+            # Pace to the segment's (or the requested) frame rate
+            if self._next_frame_at is None:
+                self._next_frame_at = loop.time()
+            delay = self._next_frame_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self._next_frame_at = loop.time()
+            if self.adaptive is not None:
+                late = int(-delay * self._step.output_fps) if delay < 0 else 0
+                if self.adaptive.record(loop.time(), late):
+                    self._step.set_target(self._level_fps())
+            self._next_frame_at += 1 / self._step.output_fps
+            return jpeg
+
+        self.close()
+        raise StopAsyncIteration
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._slot:
+            release_stream_slot()
+        if self._capture is not None:
+            try:
+                _decode_executor.submit(self._release)
+            except RuntimeError:
+                # Executor already shut down (interpreter exit)
+                self._release()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncGenerator
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from service_functions import dashboard_snapshot_sections
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+DASHBOARD_LIVE_TICK_SECONDS = float(os.getenv("DASHBOARD_LIVE_TICK_SECONDS", 5))  # One aggregation per tick, whatever the subscriber count
+DASHBOARD_LIVE_QUEUE_SIZE = int(os.getenv("DASHBOARD_LIVE_QUEUE_SIZE", 8))  # Messages buffered per subscriber, an overflowing one is resynced
+DASHBOARD_LIVE_KEEPALIVE_SECONDS = float(os.getenv("DASHBOARD_LIVE_KEEPALIVE_SECONDS", 15))  # Idle connections get a keep-alive this often
+DASHBOARD_LIVE_MAX_SUBSCRIBERS = int(os.getenv("DASHBOARD_LIVE_MAX_SUBSCRIBERS", 500))  # Per worker, more get 503
+
+_UNCHANGED = object()
+
+
+# JSON Merge Patch (RFC 7386) turning `old` into `new`: objects are patched key by key (null removes a
+# key), anything else is replaced whole. _UNCHANGED when they are equal.
+def merge_patch_diff(old, new):
+    if old == new:
+        return _UNCHANGED
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    patch = {key: None for key in old if key not in new}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+            continue
+        diff = merge_patch_diff(old[key], value)
+        if diff is not _UNCHANGED:
+            patch[key] = diff
+    return patch
+
+
+# One aggregator per worker: every DASHBOARD_LIVE_TICK_SECONDS it runs the dashboard snapshot queries
+# once (on a read replica when configured) and pushes the change to all subscribers as a merge patch.
+# New subscribers start from the last full snapshot. Messages are (event, version, data) with data
+# serialized once per tick and shared by every subscriber. The aggregator runs only while someone listens.
+class DashboardLive:
+    def __init__(self):
+        self.queues = set()
+        self.sections = None
+        self.version = 0
+        self.generated_at = None
+        self.ticks = 0
+        self.errors = 0
+        self.resyncs = 0
+        self.last_tick_ms = None
+        self._snapshot_message = None
+        self._task = None
+
+    def _snapshot(self):
+        # Serialized lazily: only new or resynced subscribers need it
+        if self._snapshot_message is None or self._snapshot_message[1] != self.version:
+            data = json.dumps({"version": self.version, "generated_at": self.generated_at, "sections": self.sections})
+            self._snapshot_message = ("snapshot", self.version, data)
+        return self._snapshot_message
+
+    async def _aggregate(self):
+        loop = asyncio.get_running_loop()
+        while self.queues:
+            started = loop.time()
+            try:
+                sections, timings = await dashboard_snapshot_sections()
+                self._publish(jsonable_encoder(sections))
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Live dashboard aggregation failed: {e}")
+            self.ticks += 1
+            self.last_tick_ms = round((loop.time() - started) * 1000, 1)
+            await asyncio.sleep(max(0.0, DASHBOARD_LIVE_TICK_SECONDS - (loop.time() - started)))
+        # Checked and cleared without an await in between: a subscriber arriving later starts a new task
+        self._task = None
+
+    def _publish(self, sections: dict):
+        previous = self.sections
+        patch = merge_patch_diff(previous, sections) if previous is not None else _UNCHANGED
+        if previous is not None and patch is _UNCHANGED:
+            return
+        self.sections = sections
+        self.version += 1
+        self.generated_at = datetime.now().isoformat()
+        if previous is None:
+            message = self._snapshot()
+        else:
+            message = ("delta", self.version, json.dumps({"version": self.version, "generated_at": self.generated_at, "patch": patch}))
+        for queue in self.queues:
+            self._put(queue, message)
+
+    def _put(self, queue: asyncio.Queue, message):
+        # A subscriber that cannot keep up drops its backlog and gets the current state in one message
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            self.resyncs += 1
+            message = self._snapshot()
+        queue.put_nowait(message)
+
+    def subscribe(self) -> "DashboardSubscription":
+        if len(self.queues) >= DASHBOARD_LIVE_MAX_SUBSCRIBERS:
+            raise HTTPException(status_code=503, detail="Too many live dashboard connections, try again later.")
+        queue = asyncio.Queue(maxsize=DASHBOARD_LIVE_QUEUE_SIZE)
+        if self.sections is not None:
+            queue.put_nowait(self._snapshot())
+        self.queues.add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._aggregate())
+        return DashboardSubscription(self, queue)
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        # The aggregator stops at its next tick once nobody is left
+        self.queues.discard(queue)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.queues),
+            "running": self._task is not None,
+            "tick_seconds": DASHBOARD_LIVE_TICK_SECONDS,
+            "version": self.version,
+            "ticks": self.ticks,
+            "errors": self.errors,
+            "last_tick_ms": self.last_tick_ms,
+            "resyncs": self.resyncs,
+        }
+
+
+# Async iterator over one subscriber's messages, (None, None, None) when idle for a keep-alive interval
+class DashboardSubscription:
+    def __init__(self, live: DashboardLive, queue: asyncio.Queue):
+        self.live = live
+        self._queue = queue
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=DASHBOARD_LIVE_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            return None, None, None
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.live.unsubscribe(self._queue)
+
+    def __del__(self):
+        self.close()
+
+
+dashboard_live = DashboardLive()
+
+
+# Server-Sent Events body for StreamingResponse, closed when the client goes away
+async def dashboard_sse_stream(subscription: DashboardSubscription) -> AsyncGenerator:
+    try:
+        # Reconnecting EventSource clients wait this long (ms) before retrying
+        yield f"retry: {int(DASHBOARD_LIVE_TICK_SECONDS * 1000)}\n\n"
+        async for event, version, data in subscription:
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event}\nid: {version}\ndata: {data}\n\n"
+    finally:
+        subscription.close()
+
+
+# WebSocket loop: the same messages as JSON text frames {"event": ..., "data": {...}}
+async def dashboard_websocket_loop(websocket, subscription: DashboardSubscription):
+    try:
+        async for event, version, data in subscription:
+            if event is None:
+                await websocket.send_text('{"event": "keep-alive"}')
+            else:
+                await websocket.send_text(f'{{"event": "{event}", "data": {data}}}')
+    finally:
+        subscription.close()
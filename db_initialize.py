@@ -1,5 +1,5 @@
 import logging
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Float, inspect, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Float, inspect, ForeignKey, UniqueConstraint, Index, DDL, event
 from sqlalchemy.orm import Session, relationship
 from db_configure import engine, Base  # Import engine and Base from db_configure
 from enum import Enum
@@ -30,6 +30,20 @@ class Account(Base):
 # Define the Visitor Model
 class Visitor(Base):
     __tablename__ = 'tbl_visitors'
+    __table_args__ = (
+        # Date range scans (slot times, monitoring, reports) read only the included columns
+        Index('ix_visitors_datetime_id', 'current_datetime', 'id',
+              postgresql_include=['counter_id', 'person_id', 'person_duration_in_roi', 'person_age_group', 'person_gender']),
+        # Per-counter reports and totals
+        Index('ix_visitors_counter_datetime', 'counter_id', 'current_datetime',
+              postgresql_include=['person_id', 'person_duration_in_roi', 'person_age_group']),
+        # Exhibition join/filter of the visitor report and exports
+        Index('ix_visitors_exhibition_datetime', 'exhibition_id', 'current_datetime'),
+        # Tiny block-range index for wide time ranges over append-only data
+        Index('ix_visitors_datetime_brin', 'current_datetime', postgresql_using='brin'),
+        # Range partitioned by day or month, partitions are managed by visitor_partitions.py
+        {'postgresql_partition_by': 'RANGE (current_datetime)'},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     person_id = Column(Integer)
@@ -39,7 +53,7 @@ class Visitor(Base):
     person_duration_in_roi = Column(Float, nullable=False)
     person_age_group = Column(String)
     person_gender = Column(String)    
-    current_datetime = Column(DateTime, nullable=False)
+    current_datetime = Column(DateTime, primary_key=True, nullable=False)  # Partition key must be part of the primary key
 
     # The field to link to the Exhibition table
     exhibition_id = Column(Integer, ForeignKey('tbl_exhibitions.id'), nullable=True)
@@ -47,6 +61,13 @@ class Visitor(Base):
     # Relationship to the Exhibition class
     exhibition = relationship("Exhibition", back_populates="visitors")
 
+# Rows outside every dated partition land in the default partition, so inserts never fail
+event.listen(
+    Visitor.__table__,
+    'after_create',
+    DDL("CREATE TABLE IF NOT EXISTS tbl_visitors_default PARTITION OF tbl_visitors DEFAULT").execute_if(dialect='postgresql')
+)
+
 # Define the Camera Model
 class Camera(Base):
     __tablename__ = 'tbl_cameras'
@@ -131,6 +152,43 @@ class Exhibition(Base):
     visitors = relationship("Visitor", back_populates="exhibition")
 
 
+# Define the Visitor Rollup Model (pre-aggregated visitor rows per hour/day bucket)
+class VisitorRollup(Base):
+    __tablename__ = 'tbl_visitor_rollups'
+    __table_args__ = (
+        UniqueConstraint('granularity', 'bucket_start', 'dim_key', name='uq_visitor_rollups_bucket_dims'),
+        Index('ix_visitor_rollups_granularity_bucket', 'granularity', 'bucket_start'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    granularity = Column(String(8), nullable=False)  # 'hour' or 'day'
+    bucket_start = Column(DateTime, nullable=False)  # Start of the hour/day bucket
+
+    # Dimensions copied from tbl_visitors
+    counter_id = Column(Integer)
+    cam_id = Column(Integer)
+    roi_id = Column(Integer)
+    exhibition_id = Column(Integer)
+    person_age_group = Column(String)
+    person_gender = Column(String)
+    dim_key = Column(String, nullable=False)  # All dimensions joined with '|', NULL as ''
+
+    # Aggregates of the visitor rows in the bucket
+    row_count = Column(Integer, nullable=False, default=0)  # count(*)
+    visitor_count = Column(Integer, nullable=False, default=0)  # count(person_id)
+    total_duration = Column(Float, nullable=False, default=0)
+    min_duration = Column(Float)
+    max_duration = Column(Float)
+
+
+# Define the Visitor Rollup State Model (set once the rollups were backfilled from history)
+class VisitorRollupState(Base):
+    __tablename__ = 'tbl_visitor_rollup_state'
+
+    id = Column(Integer, primary_key=True)
+    backfilled_at = Column(DateTime, nullable=False)
+
+
 # Function to list all existing tables
 def list_tables():
     inspector = inspect(engine)
@@ -160,6 +218,7 @@ def initialize_db():
 
 
 
+# Use db_migrate.py to update an existing database without dropping its data
 if __name__ == "__main__":
     drop_all_tables()  # Call to drop all tables
     initialize_db()  # Call to initialize the database
@@ -0,0 +1,203 @@
+import argparse
+import logging
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from db_configure import engine
+from db_initialize import Base
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+###########################################################################################
+################################### Migration #############################################
+###########################################################################################
+
+# Names of indexes left INVALID by an interrupted CREATE INDEX CONCURRENTLY
+def _invalid_indexes(connection):
+    rows = connection.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    ))
+    return {row[0] for row in rows}
+
+
+# Names of the partitioned (parent) tables
+def _partitioned_tables(connection):
+    rows = connection.execute(text(
+        "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid"
+    ))
+    return {row[0] for row in rows}
+
+
+# Names of the partitions attached to a partitioned table
+def _partitions_of(connection, table_name: str):
+    rows = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table_name AS regclass) ORDER BY c.relname"
+    ), {"table_name": table_name})
+    return [row[0] for row in rows]
+
+
+# CONCURRENTLY is not allowed on a partitioned table: create the parent index ON ONLY the parent,
+# build each partition's index concurrently and attach it, which makes the parent index valid
+def _create_partitioned_index(connection, table, index, ddl: str, dry_run: bool):
+    statements = [ddl.replace(f" ON {table.name} ", f" ON ONLY {table.name} ", 1)]
+    for partition in _partitions_of(connection, table.name):
+        partition_index = f"{partition}_{index.name}"[:63]
+        partition_ddl = ddl.replace(f" {index.name} ON {table.name} ", f" {partition_index} ON {partition} ", 1)
+        statements.append(partition_ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1))
+        statements.append(f'ALTER INDEX "{index.name}" ATTACH PARTITION "{partition_index}"')
+
+    for statement in statements:
+        logger.info(statement)
+        if not dry_run:
+            connection.execute(text(statement))
+
+
+# Bring a live database up to the models without dropping anything:
+# create missing tables, then build missing indexes concurrently (no write lock on the table)
+def migrate(dry_run: bool = False):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    missing_tables = [table for table in Base.metadata.sorted_tables if table.name not in existing_tables]
+    for table in missing_tables:
+        logger.info(f"Creating table {table.name}")
+    if missing_tables and not dry_run:
+        # New tables are empty, their indexes are created together with them
+        Base.metadata.create_all(bind=engine, tables=missing_tables)
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        invalid_indexes = _invalid_indexes(connection)
+        partitioned_tables = _partitioned_tables(connection)
+
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name in existing_indexes and index.name not in invalid_indexes:
+                    continue
+
+                if index.name in invalid_indexes:
+                    logger.info(f"Rebuilding invalid index {index.name} on {table.name}")
+                    if not dry_run:
+                        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+
+                ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                if table.name in partitioned_tables:
+                    _create_partitioned_index(connection, table, index, ddl, dry_run)
+                else:
+                    ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+                    ddl = ddl.replace("CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX CONCURRENTLY", 1)
+                    logger.info(ddl)
+                    if not dry_run:
+                        connection.execute(text(ddl))
+                if not dry_run:
+                    connection.execute(text(f'ANALYZE "{table.name}"'))
+
+    logger.info("Migration finished." if not dry_run else "Dry run finished, nothing was changed.")
+
+
+###########################################################################################
+################################ Sequential scan check ####################################
+###########################################################################################
+
+# Dashboard and report services checked by --explain, keyed by the endpoint that serves them
+def _endpoint_checks():
+    import service_functions as sf
+
+    date_range = {"start_date": "2024-01-01 00:00:00", "end_date": "2100-01-01 00:00:00"}
+    return {
+        "/total_visitors": lambda db: sf.get_total_visitors(db),
+        "/least_visited_counter": lambda db: sf.least_visited_counter(db),
+        "/most_visited_counter_no_slot_time_for_latest_date": lambda db: sf.most_visited_counter_no_slot_time_for_latest_date_func(db),
+        "/most_visited_counter_for_each_slot_time_in_latest_date": lambda db: sf.most_visited_counter_for_each_slot_time_in_latest_date_func(db),
+        "/most_visited_counter_for_latest_date_slot_time": lambda db: sf.most_visited_counter_for_latest_date_slot_time_func(db),
+        "/minimum_visited_counter_for_latest_date_slot_time": lambda db: sf.minimum_visited_counter_for_latest_date_slot_time_func(db),
+        "/age_monitoring": lambda db: (sf.clear_monitoring_cache(), sf.age_monitoring(date_range, db)),
+        "/gender_monitoring": lambda db: (sf.clear_monitoring_cache(), sf.gender_monitoring(date_range, db)),
+        "/report_visitor_table/": lambda db: sf.get_visitor_records_page(db, "2024-01-01", "2024-01-08", include_total=True),
+        "/report_people_count_per_counter/": lambda db: sf.get_people_count_per_counter(db, "2024-01-01", "2024-01-08"),
+        "/report_people_duration_per_counter/": lambda db: sf.get_people_duration_per_counter(db, "2024-01-01", "2024-01-08"),
+        "/report_details_of_selected_counter/{counter_id}": lambda db: sf.report_details_of_selected_counter(db, 1),
+    }
+
+
+# Collect the relations read by Seq Scan nodes of a JSON plan
+def _seq_scanned_relations(plan_node):
+    relations = []
+    if plan_node.get("Node Type") == "Seq Scan":
+        relations.append(plan_node.get("Relation Name"))
+    for child in plan_node.get("Plans", []):
+        relations.extend(_seq_scanned_relations(child))
+    return relations
+
+
+# Run a service function and return the SELECT statements (with parameters) it issued
+def capture_selects(connection, db: Session, check):
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", capture)
+    try:
+        check(db)
+    except Exception as e:
+        # 404s for empty ranges still issued their queries
+        logger.debug(f"Checked service raised {e}")
+    finally:
+        event.remove(connection, "before_cursor_execute", capture)
+    return captured
+
+
+# JSON plan (top node) of a captured statement
+def explain_statement(connection, statement: str, parameters):
+    plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    return plan[0]["Plan"]
+
+
+# Run every endpoint's service function, EXPLAIN each SELECT it issued and report sequential scans
+def explain_endpoints(tables=("tbl_visitors",)):
+    report = {}
+
+    with engine.connect() as connection:
+        db = Session(bind=connection)
+        try:
+            for endpoint, check in _endpoint_checks().items():
+                statements = capture_selects(connection, db, check)
+
+                seq_scans = []
+                for statement, parameters in statements:
+                    for relation in _seq_scanned_relations(explain_statement(connection, statement, parameters)):
+                        # Partitions of a listed table count as the table itself
+                        if any(relation == table or relation.startswith(table + "_") for table in tables):
+                            seq_scans.append(relation)
+
+                report[endpoint] = {"queries": len(statements), "seq_scans": seq_scans}
+        finally:
+            db.rollback()
+            db.close()
+
+    for endpoint, result in report.items():
+        status = "SEQ SCAN on " + ", ".join(sorted(set(result["seq_scans"]))) if result["seq_scans"] else "ok"
+        logger.info(f"{endpoint}: {result['queries']} queries, {status}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema changes to a live database without dropping tables.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be created")
+    parser.add_argument("--explain", action="store_true", help="Report endpoints whose queries sequentially scan tbl_visitors")
+    args = parser.parse_args()
+
+    if args.explain:
+        explain_endpoints()
+    else:
+        migrate(dry_run=args.dry_run)
@@ -0,0 +1,153 @@
+import os
+import stat
+import anyio
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Containers of the recordings, mimetypes does not know all of them everywhere
+mimetypes.add_type("video/mp4", ".mp4")
+mimetypes.add_type("video/x-msvideo", ".avi")
+mimetypes.add_type("video/x-matroska", ".mkv")
+
+FILE_CHUNK_SIZE = int(os.getenv("FILE_CHUNK_SIZE", 256 * 1024))  # Read size when the server has no zero-copy send
+
+
+# Strong validator from size and mtime, same file same ETag on every worker
+def file_etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+# Parse a Range header against the file size.
+# Returns (start, end) inclusive, None to send the whole file, or raises 416 when the range cannot be satisfied.
+def parse_range_header(range_header: str, size: int):
+    units, _, ranges = range_header.partition("=")
+    if units.strip().lower() != "bytes" or "," in ranges:
+        # Other units and multi-range requests are answered with the whole file (allowed by RFC 9110)
+        return None
+
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            end = min(end, size - 1)
+            if start > end:
+                raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable.",
+                            headers={"Content-Range": f"bytes */{size}"})
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable.",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+# If-None-Match / If-Modified-Since: True when the client's copy is current (304)
+def _not_modified(request: Request, etag: str, stat_result: os.stat_result) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# If-Range: the range only applies while the client's validator still matches
+def _if_range_matches(request: Request, etag: str, last_modified: str) -> bool:
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+# File (or byte range) response. Uses the ASGI zero-copy send extension when the server offers it,
+# otherwise reads the range off the event loop in FILE_CHUNK_SIZE blocks.
+class RangeFileResponse(Response):
+    def __init__(self, path: str, status_code: int, headers: dict, media_type: str, start: int = 0, length: int = 0):
+        self.path = path
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.start = start
+        self.length = length
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file.fileno(),
+                            "offset": self.start, "count": self.length, "more_body": False})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file shrank under us, end the body anyway
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+# Serve a file with Range (206), ETag/Last-Modified validation (304) and its MIME type
+def file_response(request: Request, path: str, media_type: Optional[str] = None) -> Response:
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    size = stat_result.st_size
+    etag = file_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache"}
+
+    if _not_modified(request, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and _if_range_matches(request, etag, last_modified):
+        byte_range = parse_range_header(range_header, size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return RangeFileResponse(path, 200, headers, media_type, 0, size)
+
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return RangeFileResponse(path, 206, headers, media_type, start, end - start + 1)
+
+
+# Resolve a client supplied path under a root directory, 404 for anything outside it
+def safe_join(root: str, relative_path: str) -> str:
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=404, detail="File not found")
+    return path
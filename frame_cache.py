@@ -0,0 +1,282 @@
+import os
+import cv2
+import json
+import mmap
+import time
+import asyncio
+import hashlib
+import argparse
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from frame_hub import acquire_stream_slot, release_stream_slot, FrameStep, AdaptiveLevel, adaptive_fps, MJPEG_JPEG_QUALITY, FRAME_HUB_DEFAULT_FPS
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+# Encoded-frame cache of the recorded videos
+FRAME_CACHE_ENABLED = os.getenv("FRAME_CACHE_ENABLED", "1") != "0"
+FRAME_CACHE_DIR = os.getenv("FRAME_CACHE_DIR", "FrameCache")
+FRAME_CACHE_MAX_BYTES = int(os.getenv("FRAME_CACHE_MAX_BYTES", 2 * 1024 ** 3))  # LRU eviction above this total
+FRAME_CACHE_MIN_AGE_SECONDS = int(os.getenv("FRAME_CACHE_MIN_AGE_SECONDS", 60))  # Files still being recorded are not cached
+FRAME_CACHE_BUILD_WORKERS = int(os.getenv("FRAME_CACHE_BUILD_WORKERS", 1))
+
+# Cache builds decode whole files, kept apart from the live-stream decode executor
+_build_executor = ThreadPoolExecutor(max_workers=FRAME_CACHE_BUILD_WORKERS, thread_name_prefix="frame-cache")
+_building = set()
+_building_lock = threading.Lock()
+
+# Open caches, shared by every viewer of an entry
+_open_entries = {}
+_open_entries_lock = threading.Lock()
+
+
+# Cache entry name for a video at a size/quality; the file's size and mtime are part of it,
+# so a re-recorded file never serves stale frames
+def frame_cache_key(video_path: str, width: int, height: int, quality: int) -> Optional[str]:
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+    source = f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}|{width}x{height}|q{quality}"
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def _entry_paths(key: str):
+    base = os.path.join(FRAME_CACHE_DIR, key)
+    return base + ".jpgs", base + ".idx.npy", base + ".json"
+
+
+###########################################################################################
+################################### Build / evict #########################################
+###########################################################################################
+
+# Decode a whole video once into one blob of JPEG frames plus an offsets index.
+# The index is renamed into place last, an entry without it is incomplete and ignored.
+def build_frame_cache(video_path: str, width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY) -> Optional[str]:
+    key = frame_cache_key(video_path, width, height, quality)
+    if key is None:
+        return None
+    blob_path, index_path, meta_path = _entry_paths(key)
+    if os.path.exists(index_path):
+        return key
+
+    with _building_lock:
+        if key in _building:
+            return None
+        _building.add(key)
+
+    os.makedirs(FRAME_CACHE_DIR, exist_ok=True)
+    capture = cv2.VideoCapture(video_path)
+    try:
+        if not capture.isOpened():
+            logging.warning(f"Frame cache: unable to open {video_path}")
+            return None
+        fps = capture.get(cv2.CAP_PROP_FPS) or FRAME_HUB_DEFAULT_FPS
+
+        started = time.monotonic()
+        offsets = [0]
+        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        with open(blob_path + ".tmp", "wb") as blob:
+            while True:
+                success, frame = capture.read()
+                if not success:
+                    break
+                if frame.shape[1] != width or frame.shape[0] != height:
+                    frame = cv2.resize(frame, (width, height))
+                encoded, buffer = cv2.imencode('.jpg', frame, encode_params)
+                if encoded:
+                    blob.write(buffer.data)
+                    offsets.append(offsets[-1] + buffer.nbytes)
+
+        if len(offsets) == 1:
+            os.remove(blob_path + ".tmp")
+            return None
+
+        with open(meta_path, "w") as meta:
+            json.dump({"source": os.path.abspath(video_path), "width": width, "height": height,
+                       "quality": quality, "fps": fps, "frames": len(offsets) - 1}, meta)
+        os.replace(blob_path + ".tmp", blob_path)
+        np.save(index_path + ".tmp.npy", np.asarray(offsets, dtype=np.int64))
+        os.replace(index_path + ".tmp.npy", index_path)
+
+        logging.info(f"Frame cache: {video_path} -> {len(offsets) - 1} frames, "
+                     f"{offsets[-1] / 1024 ** 2:.1f} MiB in {time.monotonic() - started:.1f}s")
+    finally:
+        capture.release()
+        with _building_lock:
+            _building.discard(key)
+
+    evict_frame_cache()
+    return key
+
+
+# Drop the least recently viewed entries until the cache fits in FRAME_CACHE_MAX_BYTES
+def evict_frame_cache(max_bytes: int = FRAME_CACHE_MAX_BYTES):
+    if not os.path.isdir(FRAME_CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(FRAME_CACHE_DIR):
+        if not name.endswith(".idx.npy"):
+            continue
+        key = name[:-len(".idx.npy")]
+        paths = _entry_paths(key)
+        size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+        # The index mtime is touched on every view
+        entries.append((os.path.getmtime(paths[1]), size, key))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        # Streams still reading an evicted entry keep their mapping until they finish
+        with _open_entries_lock:
+            _open_entries.pop(key, None)
+        for path in _entry_paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+        total -= size
+        logging.info(f"Frame cache: evicted {key} ({size / 1024 ** 2:.1f} MiB)")
+
+
+# Build the cache of every recording under a directory ahead of the first view
+def warm_frame_cache(videos_directory: str = "Videos", width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY) -> int:
+    built = 0
+    for root, _, files in os.walk(videos_directory):
+        for name in sorted(files):
+            if not name.endswith(('.mp4', '.avi')):
+                continue
+            path = os.path.join(root, name)
+            if time.time() - os.path.getmtime(path) < FRAME_CACHE_MIN_AGE_SECONDS:
+                continue
+            if build_frame_cache(path, width, height, quality):
+                built += 1
+    return built
+
+
+# Build in the background, at most once per entry at a time
+def schedule_frame_cache_build(video_path: str, width: int, height: int, quality: int):
+    key = frame_cache_key(video_path, width, height, quality)
+    with _building_lock:
+        if key is None or key in _building:
+            return
+    _build_executor.submit(build_frame_cache, video_path, width, height, quality)
+
+
+###########################################################################################
+################################### Replay ################################################
+###########################################################################################
+
+# A cached video mapped read-only: frame i is a zero-copy memoryview into the mapping
+class CachedFrames:
+    def __init__(self, key: str):
+        blob_path, index_path, meta_path = _entry_paths(key)
+        with open(meta_path) as meta:
+            self.meta = json.load(meta)
+        self.offsets = np.load(index_path)
+        with open(blob_path, "rb") as blob:
+            self._mmap = mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self.fps = self.meta["fps"]
+        self.frame_count = len(self.offsets) - 1
+
+    def frame(self, index: int) -> memoryview:
+        return self._view[int(self.offsets[index]):int(self.offsets[index + 1])]
+
+
+# The cached frames of a video, or None (and a background build) when it is not cached yet
+def open_cached_frames(video_path: str, width: int, height: int, quality: int) -> Optional[CachedFrames]:
+    if not FRAME_CACHE_ENABLED:
+        return None
+    key = frame_cache_key(video_path, width, height, quality)
+    if key is None:
+        return None
+
+    index_path = _entry_paths(key)[1]
+    with _open_entries_lock:
+        cached = _open_entries.get(key)
+        if cached is None and os.path.exists(index_path):
+            try:
+                cached = _open_entries[key] = CachedFrames(key)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Frame cache: unreadable entry {key}: {e}")
+                cached = None
+
+    if cached is not None:
+        try:
+            os.utime(index_path)  # LRU position
+        except OSError:
+            pass
+        return cached
+
+    if time.time() - os.path.getmtime(video_path) >= FRAME_CACHE_MIN_AGE_SECONDS:
+        schedule_frame_cache_build(video_path, width, height, quality)
+    return None
+
+
+# Async iterator replaying cached frames at the recorded frame rate (or `fps`, skipping frames), holding a stream slot.
+# Adaptive streams lower the frame rate while the client is behind schedule; the quality is the entry's.
+class CachedFrameStream:
+    def __init__(self, cached: CachedFrames, fps: Optional[float] = None, adaptive: bool = False):
+        # Closed until the slot is held, a 503 from acquire_stream_slot leaves nothing to release
+        self._closed = True
+        acquire_stream_slot()
+        self._closed = False
+        self.cached = cached
+        self.target_fps = fps
+        self.adaptive = AdaptiveLevel() if adaptive else None
+        self._step = FrameStep(cached.fps, fps)
+        self._index = 0
+        self._next_frame_at = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> memoryview:
+        if self._closed or self._index >= self.cached.frame_count:
+            self.close()
+            raise StopAsyncIteration
+
+        loop = asyncio.get_running_loop()
+        if self._next_frame_at is None:
+            self._next_frame_at = loop.time()
+        delay = self._next_frame_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            self._next_frame_at = loop.time()
+        if self.adaptive is not None:
+            late = int(-delay * self._step.output_fps) if delay < 0 else 0
+            if self.adaptive.record(loop.time(), late):
+                self._step.set_target(adaptive_fps(self.target_fps or self.cached.fps, self.adaptive.level)
+                                      if self.adaptive.level or self.target_fps else None)
+        self._next_frame_at += 1 / self._step.output_fps
+
+        frame = self.cached.frame(self._index)
+        self._index += self._step.next()
+        return frame
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            release_stream_slot()
+
+    def __del__(self):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-encode the recorded videos into the frame cache.")
+    parser.add_argument("--videos", default="Videos")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--quality", type=int, default=MJPEG_JPEG_QUALITY)
+    parser.add_argument("--evict", action="store_true", help="Only apply the size limit")
+    args = parser.parse_args()
+
+    if args.evict:
+        evict_frame_cache()
+    else:
+        logging.info(f"Built {warm_frame_cache(args.videos, args.width, args.height, args.quality)} cache entries in {FRAME_CACHE_DIR}")
@@ -0,0 +1,529 @@
+import os
+import cv2
+import time
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Optional
+from urllib.parse import urlsplit
+from fastapi import HTTPException
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+# MJPEG encoding and hub settings
+MJPEG_JPEG_QUALITY = int(os.getenv("MJPEG_JPEG_QUALITY", 95))  # OpenCV's imencode default
+MJPEG_DECODE_WORKERS = int(os.getenv("MJPEG_DECODE_WORKERS", os.cpu_count() or 2))  # Threads doing read/resize/encode
+MJPEG_MAX_STREAMS = int(os.getenv("MJPEG_MAX_STREAMS", 64))  # Concurrent viewers per worker, more get 503
+MJPEG_QUEUE_SIZE = int(os.getenv("MJPEG_QUEUE_SIZE", 2))  # Frames buffered per viewer, older ones are dropped
+FRAME_HUB_WAIT_SECONDS = float(os.getenv("FRAME_HUB_WAIT_SECONDS", 5))  # A viewer ends if its source stalls this long
+FRAME_HUB_DEFAULT_FPS = 25.0  # Used when the container does not report a frame rate
+
+# Adaptive streams step down a level (half the frame rate, 20 less JPEG quality) when the client falls behind
+MJPEG_ADAPTIVE_LEVELS = int(os.getenv("MJPEG_ADAPTIVE_LEVELS", 4))  # Full rate plus three degraded levels
+MJPEG_ADAPTIVE_WINDOW_SECONDS = float(os.getenv("MJPEG_ADAPTIVE_WINDOW_SECONDS", 2))
+MJPEG_ADAPTIVE_LATE_RATIO = float(os.getenv("MJPEG_ADAPTIVE_LATE_RATIO", 0.2))  # Share of dropped/late frames in a window that steps down
+MJPEG_ADAPTIVE_RECOVER_SECONDS = float(os.getenv("MJPEG_ADAPTIVE_RECOVER_SECONDS", 10))  # Time without drops before stepping back up
+MJPEG_ADAPTIVE_MIN_QUALITY = int(os.getenv("MJPEG_ADAPTIVE_MIN_QUALITY", 30))
+MJPEG_ADAPTIVE_MIN_FPS = float(os.getenv("MJPEG_ADAPTIVE_MIN_FPS", 2))
+
+# OpenCV releases the GIL while decoding/encoding, so a small pool keeps every core busy
+# without tying up Starlette's threadpool, which keeps serving the other endpoints
+_decode_executor = ThreadPoolExecutor(max_workers=MJPEG_DECODE_WORKERS, thread_name_prefix="mjpeg-decode")
+
+
+# One multipart/x-mixed-replace part (boundary=frame)
+MJPEG_PART_HEADER = (b'--frame\r\n'
+                     b'Content-Type: image/jpeg\r\n\r\n')
+
+
+def mjpeg_part(jpeg: bytes) -> bytes:
+    return MJPEG_PART_HEADER + jpeg + b'\r\n'
+
+
+###########################################################################################
+################################### Frame rate / quality ##################################
+###########################################################################################
+
+# Source frames to move on per output frame, to stream a `source_fps` video at `target_fps`.
+# Fractional ratios carry over, e.g. 25 -> 10 fps alternates steps of 2 and 3.
+class FrameStep:
+    def __init__(self, source_fps: float, target_fps: Optional[float] = None):
+        self.source_fps = source_fps
+        self._carry = 0.0
+        self.set_target(target_fps)
+
+    def set_target(self, target_fps: Optional[float]):
+        self.ratio = max(1.0, self.source_fps / target_fps) if target_fps else 1.0
+
+    @property
+    def output_fps(self) -> float:
+        return self.source_fps / self.ratio
+
+    def next(self) -> int:
+        self._carry += self.ratio
+        count = int(self._carry)
+        self._carry -= count
+        return count
+
+
+# The frame `count` source frames on, None at the end of the video. The frames in between are only
+# grab()bed: no BGR conversion, resize or JPEG encode, which is most of the cost of a frame
+def read_frame(capture, count: int = 1):
+    for _ in range(count - 1):
+        if not capture.grab():
+            return None
+    success, frame = capture.read()
+    return frame if success else None
+
+
+def encode_jpeg(frame, width: int, height: int, quality: int) -> bytes:
+    if frame.shape[1] != width or frame.shape[0] != height:
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA if width < frame.shape[1] else cv2.INTER_LINEAR)
+    encoded, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return buffer.tobytes() if encoded else b""
+
+
+# Quality and frame rate of an adaptive stream at a degradation level (0 = as requested)
+def adaptive_quality(quality: int, level: int) -> int:
+    return max(min(quality, MJPEG_ADAPTIVE_MIN_QUALITY), quality - 20 * level)
+
+
+def adaptive_fps(fps: float, level: int) -> float:
+    return max(min(fps, MJPEG_ADAPTIVE_MIN_FPS), fps / 2 ** level)
+
+
+# Degradation level of one adaptive stream, from how many frames the client missed: more than
+# MJPEG_ADAPTIVE_LATE_RATIO of a window late steps down, MJPEG_ADAPTIVE_RECOVER_SECONDS without any steps back up
+class AdaptiveLevel:
+    def __init__(self):
+        self.level = 0
+        self._window_started = None
+        self._sent = 0
+        self._late = 0
+        self._calm_since = None
+
+    # Account a sent frame and the frames the client missed before it; True when the level changed
+    def record(self, now: float, late: int = 0) -> bool:
+        if self._window_started is None:
+            self._window_started = self._calm_since = now
+        self._sent += 1
+        self._late += late
+        if late:
+            self._calm_since = now
+        if now - self._window_started < MJPEG_ADAPTIVE_WINDOW_SECONDS:
+            return False
+
+        late_ratio = self._late / (self._sent + self._late)
+        self._window_started, self._sent, self._late = now, 0, 0
+        if late_ratio > MJPEG_ADAPTIVE_LATE_RATIO and self.level < MJPEG_ADAPTIVE_LEVELS - 1:
+            self.level += 1
+            self._calm_since = now
+            return True
+        if self.level > 0 and now - self._calm_since >= MJPEG_ADAPTIVE_RECOVER_SECONDS:
+            self.level -= 1
+            self._calm_since = now
+            return True
+        return False
+
+
+###########################################################################################
+################################### Frame hub #############################################
+###########################################################################################
+
+# A viewer's frame queue, counting the frames it lost by not keeping up
+class ViewerQueue(asyncio.Queue):
+    dropped = 0
+
+
+# One producer per (video_path, width, height, quality, fps): decodes, resizes and JPEG-encodes each frame once
+# in the decode executor, paced with asyncio.sleep, and hands it to every viewer's queue.
+# With a target fps below the source's, the skipped frames are only grabbed.
+class FrameHub:
+    def __init__(self, key):
+        self.key = key
+        self.video_path, self.width, self.height, self.quality, self.target_fps = key
+        self.source_fps = FRAME_HUB_DEFAULT_FPS
+        self.fps = FRAME_HUB_DEFAULT_FPS
+        self.frames_decoded = 0
+        self.frames_skipped = 0
+        self.frames_dropped = 0
+
+        self.queues = set()
+        self._step = None
+        self.starting = None  # Task opening the capture, awaited by every new viewer
+        self._capture = None
+        self._latest = None
+        self._stopped = False
+        self._finished = False
+
+    def _open(self):
+        capture = cv2.VideoCapture(self.video_path)
+        if not capture.isOpened():
+            capture.release()
+            return None
+        return capture
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        capture = await loop.run_in_executor(_decode_executor, self._open)
+        if capture is None:
+            raise HTTPException(status_code=500, detail="Unable to open video file.")
+
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if fps and fps > 0:
+            self.source_fps = fps
+        self._step = FrameStep(self.source_fps, self.target_fps)
+        self.fps = self._step.output_fps
+        self._capture = capture
+        asyncio.create_task(self._produce())
+
+    def stop(self):
+        self._stopped = True
+
+    # Runs in the decode executor
+    def _decode_next(self):
+        count = self._step.next()
+        frame = read_frame(self._capture, count)
+        if frame is None:
+            return None
+        self.frames_skipped += count - 1
+        return encode_jpeg(frame, self.width, self.height, self.quality)
+
+    async def _produce(self):
+        loop = asyncio.get_running_loop()
+        frame_duration = 1 / self.fps
+        next_frame_at = loop.time()
+        try:
+            # Stopping is a flag checked between frames: cancelling an await would leave the
+            # executor thread still reading from the capture we are about to release
+            while not self._stopped:
+                jpeg = await loop.run_in_executor(_decode_executor, self._decode_next)
+                if jpeg is None:
+                    break
+                if jpeg:
+                    self._publish(jpeg)
+
+                # Pace to the source frame rate; a producer that fell behind does not burst to catch up
+                next_frame_at += frame_duration
+                delay = next_frame_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    next_frame_at = loop.time()
+        except Exception as e:
+            logging.error(f"Frame hub for {self.video_path} failed: {e}")
+        finally:
+            await loop.run_in_executor(_decode_executor, self._capture.release)
+            self._finished = True
+            for queue in self.queues:
+                self._put(queue, None)
+            _discard_hub(self)
+
+    def _put(self, queue: asyncio.Queue, item):
+        # Slow viewers lose their oldest frame instead of holding back the others
+        if queue.full():
+            queue.get_nowait()
+            queue.dropped += 1
+            self.frames_dropped += 1
+        queue.put_nowait(item)
+
+    def _publish(self, jpeg: bytes):
+        self._latest = jpeg
+        self.frames_decoded += 1
+        for queue in self.queues:
+            self._put(queue, jpeg)
+
+    def subscribe(self) -> ViewerQueue:
+        queue = ViewerQueue(maxsize=MJPEG_QUEUE_SIZE)
+        if self._finished:
+            queue.put_nowait(None)
+        elif self._latest is not None:
+            # A new viewer gets a picture right away
+            queue.put_nowait(self._latest)
+        self.queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.queues.discard(queue)
+        if not self.queues:
+            # The last viewer leaving stops the producer
+            _discard_hub(self)
+            self.stop()
+
+
+# Async iterator over a hub's encoded frames for one viewer; closing it (or dropping it) unsubscribes
+class FrameSubscription:
+    def __init__(self, hub: FrameHub, queue: ViewerQueue):
+        self.hub = hub
+        self._queue = queue
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        if not self._closed:
+            try:
+                jpeg = await asyncio.wait_for(self._queue.get(), timeout=FRAME_HUB_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                jpeg = None
+            if jpeg is not None:
+                return jpeg
+        self.close()
+        raise StopAsyncIteration
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            release_stream_slot()
+            self.hub.unsubscribe(self._queue)
+
+    def __del__(self):
+        self.close()
+
+
+# Subscription that moves to a cheaper hub of the same video (lower quality and frame rate) while its
+# viewer keeps losing frames, i.e. its send buffer backs up, and back up once it keeps pace again.
+# Viewers at the same level share that level's hub like any other.
+class AdaptiveFrameSubscription(FrameSubscription):
+    def __init__(self, hub: FrameHub, queue: ViewerQueue):
+        super().__init__(hub, queue)
+        self.quality = hub.quality
+        self.target_fps = hub.target_fps
+        self.adaptive = AdaptiveLevel()
+        self._dropped_seen = 0
+
+    async def __anext__(self) -> bytes:
+        jpeg = await super().__anext__()
+        late = self._queue.dropped - self._dropped_seen
+        self._dropped_seen = self._queue.dropped
+        if self.adaptive.record(asyncio.get_running_loop().time(), late):
+            await self._switch_level()
+        return jpeg
+
+    async def _switch_level(self):
+        level = self.adaptive.level
+        fps = adaptive_fps(self.target_fps or self.hub.source_fps, level) if level or self.target_fps else None
+        key = _hub_key(self.hub.video_path, self.hub.width, self.hub.height, adaptive_quality(self.quality, level), fps)
+        if key == self.hub.key:
+            return
+
+        # Join the new hub before leaving the old one, so the viewer never waits on an empty queue
+        hub = _get_hub(key)
+        queue = hub.subscribe()
+        try:
+            await asyncio.shield(hub.starting)
+        except asyncio.CancelledError:
+            hub.unsubscribe(queue)
+            raise
+        except Exception as e:
+            hub.unsubscribe(queue)
+            logging.warning(f"Adaptive stream of {self.hub.video_path}: staying at {self.hub.key[3:]}: {e}")
+            return
+        old_hub, old_queue = self.hub, self._queue
+        self.hub, self._queue, self._dropped_seen = hub, queue, queue.dropped
+        old_hub.unsubscribe(old_queue)
+        logging.info(f"Adaptive stream of {hub.video_path}: level {level}, quality {hub.quality}, {hub.fps:.1f} fps")
+
+
+###########################################################################################
+################################### Registry ##############################################
+###########################################################################################
+
+# Only touched from the event loop, so no locking is needed
+_hubs = {}
+_active_streams = 0
+
+
+# Every MJPEG viewer of this worker (live or cached) holds a slot, 503 past MJPEG_MAX_STREAMS
+def acquire_stream_slot():
+    global _active_streams
+    if _active_streams >= MJPEG_MAX_STREAMS:
+        raise HTTPException(status_code=503, detail="Too many video streams, retry later.", headers={"Retry-After": "5"})
+    _active_streams += 1
+
+
+def release_stream_slot():
+    global _active_streams
+    _active_streams -= 1
+
+
+def _hub_key(video_path: str, width: int, height: int, quality: int, fps: Optional[float]):
+    return os.path.abspath(video_path), width, height, quality, round(fps, 2) if fps else None
+
+
+# Running hub for a key, started if there is none
+def _get_hub(key) -> FrameHub:
+    hub = _hubs.get(key)
+    if hub is None:
+        hub = FrameHub(key)
+        hub.starting = asyncio.ensure_future(hub.start())
+        _hubs[key] = hub
+    return hub
+
+
+# Subscribe to the shared frames of a video at a size/quality/frame rate (None: the source's), starting
+# its producer if needed. `adaptive` lets the viewer drop to lower quality/fps levels when it falls behind.
+# Raises 503 past MJPEG_MAX_STREAMS viewers and 500 when the video cannot be opened.
+async def subscribe_frames(video_path: str, width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY,
+                           fps: Optional[float] = None, adaptive: bool = False) -> FrameSubscription:
+    acquire_stream_slot()
+    hub = _get_hub(_hub_key(video_path, width, height, quality, fps))
+
+    # Subscribe before awaiting, so a viewer leaving meanwhile does not stop the hub under us
+    subscription = (AdaptiveFrameSubscription if adaptive else FrameSubscription)(hub, hub.subscribe())
+    try:
+        await asyncio.shield(hub.starting)
+    except BaseException:
+        subscription.close()
+        raise
+    return subscription
+
+
+# A finished or abandoned producer leaves the registry, the next viewer starts a new one
+def _discard_hub(hub: FrameHub):
+    if _hubs.get(hub.key) is hub:
+        del _hubs[hub.key]
+
+
+# Running producers, their viewer counts and drop counters
+def frame_hub_stats():
+    return {
+        "active_streams": _active_streams,
+        "max_streams": MJPEG_MAX_STREAMS,
+        "hubs": [
+            {"video_path": hub.video_path, "width": hub.width, "height": hub.height, "quality": hub.quality,
+             "fps": hub.fps, "source_fps": hub.source_fps, "subscribers": len(hub.queues),
+             "frames_decoded": hub.frames_decoded, "frames_skipped": hub.frames_skipped,
+             "frames_dropped": hub.frames_dropped}
+            for hub in _hubs.values()
+        ]
+    }
+
+
+# MJPEG body for StreamingResponse over any async frame iterator with close(), closed when the client goes away.
+# Frames are sent as they are (bytes or a memoryview into the frame cache), without copying them into a part.
+async def mjpeg_stream(frames) -> AsyncGenerator:
+    try:
+        async for jpeg in frames:
+            yield MJPEG_PART_HEADER
+            yield jpeg
+            yield b'\r\n'
+    finally:
+        frames.close()
+
+
+###########################################################################################
+################################### Load benchmark ########################################
+###########################################################################################
+
+# One HTTP viewer reading a multipart stream for `seconds`, returns the number of frames received
+async def _http_viewer(url: str, seconds: float) -> int:
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if b" 200 " not in status_line:
+        writer.close()
+        raise RuntimeError(status_line.decode(errors="replace").strip())
+
+    frames, tail = 0, b""
+    deadline = time.monotonic() + seconds
+    try:
+        while time.monotonic() < deadline:
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), timeout=max(0.01, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            data = tail + chunk
+            frames += data.count(b"--frame\r\n")
+            tail = data[-9:]
+    finally:
+        writer.close()
+    return frames
+
+
+# In-process viewer: the same hub path as the endpoints, without HTTP
+async def _local_viewer(video_path: str, width: int, height: int, quality: int, seconds: float,
+                        fps: Optional[float] = None) -> int:
+    frames = 0
+    deadline = time.monotonic() + seconds
+    stream = mjpeg_stream(await subscribe_frames(video_path, width, height, quality, fps))
+    try:
+        async for chunk in stream:
+            if chunk is MJPEG_PART_HEADER:
+                frames += 1
+            if time.monotonic() >= deadline:
+                break
+    finally:
+        await stream.aclose()
+    return frames
+
+
+# Open `viewers` concurrent streams and report the frame rate each one actually got, plus event loop lag
+async def run_benchmark(viewers: int, seconds: float, url: str = None, video_path: str = None,
+                        width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY, distinct: bool = False,
+                        fps: Optional[float] = None):
+    lag = []
+    cpu_started = time.process_time()
+
+    async def measure_loop_lag():
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(0.05)
+            lag.append(time.monotonic() - started - 0.05)
+
+    monitor = asyncio.create_task(measure_loop_lag())
+    if url:
+        tasks = [_http_viewer(url, seconds) for _ in range(viewers)]
+    else:
+        # distinct: every viewer gets its own quality, i.e. its own decoder (worst case)
+        tasks = [
+            _local_viewer(video_path, width, height, max(1, quality - index) if distinct else quality, seconds, fps)
+            for index in range(viewers)
+        ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    monitor.cancel()
+    cpu_seconds = time.process_time() - cpu_started
+
+    frame_counts = [result for result in results if isinstance(result, int)]
+    errors = len(results) - len(frame_counts)
+    if errors:
+        print(f"First failure: {next(result for result in results if not isinstance(result, int))!r}")
+    if frame_counts:
+        rates = sorted(count / seconds for count in frame_counts)
+        print(f"{len(frame_counts)} viewers for {seconds:.0f}s: fps min {rates[0]:.1f} / "
+              f"median {rates[len(rates) // 2]:.1f} / max {rates[-1]:.1f}, {errors} failed")
+    else:
+        print(f"All {viewers} viewers failed: {results[0]!r}")
+    if lag:
+        print(f"Event loop lag: max {max(lag) * 1000:.1f} ms, mean {sum(lag) / len(lag) * 1000:.1f} ms")
+    if not url:
+        print(f"Decoders used: {viewers if distinct else 1}, decode workers: {MJPEG_DECODE_WORKERS}")
+        # What a dashboard wall costs: compare e.g. --distinct at full size with --width 160 --height 120 --fps 5
+        print(f"CPU: {cpu_seconds:.1f}s, {cpu_seconds / seconds * 100:.0f}% of one core")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load benchmark: how many concurrent MJPEG viewers one worker sustains.")
+    parser.add_argument("--viewers", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--url", help="Stream URL of a running server, e.g. http://localhost:8000/video/video.mp4")
+    parser.add_argument("--video", default=os.path.join("Videos", "video.mp4"), help="Video file for the in-process benchmark")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--quality", type=int, default=MJPEG_JPEG_QUALITY)
+    parser.add_argument("--fps", type=float, help="Target frame rate, default the video's")
+    parser.add_argument("--distinct", action="store_true", help="One decoder per viewer instead of a shared one")
+    args = parser.parse_args()
+
+    MJPEG_MAX_STREAMS = max(MJPEG_MAX_STREAMS, args.viewers)
+    asyncio.run(run_benchmark(args.viewers, args.seconds, args.url, args.video,
+                              args.width, args.height, args.quality, args.distinct, args.fps))
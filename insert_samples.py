@@ -2,6 +2,7 @@ from db_configure import SessionLocal
 from db_initialize import Account, Camera, Counter, ROI, Visitor, Activity, Notification, Exhibition
 from datetime import datetime, timedelta
 import random
+import visitor_rollups  # Keeps the visitor rollups in step with inserted Visitor rows
 
 # Insert accounts data
 def insert_accounts():
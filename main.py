@@ -1,9 +1,10 @@
 import os
-import cv2
-from fastapi import FastAPI, HTTPException, Depends, Query, Path
+from fastapi import FastAPI, HTTPException, Depends, Query, Path, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import time
+import asyncio
+from datetime import datetime
 import logging
 from typing import Optional
 from starlette.concurrency import run_in_threadpool  # <-- Import the correct module
@@ -12,7 +13,9 @@ import subprocess
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
 from fastapi.responses import FileResponse
+from pydantic import ValidationError
 from db_initialize import Account, Camera, Counter, ROI, Visitor, Activity, Notification
 from service_functions import (
     recover_password,
@@ -34,6 +37,17 @@ from service_functions import (
     get_people_duration_per_counter,
     report_details_of_selected_counter,
     get_visitor_records,
+    get_visitor_records_page,
+    REPORT_PAGE_SIZE_DEFAULT,
+    REPORT_PAGE_SIZE_MAX,
+    parse_visitor_records_dates,
+    visitor_records_query,
+    stream_visitor_records_csv,
+    build_visitor_records_excel,
+    get_export_progress,
+    iter_file_chunks,
+    stream_visitor_records_columnar,
+    require_columnar_exports,
     get_most_recent_video,
     stream_video_frames,
     get_cameras_details,
@@ -59,13 +73,30 @@ from service_functions import (
     get_logged_in_user,
     get_latest_disabled_camera,
     get_db,
+    get_read_db,
+    rois_cache,
+    dashboard_snapshot_sections,
+    dashboard_snapshot_system_info,
     verify_token,
     TokenData,
     most_visited_counter_no_slot_time_for_latest_date_func,
     most_visited_counter_for_each_slot_time_in_latest_date_func,
     most_visited_counter_for_latest_date_slot_time_func,
     minimum_visited_counter_for_latest_date_slot_time_func,
+    SLOT_OPENING_HOUR,
+    SLOT_CLOSING_HOUR,
+    SLOT_MINUTES,
 )
+from visitor_ingest import parse_visitor_payload, ingest_visitors
+from frame_hub import frame_hub_stats, mjpeg_stream, MJPEG_JPEG_QUALITY
+from file_serving import file_response, safe_join
+from recording_catalog import recording_catalog, list_recordings
+from camera_playback import CameraPlayback
+from camera_ingest import camera_ingest, live_frame_stream, CAMERA_INGEST_ENABLED
+from roi_geometry import roi_cache
+from db_configure import run_read_db, pool_metrics
+from response_cache import response_cache_stats
+from dashboard_live import dashboard_live, dashboard_sse_stream, dashboard_websocket_loop
 
 logging.basicConfig(level=logging.INFO)
 
@@ -83,6 +114,18 @@ app.add_middleware(
 # Set up OAuth2 password bearer for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+
+# Live camera readers (CAMERA_INGEST_ENABLED=1), following tbl_cameras
+@app.on_event("startup")
+def start_camera_ingest():
+    if CAMERA_INGEST_ENABLED:
+        camera_ingest.start()
+
+
+@app.on_event("shutdown")
+def stop_camera_ingest():
+    camera_ingest.stop()
+
 VIDEO_DIRECTORY = "Videos/"
 
 class VideoStreamRequest(BaseModel):
@@ -103,7 +146,14 @@ def login_endpoint(login_data: LoginData, db: Session = Depends(get_db)):
 VIDEO_DIRECTORY = "Videos/"  # Path to the Videos directory
 
 @app.get("/video/{filename}")
-def stream_video(filename: str, width: int = 640, height: int = 480):
+async def stream_video(
+    filename: str,
+    width: int = Query(640, ge=16, le=3840),
+    height: int = Query(480, ge=16, le=2160),
+    quality: int = Query(MJPEG_JPEG_QUALITY, ge=1, le=100),
+    fps: Optional[float] = Query(None, gt=0, le=60),
+    adaptive: bool = False
+):
     # Allowed video extensions
     allowed_extensions = [".mp4", ".avi"]
 
@@ -118,41 +168,31 @@ def stream_video(filename: str, width: int = 640, height: int = 480):
     if not os.path.isfile(video_path):
         return {"error": "File not found"}
 
-    # Open the video using OpenCV
-    video_capture = cv2.VideoCapture(video_path)
-
-    # Check if the video can be opened
-    if not video_capture.isOpened():
+    # Cached replay, or a decoder shared by the viewers of the same file and size
+    try:
+        frames = await stream_video_frames(video_path, width, height, quality, fps, adaptive)
+    except HTTPException as e:
+        if e.status_code == 503:
+            raise
         return {"error": "Unable to open video file"}
 
-    # Get the video's frames per second (FPS)
-    fps = video_capture.get(cv2.CAP_PROP_FPS)
-    frame_duration = 1 / fps  # Time in seconds for each frame
-
-    # Generator function to stream video frames
-    def generate_video_stream():
-        while video_capture.isOpened():
-            start_time = time.time()  # Get the start time of frame processing
-            success, frame = video_capture.read()
-            if not success:
-                break
-
-            # Resize the frame to the specified dimensions
-            frame = cv2.resize(frame, (width, height))
+    # Return streaming response with multipart data
+    return StreamingResponse(frames, media_type="multipart/x-mixed-replace; boundary=frame")
 
-            # Convert the frame to JPG format
-            _, buffer = cv2.imencode('.jpg', frame)
 
-            # Yield the frame as a byte sequence
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n\r\n')
+# Original recording bytes with HTTP Range (206), ETag/Last-Modified and its MIME type.
+# Players that decode H.264 themselves seek with byte ranges and cost no transcoding.
+@app.api_route("/video_file/{file_path:path}", methods=["GET", "HEAD"])
+def serve_video_file(file_path: str, request: Request):
+    if not file_path.endswith((".mp4", ".avi")):
+        raise HTTPException(status_code=400, detail="Invalid file extension. Only .mp4 and .avi are allowed.")
+    return file_response(request, safe_join(VIDEO_DIRECTORY, file_path))
 
-            # Sleep to match the frame duration based on FPS
-            elapsed_time = time.time() - start_time
-            time.sleep(max(0, frame_duration - elapsed_time))
 
-    # Return streaming response with multipart data
-    return StreamingResponse(generate_video_stream(), media_type="multipart/x-mixed-replace; boundary=frame")
+# Most recent recording of a camera, served as a file (see /camera_video_view for MJPEG)
+@app.api_route("/camera_video_file", methods=["GET", "HEAD"])
+def camera_video_file(id: int, request: Request):
+    return file_response(request, get_most_recent_video(id))
 
 
 # Database query endpoints (authentication required)
@@ -181,7 +221,7 @@ def get_counter_list_endpoint(db: Session = Depends(get_db), token: str = Depend
 
 
 @app.get("/visitor_list")
-def get_visitor_list_endpoint(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+def get_visitor_list_endpoint(db: Session = Depends(get_read_db), token: str = Depends(oauth2_scheme)):
     token_data = verify_token(token)  # Verifying the token
     try:
         visitors = get_visitor_list(db)  # Fetch visitor list from the database
@@ -238,10 +278,10 @@ def logged_in_user_endpoint(token: str = Depends(oauth2_scheme), db: Session = D
 
 
 @app.get("/total_visitors")
-async def total_visitors_endpoint(db: Session = Depends(get_db)):    
+async def total_visitors_endpoint():
     #token_data = verify_token(token)  # Verifying the token
     try:
-        total = get_total_visitors(db)
+        total = await run_read_db(get_total_visitors)
         return {"total_visitors": total}
     except Exception as e:
         logging.error(f"Error fetching total number of visitors: {e}")
@@ -250,7 +290,7 @@ async def total_visitors_endpoint(db: Session = Depends(get_db)):
 
 # New endpoints for least visited counters
 @app.get("/least_visited_counter")
-def least_visited_counter_endpoint(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+def least_visited_counter_endpoint(db: Session = Depends(get_read_db), token: str = Depends(oauth2_scheme)):
     token_data = verify_token(token)  # Verifying the token
     try:
         result = least_visited_counter(db)
@@ -261,7 +301,7 @@ def least_visited_counter_endpoint(db: Session = Depends(get_db), token: str = D
 
 # New endpoints for retrieving of most visited counter with no slot time and only for latest date (today) - on home dashboard
 @app.get("/most_visited_counter_no_slot_time_for_latest_date")
-def most_visited_counter_no_slot_time_for_latest_date_endpoint(db: Session = Depends(get_db)):
+def most_visited_counter_no_slot_time_for_latest_date_endpoint(db: Session = Depends(get_read_db)):
     #token_data = verify_token(token)  # Verifying the token
     try:
         result = most_visited_counter_no_slot_time_for_latest_date_func(db)
@@ -274,10 +314,15 @@ def most_visited_counter_no_slot_time_for_latest_date_endpoint(db: Session = Dep
 
 # New endpoints for retrieving of most visited counter for only latest date and covering slot time
 @app.get("/most_visited_counter_for_each_slot_time_in_latest_date")
-def most_visited_counter_for_each_slot_time_in_latest_date_endpoint(db: Session = Depends(get_db)):
+def most_visited_counter_for_each_slot_time_in_latest_date_endpoint(
+    opening_hour: int = Query(SLOT_OPENING_HOUR, ge=0, le=24),
+    closing_hour: int = Query(SLOT_CLOSING_HOUR, ge=0, le=24),
+    slot_minutes: int = Query(SLOT_MINUTES, gt=0),
+    db: Session = Depends(get_read_db)
+):
     #token_data = verify_token(token)  # Verifying the token
     try:
-        result = most_visited_counter_for_each_slot_time_in_latest_date_func(db)
+        result = most_visited_counter_for_each_slot_time_in_latest_date_func(db, opening_hour, closing_hour, slot_minutes)
         return result
     except Exception as e:
         logging.error(f"Error fetching most visited counter: {e}")
@@ -287,10 +332,15 @@ def most_visited_counter_for_each_slot_time_in_latest_date_endpoint(db: Session
 
 # Endpoint for identifying the most visited counter during specific time slots on the latest date stored in the database.
 @app.get("/most_visited_counter_for_latest_date_slot_time")
-def most_visited_counter_for_latest_date_slot_time_endpoint(db: Session = Depends(get_db)):
+def most_visited_counter_for_latest_date_slot_time_endpoint(
+    opening_hour: int = Query(SLOT_OPENING_HOUR, ge=0, le=24),
+    closing_hour: int = Query(SLOT_CLOSING_HOUR, ge=0, le=24),
+    slot_minutes: int = Query(SLOT_MINUTES, gt=0),
+    db: Session = Depends(get_read_db)
+):
     #token_data = verify_token(token)  # Verifying the token
     try:
-        result = most_visited_counter_for_latest_date_slot_time_func(db)
+        result = most_visited_counter_for_latest_date_slot_time_func(db, opening_hour, closing_hour, slot_minutes)
         return result
     except Exception as e:
         logging.error(f"Error fetching most visited counter: {e}")
@@ -299,9 +349,14 @@ def most_visited_counter_for_latest_date_slot_time_endpoint(db: Session = Depend
 
 # Endpoint to find the minimum visited counter for the latest date
 @app.get("/minimum_visited_counter_for_latest_date_slot_time")
-def minimum_visited_counter_for_latest_date_slot_time_endpoint(db: Session = Depends(get_db)):
+def minimum_visited_counter_for_latest_date_slot_time_endpoint(
+    opening_hour: int = Query(SLOT_OPENING_HOUR, ge=0, le=24),
+    closing_hour: int = Query(SLOT_CLOSING_HOUR, ge=0, le=24),
+    slot_minutes: int = Query(SLOT_MINUTES, gt=0),
+    db: Session = Depends(get_read_db)
+):
     try:
-        result = minimum_visited_counter_for_latest_date_slot_time_func(db)
+        result = minimum_visited_counter_for_latest_date_slot_time_func(db, opening_hour, closing_hour, slot_minutes)
         return result
     except Exception as e:
         logging.error(f"Error fetching minimum visited counter: {e}")
@@ -309,25 +364,23 @@ def minimum_visited_counter_for_latest_date_slot_time_endpoint(db: Session = Dep
 
 
 @app.post("/age_monitoring")
-async def age_monitoring_endpoint(selected_date_range: dict, 
-                                  db: Session = Depends(get_db)):
+async def age_monitoring_endpoint(selected_date_range: dict):
     #token_data = verify_token(token)  # Verifying the token
     try:
         # Perform age monitoring operation using selected_date_range and db session
-        result = age_monitoring(selected_date_range, db)
+        result = await run_read_db(lambda db: age_monitoring(selected_date_range, db))
         return result
     except Exception as e:
         logging.error(f"Error in age monitoring: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/gender_monitoring")
-async def gender_monitoring_endpoint(selected_date_range: dict, 
-                                    db: Session = Depends(get_db),
+async def gender_monitoring_endpoint(selected_date_range: dict,
                                     token: str = Depends(oauth2_scheme)):
     token_data = verify_token(token)  # Verifying the token    
     try:
         # Perform gender monitoring operation using selected_date_range and db session
-        result = gender_monitoring(selected_date_range, db)
+        result = await run_read_db(lambda db: gender_monitoring(selected_date_range, db))
         return result
     except Exception as e:
         logging.error(f"Error in gender monitoring: {e}")
@@ -355,23 +408,123 @@ def latest_disabled_camera(db: Session = Depends(get_db), token: str = Depends(o
     return response  # Return the message from the service function
 
 
+# Everything the home dashboard shows in one request: the sections are keyed like the endpoints above
+# and their queries run concurrently on read sessions, while the system info is collected alongside
+@app.get("/dashboard/snapshot")
+async def dashboard_snapshot(
+    start_date: Optional[str] = Query(None, description="Age/gender range start, 'YYYY-MM-DD HH:MM:SS' (default today)"),
+    end_date: Optional[str] = Query(None, description="Age/gender range end, 'YYYY-MM-DD HH:MM:SS' (default today)"),
+    opening_hour: int = Query(SLOT_OPENING_HOUR, ge=0, le=24),
+    closing_hour: int = Query(SLOT_CLOSING_HOUR, ge=0, le=24),
+    slot_minutes: int = Query(SLOT_MINUTES, gt=0),
+    token: str = Depends(oauth2_scheme)
+):
+    token_data = verify_token(token)  # Verifying the token
+    if (start_date is None) != (end_date is None):
+        raise HTTPException(status_code=400, detail="Give both start_date and end_date, or neither.")
+    selected_date_range = {'start_date': start_date, 'end_date': end_date} if start_date else None
+
+    started = time.perf_counter()
+    (sections, timings), (system_sections, system_timings) = await asyncio.gather(
+        dashboard_snapshot_sections(selected_date_range, opening_hour, closing_hour, slot_minutes),
+        run_in_threadpool(dashboard_snapshot_system_info)
+    )
+    sections.update(system_sections)
+    timings.update(system_timings)
+    timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+    return {"generated_at": datetime.now().isoformat(), "sections": sections, "timings_ms": timings}
+
+
+# Live dashboard over Server-Sent Events: a "snapshot" event with the snapshot sections (without system
+# info), then "delta" events carrying JSON Merge Patches of them. EventSource cannot send headers, so the
+# token comes as a query parameter.
+@app.get("/dashboard/live")
+async def dashboard_live_events(token: str = Query(...)):
+    token_data = verify_token(token)  # Verifying the token
+    if isinstance(token_data, dict):
+        raise HTTPException(status_code=401, detail=token_data["message"])
+    subscription = dashboard_live.subscribe()
+    return StreamingResponse(
+        dashboard_sse_stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Same messages over a WebSocket (needs a server with WebSocket support, e.g. pip install websockets)
+@app.websocket("/dashboard/live/ws")
+async def dashboard_live_websocket(websocket: WebSocket, token: str = Query(...)):
+    if isinstance(verify_token(token), dict):
+        await websocket.close(code=1008)
+        return
+    try:
+        subscription = dashboard_live.subscribe()
+    except HTTPException:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    try:
+        await dashboard_websocket_loop(websocket, subscription)
+    except WebSocketDisconnect:
+        pass
+
+
+# Live dashboard aggregator of this worker: subscribers, ticks and timings
+@app.get("/dashboard/live/stats")
+def dashboard_live_stats(token: str = Depends(oauth2_scheme)):
+    token_data = verify_token(token)  # Verifying the token
+    return dashboard_live.stats()
+
+
+################################ VISITOR INGEST APIs ###############################
+
+# Bulk visitor ingestion for the detectors: JSON array or NDJSON (Content-Type: application/x-ndjson)
+@app.post("/visitors/bulk")
+async def ingest_visitors_bulk_endpoint(
+    request: Request,
+    db: Session = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    token_data = verify_token(token)  # Verifying the token
+    if isinstance(token_data, dict):
+        raise HTTPException(status_code=401, detail=token_data["message"])
+
+    body = await request.body()
+    try:
+        records = parse_visitor_payload(body, request.headers.get("content-type", ""))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False)[:20])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid visitors payload: {str(e)}")
+
+    # COPY and commit run in the threadpool to keep the event loop free
+    inserted = await run_in_threadpool(ingest_visitors, db, records)
+    return {"inserted": inserted}
+
+
 ################################# REPORT APIs ###################################
 
+# Visitor report table, one keyset page at a time: pass next_cursor back as cursor for the following page
 @app.get("/report_visitor_table/") 
-async def report_visitor_table(
+def report_visitor_table(
     start_date: str,
     end_date: str,
     counter_id: int = None,
     id: int = None,
     age: str = None,
     gender: str = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    page_size: int = Query(REPORT_PAGE_SIZE_DEFAULT, gt=0, le=REPORT_PAGE_SIZE_MAX),
+    include_total: bool = Query(False, description="Add the total row count (from the rollups, or the planner estimate)"),
+    db: Session = Depends(get_read_db)
 ):
     #token_data = verify_token(token)  # Verifying the token
-    visitors = get_visitor_records(db, start_date, end_date, counter_id, id, age, gender)
-    
     # Instead of raising 404, return the visitors data which could be empty
-    return {"visitors": visitors}
+    return get_visitor_records_page(
+        db, start_date, end_date,
+        counter_id=counter_id, id=id, age=age, gender=gender,
+        cursor=cursor, page_size=page_size, include_total=include_total
+    )
 
 
 @app.post("/export_visitor_records/csv")
@@ -383,15 +536,22 @@ def export_visitor_records_csv(
     age: str = None,
     gender: str = None,
     exhibition: str = None,
-    db: Session = Depends(get_db)
+    stream: bool = Query(True, description="Stream rows from a server-side cursor (False builds the whole file first)"),
+    db: Session = Depends(get_read_db)
 ):
     #token_data = verify_token(token)  # Verifying the token
     if not start_date or not end_date:
         raise HTTPException(status_code=400, detail="Start date and end date must be provided.")
-    
-    data = get_visitor_records(db, start_date, end_date, counter_id, id, age, gender, exhibition)
+
+    headers = {"Content-Disposition": "attachment; filename=visitor_records.csv"}
+    if stream:
+        start, end = parse_visitor_records_dates(start_date, end_date)
+        query = visitor_records_query(start, end, counter_id=counter_id, id=id, age=age, gender=gender, exhibition=exhibition)
+        return StreamingResponse(stream_visitor_records_csv(query), media_type="text/csv", headers=headers)
+
+    data = get_visitor_records(db, start_date, end_date, counter_id=counter_id, id=id, age=age, gender=gender, exhibition=exhibition)
     csv_file = export_visitor_records_to_csv(data)
-    return StreamingResponse(csv_file, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=visitor_records.csv"})
+    return StreamingResponse(csv_file, media_type="text/csv", headers=headers)
 
 @app.post("/export_visitor_records/excel")
 def export_visitor_records_excel(
@@ -402,17 +562,77 @@ def export_visitor_records_excel(
     age: str = None,
     gender: str = None,
     exhibition: str = None,
-    db: Session = Depends(get_db),
+    stream: bool = Query(True, description="Build the file with a write-only workbook from a server-side cursor"),
+    export_id: Optional[str] = Query(None, description="Client chosen id to follow the export on /export_visitor_records/progress/{export_id}"),
+    db: Session = Depends(get_read_db),
     token: str = Depends(oauth2_scheme)
 ):
     token_data = verify_token(token)  # Verifying the token
     if not start_date or not end_date:
         raise HTTPException(status_code=400, detail="Start date and end date must be provided.")
-    
-    data = get_visitor_records(db, start_date, end_date, counter_id, id, age, gender, exhibition)
+
+    media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    headers = {"Content-Disposition": "attachment; filename=visitor_records.xlsx"}
+    if stream:
+        start, end = parse_visitor_records_dates(start_date, end_date)
+        query = visitor_records_query(start, end, counter_id=counter_id, id=id, age=age, gender=gender, exhibition=exhibition)
+        try:
+            excel_file, rows = build_visitor_records_excel(query, export_id=export_id)
+        except SQLAlchemyError as e:
+            logging.error(f"Error exporting visitor records: {e}")
+            raise HTTPException(status_code=500, detail="Error exporting visitor records")
+
+        # The file is complete here, so its size is known
+        excel_file.seek(0, os.SEEK_END)
+        headers["Content-Length"] = str(excel_file.tell())
+        headers["X-Export-Rows"] = str(rows)
+        excel_file.seek(0)
+        return StreamingResponse(iter_file_chunks(excel_file), media_type=media_type, headers=headers)
+
+    data = get_visitor_records(db, start_date, end_date, counter_id=counter_id, id=id, age=age, gender=gender, exhibition=exhibition)
     excel_file = export_visitor_records_to_excel(data)
-    return StreamingResponse(excel_file, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": "attachment; filename=visitor_records.xlsx"})
+    return StreamingResponse(excel_file, media_type=media_type, headers=headers)
+
+
+# Columnar exports for analytics: Parquet file or Arrow IPC stream, same filters as the other exports
+@app.post("/export_visitor_records/{file_format}")
+def export_visitor_records_columnar(
+    file_format: str = Path(..., pattern="^(parquet|arrow)$"),
+    start_date: str = Query(...),
+    end_date: str = Query(...),
+    counter_id: int = None,
+    id: int = None,
+    age: str = None,
+    gender: str = None,
+    exhibition: str = None,
+    token: str = Depends(oauth2_scheme)
+):
+    token_data = verify_token(token)  # Verifying the token
+    if isinstance(token_data, dict):
+        raise HTTPException(status_code=401, detail=token_data["message"])
+    require_columnar_exports()
+
+    start, end = parse_visitor_records_dates(start_date, end_date)
+    query = visitor_records_query(start, end, counter_id=counter_id, id=id, age=age, gender=gender, exhibition=exhibition)
+    if file_format == "parquet":
+        media_type, filename = "application/vnd.apache.parquet", "visitor_records.parquet"
+    else:
+        media_type, filename = "application/vnd.apache.arrow.stream", "visitor_records.arrows"
+    return StreamingResponse(
+        stream_visitor_records_columnar(query, file_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+# Progress of an Excel export started with an export_id
+@app.get("/export_visitor_records/progress/{export_id}")
+def export_visitor_records_progress(export_id: str, token: str = Depends(oauth2_scheme)):
+    token_data = verify_token(token)  # Verifying the token
+    progress = get_export_progress(export_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Unknown export id.")
+    return progress
 
 
 
@@ -423,7 +643,7 @@ def report_people_count_per_counter(
     end_date: Optional[str] = None,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     token: str = Depends(oauth2_scheme)
 ):
     # Verify the token
@@ -454,7 +674,6 @@ async def report_people_duration_per_counter(
     end_date: Optional[str] = None,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
-    db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
     try:
@@ -462,7 +681,7 @@ async def report_people_duration_per_counter(
         token_data = verify_token(token)
         
         # Fetch the total attendance duration per counter
-        result = get_people_duration_per_counter(db, start_date, end_date, start_time, end_time)
+        result = await run_read_db(get_people_duration_per_counter, start_date, end_date, start_time, end_time)
         
         if not result:
             raise HTTPException(status_code=404, detail="No records found for the specified criteria.")
@@ -484,15 +703,14 @@ async def report_people_duration_per_counter(
 @app.get("/report_details_of_selected_counter/{counter_id}")
 async def report_details_of_selected_counter_route(
     counter_id: int,
-    db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
     try:
         # Verify token
         token_data = verify_token(token)
 
-        # Run the synchronous function in a threadpool to avoid blocking
-        result = await run_in_threadpool(report_details_of_selected_counter, db, counter_id)
+        # Run the synchronous function off the event loop
+        result = await run_read_db(report_details_of_selected_counter, counter_id)
 
         return {"details": result}
 
@@ -532,7 +750,7 @@ class CameraData(BaseModel):
     cam_desc: Optional[str] = None
 
 @app.post("/cameras")
-async def insert_camera_service(
+def insert_camera_service(
     camera_data: CameraData,  # Use Pydantic model to receive the data
     db: Session = Depends(get_db)
 ):
@@ -552,6 +770,8 @@ async def insert_camera_service(
             cam_desc=camera_data.cam_desc
         )
 
+        camera_ingest.request_sync()
+
         # Return a success message
         return {"message": "Camera inserted successfully."}
     except Exception as e:
@@ -559,7 +779,7 @@ async def insert_camera_service(
 
 
 @app.delete("/cameras/{id}")
-async def delete_camera_service(
+def delete_camera_service(
     id: int,  # Accept the camera ID as a path parameter
     db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
@@ -570,13 +790,14 @@ async def delete_camera_service(
 
         # Call the delete function and pass the session (db)
         delete_camera_by_id(db, id)  # Pass id from the path parameter
+        camera_ingest.request_sync()
         return {"message": f"Camera with id={id} deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/cameras/{id}")
-async def camera_details_for_edit_service(
+def camera_details_for_edit_service(
     id: int,  # Accept the camera ID as a path parameter
     db: Session = Depends(get_db)
 ):
@@ -609,7 +830,7 @@ class CameraEditData(BaseModel):
     cam_desc: Optional[str] = None  # Optional description
 
 @app.patch("/cameras/{id}")  # Optionally allow PATCH as well
-async def camera_edit_save_service(
+def camera_edit_save_service(
     id: int,  # Accept id as a path parameter
     camera_data: CameraEditData,
     db: Session = Depends(get_db)
@@ -634,28 +855,109 @@ async def camera_edit_save_service(
             time_duration_calculation_status=camera_data.time_duration_calculation_status,
             cam_desc=camera_data.cam_desc  # Pass optional description
         )
+        camera_ingest.request_sync()
         return {"message": f"Camera with ID {id} updated successfully."}  # Include camera ID in the response
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# Dashboard tiles ask for what they display, e.g. width=320&height=240&quality=60&fps=5&adaptive=true;
+# a tile costs a fraction of a full-rate stream and viewers asking the same share one decoder
 @app.get("/camera_video_view")
-async def camera_video_view(id: int, db: Session = Depends(get_db)):
+async def camera_video_view(
+    id: int,
+    width: int = Query(640, ge=16, le=3840),
+    height: int = Query(480, ge=16, le=2160),
+    quality: int = Query(MJPEG_JPEG_QUALITY, ge=1, le=100),
+    fps: Optional[float] = Query(None, gt=0, le=60),
+    adaptive: bool = False,
+    live: bool = True,
+    db: Session = Depends(get_db)
+):
+    # Cameras being ingested are shown live, the others replay their most recent recording
+    reader = camera_ingest.reader(id)
+    if live and reader is not None and reader.state == "streaming":
+        return StreamingResponse(mjpeg_stream(live_frame_stream(id, width, height, quality, fps)),
+                                 media_type="multipart/x-mixed-replace; boundary=frame")
+
     # Get the most recent video for the selected camera
     try:
         # Verify token
         #token_data = verify_token(token)
 
-        video_path = get_most_recent_video(id)
+        # The catalog lookup may rescan the camera's folder under the catalog lock, keep it off the event loop
+        video_path = await run_in_threadpool(get_most_recent_video, id)
     except HTTPException as e:
         raise e
     
-    # Stream the video frames
-    return StreamingResponse(stream_video_frames(video_path), media_type="multipart/x-mixed-replace; boundary=frame")
+    # Stream the video frames, shared with the other viewers of this camera (503 past MJPEG_MAX_STREAMS)
+    return StreamingResponse(await stream_video_frames(video_path, width, height, quality, fps, adaptive), media_type="multipart/x-mixed-replace; boundary=frame")
+
 
 
 
 
+# Recordings of a camera, optionally only those overlapping [start, end] (YYYY-MM-DD HH:MM:SS)
+@app.get("/recordings/{camera_id}")
+def list_camera_recordings(
+    camera_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    token: str = Depends(oauth2_scheme)
+):
+    token_data = verify_token(token)  # Verifying the token
+    if recording_catalog.camera(camera_id) is None:
+        raise HTTPException(status_code=404, detail=f"Folder for camera {camera_id} not found.")
+    return {"camera_id": camera_id, "recordings": list_recordings(camera_id, start, end)}
+
+
+# Play a camera's recordings from a point in time (e.g. a visitor record's date_time), across segment files
+@app.get("/camera_playback")
+async def camera_playback(
+    id: int,
+    start: datetime,
+    width: int = Query(640, ge=16, le=3840),
+    height: int = Query(480, ge=16, le=2160),
+    quality: int = Query(MJPEG_JPEG_QUALITY, ge=1, le=100),
+    fps: Optional[float] = Query(None, gt=0, le=60),
+    adaptive: bool = False
+):
+    playback = CameraPlayback(id, start, width, height, quality, fps, adaptive)
+    await playback.open()
+    return StreamingResponse(
+        mjpeg_stream(playback),
+        media_type="multipart/x-mixed-replace; boundary=frame",
+        headers={"X-Playback-Segment": playback.segment.file_name}
+    )
+
+
+# Live readers of the ingested cameras: state, frame counts, reconnects and the segment being recorded
+@app.get("/camera_ingest/status")
+def camera_ingest_status(token: str = Depends(oauth2_scheme)):
+    token_data = verify_token(token)  # Verifying the token
+    return {"enabled": CAMERA_INGEST_ENABLED, "cameras": camera_ingest.status()}
+
+
+# Running video producers and viewer counts of this worker
+@app.get("/video_streams/stats")
+async def video_streams_stats(token: str = Depends(oauth2_scheme)):
+    token_data = verify_token(token)  # Verifying the token
+    return frame_hub_stats()
+
+
+# Connection pool usage of this worker: checked-out/overflow connections and checkout waits
+@app.get("/db/pool")
+def db_pool_stats(token: str = Depends(oauth2_scheme)):
+    token_data = verify_token(token)  # Verifying the token
+    return pool_metrics()
+
+
+# Hit/miss counters of this worker's response caches
+@app.get("/cache/stats")
+def response_cache_stats_endpoint(token: str = Depends(oauth2_scheme)):
+    token_data = verify_token(token)  # Verifying the token
+    return response_cache_stats()
+
 
 #################################### ROIS APIs ######################################
 
@@ -713,7 +1015,7 @@ def delete_roi(camera_id: int, roi_id: int, db: Session = Depends(get_db),
 
 # ROI Edit Endpoint
 @app.patch("/rois/{camera_id}/{roi_id}")
-async def roi_edit_service(
+def roi_edit_service(
     camera_id: int,  # Accept camera_id as a path parameter
     roi_id: int,  # Accept roi_id as a path parameter
     roi_data: ROIData,  # Accept the ROI details as a request body
@@ -741,10 +1043,12 @@ async def roi_edit_service(
 
 ## add camera
 @app.post("/rois/{camera_id}")
-async def insert_roi(camera_id: int):
+def insert_roi(camera_id: int):
     try:
         # Run the Python script with the specified camera ID
         result = subprocess.run(['python3', 'roi_define/roi_definition.py', '--video', str(camera_id)], capture_output=True, text=True)
+        roi_cache.invalidate(camera_id)
+        rois_cache.invalidate((camera_id,))
         return {"output": result.stdout}
     except Exception as e:
         return {"error": str(e)}
@@ -754,7 +1058,7 @@ async def insert_roi(camera_id: int):
 
 # Creat users service to fetch all users
 @app.get("/users")
-async def get_all_users_service(
+def get_all_users_service(
     db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
@@ -787,7 +1091,7 @@ class AccountCreate(BaseModel):
     user_status: bool
 
 @app.post("/users")
-async def insert_account_service(
+def insert_account_service(
     account_data: AccountCreate,  # Accept JSON body data
     db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
@@ -823,7 +1127,7 @@ class UserDeleteRequest(BaseModel):
 
 
 @app.delete("/users/{id}")
-async def delete_user_service(
+def delete_user_service(
     id: int = Path(..., description="The ID of the user to delete"),  # id as a path parameter
     db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
@@ -843,7 +1147,7 @@ async def delete_user_service(
 
 
 @app.get("/users/{id}")
-async def user_details_for_edit_service(
+def user_details_for_edit_service(
     id: int = Path(..., description="The ID of the user to retrieve details for"),  # id as a path parameter
     db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
@@ -875,7 +1179,7 @@ class UserEdit(BaseModel):
     user_status: bool
 
 @app.put("/users/{id}")
-async def user_edit_save_service(
+def user_edit_save_service(
     user_data: UserEdit,  # Non-default argument (Pydantic model for user data)
     id: int = Path(..., description="The ID of the user to edit"),  # Default argument
     db: Session = Depends(get_db),  # Default argument
@@ -907,7 +1211,7 @@ async def user_edit_save_service(
 
 
 @app.post("/exhibitions/")
-async def add_exhibition_service(
+def add_exhibition_service(
     name: str,
     description: str,
     start_date: str,
@@ -925,7 +1229,7 @@ async def add_exhibition_service(
 
 # List all exhibitions
 @app.get("/exhibitions/")
-async def list_exhibitions_service(db: Session = Depends(get_db)):
+def list_exhibitions_service(db: Session = Depends(get_db)):
     exhibitions = list_exhibitions(db)
     if not exhibitions:
         raise HTTPException(status_code=404, detail="No exhibitions found")
@@ -933,7 +1237,7 @@ async def list_exhibitions_service(db: Session = Depends(get_db)):
 
 # Edit an exhibition
 @app.put("/exhibitions/{exhibition_id}")
-async def edit_exhibition_service(
+def edit_exhibition_service(
     exhibition_id: int,
     name: str,
     description: str,
@@ -949,7 +1253,7 @@ async def edit_exhibition_service(
 
 # Delete an exhibition
 @app.delete("/exhibitions/{exhibition_id}")
-async def delete_exhibition_service(exhibition_id: int, db: Session = Depends(get_db)):
+def delete_exhibition_service(exhibition_id: int, db: Session = Depends(get_db)):
     success = delete_exhibition(db, exhibition_id)
     if success:
         return {"message": "Exhibition deleted successfully"}
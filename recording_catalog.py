@@ -0,0 +1,245 @@
+import os
+import re
+import cv2
+import time
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+RECORDINGS_DIRECTORY = os.getenv("RECORDINGS_DIRECTORY", "Videos")
+RECORDING_CATALOG_REFRESH_SECONDS = float(os.getenv("RECORDING_CATALOG_REFRESH_SECONDS", 5))  # Directory mtime check interval
+
+# <id>_YYYY-MM-DD_HH-MM-SS.mp4
+RECORDING_NAME_PATTERN = re.compile(r"^[^_]+_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.(mp4|avi)$")
+
+
+# Start time encoded in a recording's file name, None for names that do not follow the pattern
+def parse_recording_start(file_name: str) -> Optional[datetime]:
+    match = RECORDING_NAME_PATTERN.match(file_name)
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S")
+    except ValueError:
+        return None
+
+
+# File names carry naive local time; a timestamp with an offset (e.g. ...Z from a browser) is converted
+# to it so it can be compared with them
+def naive_local_time(moment: Optional[datetime]) -> Optional[datetime]:
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+class Recording:
+    __slots__ = ("camera_id", "path", "start", "_duration", "_duration_mtime")
+
+    def __init__(self, camera_id: int, path: str, start: datetime):
+        self.camera_id = camera_id
+        self.path = path
+        self.start = start
+        self._duration = None
+        self._duration_mtime = None
+
+    @property
+    def file_name(self) -> str:
+        return os.path.basename(self.path)
+
+    # Length of the file from its container, read once per file version
+    def duration(self) -> Optional[timedelta]:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        if self._duration_mtime != mtime:
+            capture = cv2.VideoCapture(self.path)
+            try:
+                fps = capture.get(cv2.CAP_PROP_FPS)
+                frames = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+                self._duration = timedelta(seconds=frames / fps) if fps and fps > 0 and frames > 0 else None
+            finally:
+                capture.release()
+            self._duration_mtime = mtime
+        return self._duration
+
+    # Whether the segment is still playing at `moment`; unknown length: assume it runs until the next one starts
+    def running_at(self, moment: datetime) -> bool:
+        duration = self.duration()
+        return duration is None or moment < self.start + duration
+
+    # Listing entry. Only the last segment (no `next_start`) is probed for its length, the others end
+    # where the next one starts unless their length is already known.
+    def to_dict(self, next_start: Optional[datetime] = None) -> dict:
+        duration = self.duration() if next_start is None else self._duration
+        end = self.start + duration if duration is not None else next_start
+        return {
+            "camera_id": self.camera_id,
+            "file_name": self.file_name,
+            "path": os.path.relpath(self.path, RECORDINGS_DIRECTORY),
+            "start": self.start,
+            "end": end,
+            "duration_seconds": (end - self.start).total_seconds() if end is not None else None,
+        }
+
+
+# Sorted index of one camera's recordings, rebuilt only when the directory changed
+class CameraRecordings:
+    def __init__(self, camera_id: int, directory: str):
+        self.camera_id = camera_id
+        self.directory = directory
+        self.starts: List[datetime] = []
+        self.recordings: List[Recording] = []
+        self._directory_mtime = None
+        self._checked_at = 0.0
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < RECORDING_CATALOG_REFRESH_SECONDS:
+            return
+        self._checked_at = now
+
+        try:
+            directory_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            self.starts, self.recordings, self._directory_mtime = [], [], None
+            return
+        if not force and directory_mtime == self._directory_mtime:
+            return
+
+        # Keep the known entries (and their cached durations), parse only the new names
+        known = {recording.file_name: recording for recording in self.recordings}
+        recordings = []
+        for file_name in os.listdir(self.directory):
+            recording = known.get(file_name)
+            if recording is None:
+                start = parse_recording_start(file_name)
+                if start is None:
+                    if file_name.endswith(('.mp4', '.avi')):
+                        logging.warning(f"Recording catalog: ignoring {file_name}, expected <id>_YYYY-MM-DD_HH-MM-SS")
+                    continue
+                recording = Recording(self.camera_id, os.path.join(self.directory, file_name), start)
+            recordings.append(recording)
+
+        recordings.sort(key=lambda recording: (recording.start, recording.file_name))
+        self.recordings = recordings
+        self.starts = [recording.start for recording in recordings]
+        self._directory_mtime = directory_mtime
+
+    # Add a segment the recorder just closed, without waiting for the next rescan
+    def add(self, path: str) -> Optional[Recording]:
+        start = parse_recording_start(os.path.basename(path))
+        if start is None:
+            return None
+        if any(recording.path == path for recording in self.recordings[-4:]):
+            return None
+        recording = Recording(self.camera_id, path, start)
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.recordings.insert(index, recording)
+        return recording
+
+    def latest(self) -> Optional[Recording]:
+        return self.recordings[-1] if self.recordings else None
+
+    # Last segment starting at or before `moment` (it may have ended already)
+    def at_or_before(self, moment: datetime) -> Optional[Recording]:
+        index = bisect.bisect_right(self.starts, moment) - 1
+        return self.recordings[index] if index >= 0 else None
+
+    # Segments starting up to `end`, from the last one starting at or before `start` (the caller drops it
+    # if it ended before `start`)
+    def between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Recording]:
+        first = 0 if start is None else max(0, bisect.bisect_right(self.starts, start) - 1)
+        last = len(self.recordings) if end is None else bisect.bisect_right(self.starts, end)
+        return self.recordings[first:last]
+
+    def next_after(self, recording: Recording) -> Optional[Recording]:
+        index = bisect.bisect_right(self.starts, recording.start)
+        while index < len(self.recordings) and self.recordings[index] is recording:
+            index += 1
+        return self.recordings[index] if index < len(self.recordings) else None
+
+
+# Catalog of every camera's recordings under RECORDINGS_DIRECTORY/<camera_id>/. The lock only guards the
+# index lookups; file lengths are probed after it is released, a slow file must not stall other cameras.
+class RecordingCatalog:
+    def __init__(self, root: str = RECORDINGS_DIRECTORY):
+        self.root = root
+        self._cameras = {}
+        self._lock = threading.Lock()
+
+    def camera(self, camera_id: int) -> Optional[CameraRecordings]:
+        with self._lock:
+            recordings = self._cameras.get(camera_id)
+            if recordings is None:
+                directory = os.path.join(self.root, str(camera_id))
+                if not os.path.isdir(directory):
+                    return None
+                recordings = self._cameras[camera_id] = CameraRecordings(camera_id, directory)
+            recordings.refresh()
+            return recordings
+
+    def latest(self, camera_id: int) -> Optional[Recording]:
+        recordings = self.camera(camera_id)
+        return recordings.latest() if recordings else None
+
+    # Segment playing at `moment`
+    def covering(self, camera_id: int, moment: datetime) -> Optional[Recording]:
+        recordings = self.camera(camera_id)
+        if recordings is None:
+            return None
+        with self._lock:
+            recording = recordings.at_or_before(moment)
+        return recording if recording is not None and recording.running_at(moment) else None
+
+    # Segments overlapping [start, end]
+    def between(self, camera_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Recording]:
+        recordings = self.camera(camera_id)
+        if recordings is None:
+            return []
+        with self._lock:
+            segments = recordings.between(start, end)
+        if start is not None and segments and segments[0].start < start and not segments[0].running_at(start):
+            segments = segments[1:]
+        return segments
+
+    def next_after(self, recording: Recording) -> Optional[Recording]:
+        recordings = self.camera(recording.camera_id)
+        if recordings is None:
+            return None
+        with self._lock:
+            return recordings.next_after(recording)
+
+    def register(self, camera_id: int, path: str) -> Optional[Recording]:
+        recordings = self.camera(camera_id)
+        if recordings is None:
+            return None
+        with self._lock:
+            return recordings.add(path)
+
+    # Forget the cached state, the next query rescans
+    def invalidate(self, camera_id: Optional[int] = None):
+        with self._lock:
+            if camera_id is None:
+                self._cameras.clear()
+            else:
+                self._cameras.pop(camera_id, None)
+
+
+recording_catalog = RecordingCatalog()
+
+
+# Recordings of a camera overlapping [start, end] as dicts, each with its end time
+def list_recordings(camera_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    recordings = recording_catalog.between(camera_id, naive_local_time(start), naive_local_time(end))
+    result = []
+    for index, recording in enumerate(recordings):
+        next_start = recordings[index + 1].start if index + 1 < len(recordings) else None
+        result.append(recording.to_dict(next_start))
+    return result
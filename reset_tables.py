@@ -1,12 +1,14 @@
 from sqlalchemy import text
 from db_configure import SessionLocal
 from db_initialize import Account, Camera, Counter, ROI, Visitor, Activity, Notification
+from visitor_rollups import reset_visitor_rollups
 
 def reset_tables():
     session = SessionLocal()
     try:
         # Delete records from the child tables first
         session.query(Visitor).delete()
+        reset_visitor_rollups(session)  # Rollups would otherwise still count the deleted visitors
         session.query(ROI).delete()
         session.query(Counter).delete()
         session.query(Camera).delete()
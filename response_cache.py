@@ -0,0 +1,115 @@
+import os
+import copy
+import time
+import threading
+import functools
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0"
+
+_MISSING = object()
+
+
+# Thread-safe TTL + LRU map. Values are stored and handed out as deep copies, so callers may modify what
+# they get. Invalidation is per process: with several workers, entries written elsewhere live until their TTL.
+class TTLCache:
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            value = entry[1]
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drop one key, or everything
+    def invalidate(self, key=_MISSING):
+        with self._lock:
+            self.invalidations += 1
+            if key is _MISSING:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_caches = {}
+
+
+# Named cache, its TTL and size overridable with RESPONSE_CACHE_<NAME>_TTL / RESPONSE_CACHE_<NAME>_MAX_ENTRIES
+def response_cache(name: str, ttl_seconds: float, max_entries: int = 128) -> TTLCache:
+    cache = _caches.get(name)
+    if cache is None:
+        cache = TTLCache(
+            name,
+            float(os.getenv(f"RESPONSE_CACHE_{name.upper()}_TTL", ttl_seconds)),
+            int(os.getenv(f"RESPONSE_CACHE_{name.upper()}_MAX_ENTRIES", max_entries))
+        )
+        _caches[name] = cache
+    return cache
+
+
+# Cache a read service `fn(db, *args)` by its arguments after the session. The result is stored in its
+# JSON form (ORM objects become dicts), which is also what a miss returns, so hits and misses look alike.
+# Exceptions (e.g. a 404 HTTPException) and empty results are not cached: empty ones are cheap to
+# recompute, and some services return them in place of an error.
+def cached_read(cache: TTLCache):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(db, *args, **kwargs):
+            if not RESPONSE_CACHE_ENABLED:
+                return fn(db, *args, **kwargs)
+            key = args + tuple(sorted(kwargs.items()))
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = jsonable_encoder(fn(db, *args, **kwargs))
+                if value:
+                    cache.set(key, value)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+# Hit/miss counters of every cache of this worker
+def response_cache_stats() -> dict:
+    return {"enabled": RESPONSE_CACHE_ENABLED, "caches": {name: cache.stats() for name, cache in _caches.items()}}
@@ -0,0 +1,246 @@
+import os
+import ast
+import time
+import logging
+import threading
+import numpy as np
+import cv2
+from typing import List, Optional, Tuple
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+ROI_CACHE_REVALIDATE_SECONDS = float(os.getenv("ROI_CACHE_REVALIDATE_SECONDS", 30))  # Re-read a camera's ROIs this often (edits from other processes)
+ROI_MASK_MAX_ROIS = 64  # One bit per ROI in the rasterized mask
+
+
+# "[x1,y1,x2,y2]" rectangle or "[[x,y],[x,y],...]" polygon, in pixels of the camera frame; None when unusable
+def parse_roi_coordinates(roi_coor: str) -> Optional[np.ndarray]:
+    try:
+        points = np.asarray(ast.literal_eval(roi_coor.strip()), dtype=np.float32)
+    except (ValueError, SyntaxError, TypeError, AttributeError):
+        return None
+    if points.shape == (4,):
+        x1, y1, x2, y2 = points
+        points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float32)
+    if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+        return None
+    return points
+
+
+# Even-odd test of N points against R polygons at once: (N, 2) points -> (N, R) bool.
+# Polygons are padded to the same vertex count with degenerate edges, which never cross the ray.
+def points_in_polygons(points: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    x = points[:, 0][:, None, None]
+    y = points[:, 1][:, None, None]
+    x1, y1 = starts[None, :, :, 0], starts[None, :, :, 1]
+    x2, y2 = ends[None, :, :, 0], ends[None, :, :, 1]
+    straddles = (y1 > y) != (y2 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    crossings = straddles & (x < crossing_x)
+    return np.count_nonzero(crossings, axis=2) % 2 == 1
+
+
+# The ROIs of one camera, ready for vectorized membership tests. With the frame size known the ROIs are
+# rasterized once into a bit mask (bit r = ROI r) and a lookup is one gather per point; otherwise the
+# points are bounding-box filtered and run through the vectorized polygon test.
+class RoiSet:
+    def __init__(self, rois: List[Tuple[int, np.ndarray]]):
+        self.roi_ids = np.asarray([roi_id for roi_id, _ in rois], dtype=np.int64)
+        self.polygons = [polygon for _, polygon in rois]
+        self._masks = {}
+
+        vertices = max((len(polygon) for polygon in self.polygons), default=0)
+        self._starts = np.zeros((len(rois), vertices, 2), dtype=np.float32)
+        self._ends = np.zeros((len(rois), vertices, 2), dtype=np.float32)
+        self.bounds = np.zeros((len(rois), 4), dtype=np.float32)
+        for index, polygon in enumerate(self.polygons):
+            count = len(polygon)
+            self._starts[index, :count] = polygon
+            self._ends[index, :count] = np.roll(polygon, -1, axis=0)
+            # Padding repeats the last vertex: zero-length edges
+            self._starts[index, count:] = polygon[-1]
+            self._ends[index, count:] = polygon[-1]
+            self.bounds[index] = (*polygon.min(axis=0), *polygon.max(axis=0))
+
+    @classmethod
+    def from_rows(cls, rows, camera_id: Optional[int] = None) -> "RoiSet":
+        rois = []
+        for roi_id, roi_coor in rows:
+            polygon = parse_roi_coordinates(roi_coor)
+            if polygon is None:
+                logging.warning(f"ROI {roi_id} of camera {camera_id} has unusable coordinates {roi_coor!r}")
+            else:
+                rois.append((roi_id, polygon))
+        return cls(rois)
+
+    def __len__(self):
+        return len(self.roi_ids)
+
+    def _mask(self, width: int, height: int) -> np.ndarray:
+        mask = self._masks.get((width, height))
+        if mask is None:
+            mask = np.zeros((height, width), dtype=np.uint64)
+            layer = np.zeros((height, width), dtype=np.uint8)
+            for index, polygon in enumerate(self.polygons):
+                layer[:] = 0
+                cv2.fillPoly(layer, [np.round(polygon).astype(np.int32)], 1)
+                mask |= layer.astype(np.uint64) << np.uint64(index)
+            self._masks[(width, height)] = mask
+        return mask
+
+    # (N, 2) points -> (N, R) bool, column r for ROI roi_ids[r]
+    def contains(self, points: np.ndarray, frame_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if not len(self) or not len(points):
+            return np.zeros((len(points), len(self)), dtype=bool)
+
+        if frame_size is not None and len(self) <= ROI_MASK_MAX_ROIS:
+            width, height = frame_size
+            columns = np.floor(points[:, 0]).astype(np.int64)
+            rows = np.floor(points[:, 1]).astype(np.int64)
+            in_frame = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+            bits = np.zeros(len(points), dtype=np.uint64)
+            bits[in_frame] = self._mask(width, height)[rows[in_frame], columns[in_frame]]
+            return (bits[:, None] >> np.arange(len(self), dtype=np.uint64)[None, :]) & np.uint64(1) == 1
+
+        # Only the points inside at least one bounding box go through the polygon test
+        in_bounds = ((points[:, None, 0] >= self.bounds[None, :, 0]) & (points[:, None, 0] <= self.bounds[None, :, 2]) &
+                     (points[:, None, 1] >= self.bounds[None, :, 1]) & (points[:, None, 1] <= self.bounds[None, :, 3]))
+        candidates = np.flatnonzero(in_bounds.any(axis=1))
+        inside = np.zeros(in_bounds.shape, dtype=bool)
+        if len(candidates):
+            inside[candidates] = points_in_polygons(points[candidates], self._starts, self._ends) & in_bounds[candidates]
+        return inside
+
+
+###########################################################################################
+################################### Dwell time ############################################
+###########################################################################################
+
+# Per-person, per-ROI visit state in two (persons, ROIs) arrays: the entry time and the last time the
+# person was seen inside, NaN while outside. Person ids only grow, so rows stay sorted and are found
+# with searchsorted.
+class DwellState:
+    def __init__(self, roi_ids):
+        self.roi_ids = np.asarray(roi_ids)
+        self.person_ids = np.empty(0, dtype=np.int64)
+        self.entered = np.empty((0, len(self.roi_ids)), dtype=np.float64)
+        self.last_inside = np.empty((0, len(self.roi_ids)), dtype=np.float64)
+
+    def _rows(self, person_ids: np.ndarray) -> np.ndarray:
+        rows = np.searchsorted(self.person_ids, person_ids)
+        known = (rows < len(self.person_ids)) & (self.person_ids[np.minimum(rows, len(self.person_ids) - 1)] == person_ids) \
+            if len(self.person_ids) else np.zeros(len(person_ids), dtype=bool)
+        new_ids = np.unique(person_ids[~known])
+        if len(new_ids):
+            self.person_ids = np.concatenate([self.person_ids, new_ids])
+            order = np.argsort(self.person_ids, kind="stable")
+            blank = np.full((len(new_ids), len(self.roi_ids)), np.nan)
+            self.person_ids = self.person_ids[order]
+            self.entered = np.concatenate([self.entered, blank])[order]
+            self.last_inside = np.concatenate([self.last_inside, blank])[order]
+            rows = np.searchsorted(self.person_ids, person_ids)
+        return rows
+
+    def _closed(self, rows: np.ndarray, columns: np.ndarray):
+        return (self.person_ids[rows], self.roi_ids[columns], self.entered[rows, columns], self.last_inside[rows, columns])
+
+    # Apply one frame: `inside` is (N, R) for `person_ids`. Returns (visits started, visits ended), each as
+    # arrays (person ids, roi ids, entered at, last inside at)
+    def update(self, person_ids: np.ndarray, inside: np.ndarray, now: float):
+        person_ids = np.asarray(person_ids, dtype=np.int64)
+        rows = self._rows(person_ids)
+        was_inside = ~np.isnan(self.entered[rows])
+
+        started_rows, started_columns = np.nonzero(inside & ~was_inside)
+        self.entered[rows[started_rows], started_columns] = now
+        self.last_inside[rows[started_rows], started_columns] = now
+        staying_rows, staying_columns = np.nonzero(inside & was_inside)
+        self.last_inside[rows[staying_rows], staying_columns] = now
+
+        ended_rows, ended_columns = np.nonzero(~inside & was_inside)
+        ended = self._closed(rows[ended_rows], ended_columns)
+        self.entered[rows[ended_rows], ended_columns] = np.nan
+        self.last_inside[rows[ended_rows], ended_columns] = np.nan
+        return self._closed(rows[started_rows], started_columns), ended
+
+    # Forget people who left; returns their open visits like update()
+    def end_persons(self, person_ids: np.ndarray):
+        person_ids = np.asarray(person_ids, dtype=np.int64)
+        present = np.isin(self.person_ids, person_ids)
+        rows, columns = np.nonzero(~np.isnan(self.entered) & present[:, None])
+        ended = self._closed(rows, columns)
+        self.person_ids = self.person_ids[~present]
+        self.entered = self.entered[~present]
+        self.last_inside = self.last_inside[~present]
+        return ended
+
+    # Follow a new ROI list: columns of kept ROIs move along, removed ROIs' open visits are returned as ended
+    def remap(self, roi_ids):
+        roi_ids = np.asarray(roi_ids)
+        kept = np.isin(self.roi_ids, roi_ids)
+        rows, columns = np.nonzero(~np.isnan(self.entered[:, ~kept]))
+        ended = self._closed(rows, np.flatnonzero(~kept)[columns])
+
+        entered = np.full((len(self.person_ids), len(roi_ids)), np.nan)
+        last_inside = np.full((len(self.person_ids), len(roi_ids)), np.nan)
+        old_columns = {roi_id: index for index, roi_id in enumerate(self.roi_ids.tolist())}
+        for new_column, roi_id in enumerate(roi_ids.tolist()):
+            old_column = old_columns.get(roi_id)
+            if old_column is not None:
+                entered[:, new_column] = self.entered[:, old_column]
+                last_inside[:, new_column] = self.last_inside[:, old_column]
+        self.roi_ids, self.entered, self.last_inside = roi_ids, entered, last_inside
+        return ended
+
+
+###########################################################################################
+################################### Cache #################################################
+###########################################################################################
+
+# Parsed ROIs per camera. roi_edit_save/delete_roi_for_camera invalidate an entry; other processes
+# (the analytics workers) re-read theirs every ROI_CACHE_REVALIDATE_SECONDS and keep the parsed set
+# (and its masks) when nothing changed.
+class RoiCache:
+    def __init__(self):
+        self._entries = {}  # camera_id -> (RoiSet, rows, loaded_at)
+        self._lock = threading.Lock()
+
+    def get(self, camera_id: int, db=None) -> RoiSet:
+        with self._lock:
+            entry = self._entries.get(camera_id)
+        if entry is not None and time.monotonic() - entry[2] < ROI_CACHE_REVALIDATE_SECONDS:
+            return entry[0]
+
+        rows = self._load(camera_id, db)
+        if entry is not None and entry[1] == rows:
+            roi_set = entry[0]
+        else:
+            roi_set = RoiSet.from_rows(rows, camera_id)
+        with self._lock:
+            self._entries[camera_id] = (roi_set, rows, time.monotonic())
+        return roi_set
+
+    @staticmethod
+    def _load(camera_id: int, db=None):
+        from db_configure import SessionLocal
+        from db_initialize import ROI
+
+        session = db or SessionLocal()
+        try:
+            return [tuple(row) for row in session.query(ROI.roi_id, ROI.roi_coor).filter(ROI.camera_id == camera_id).order_by(ROI.roi_id)]
+        finally:
+            if db is None:
+                session.close()
+
+    def invalidate(self, camera_id: Optional[int] = None):
+        with self._lock:
+            if camera_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(camera_id, None)
+
+
+roi_cache = RoiCache()
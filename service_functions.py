@@ -1,24 +1,46 @@
 import os
 import cv2
+import csv
+import json
+import base64
+import hashlib
+import time
 import secrets
+import tempfile
+import asyncio
 import logging
+import threading
 import pandas as pd
+from openpyxl import Workbook
+try:
+    # Optional, only needed by the Parquet/Arrow exports
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 from fastapi import Depends, HTTPException, status
 from starlette.responses import StreamingResponse
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr
 from db_initialize import Account, Camera, Counter, ROI, Visitor, Activity, Notification, Exhibition
-from db_configure import SessionLocal
+from db_configure import SessionLocal, read_session, run_read_db
+from visitor_rollups import query_visitor_rollups
+from frame_hub import subscribe_frames, mjpeg_stream, MJPEG_JPEG_QUALITY
+from frame_cache import open_cached_frames, CachedFrameStream
+from recording_catalog import recording_catalog, RECORDINGS_DIRECTORY
+from roi_geometry import roi_cache
+from response_cache import response_cache, cached_read
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc, delete
-from sqlalchemy.exc import IntegrityError
-from typing import Optional, Generator
+from sqlalchemy import func, desc, delete, cast, Integer, select, tuple_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from typing import Optional, Generator, AsyncGenerator
+from collections import OrderedDict
 import psutil  # For CPU, memory, and disk usage
 import platform
 import GPUtil 
-from io import BytesIO
+from io import BytesIO, StringIO
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -36,6 +58,14 @@ def get_db():
     finally:
         db.close()
 
+# Read-only dependency for dashboards, reports and exports: a replica session when one is configured and fresh
+def get_read_db():
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Login data model for request body
 class LoginData(BaseModel):
     username: str
@@ -100,7 +130,33 @@ def login(login_data: LoginData, db: Session):
 
 
 
+# Configuration lists change only through the CRUD services below, which invalidate their caches;
+# the TTLs bound how long another worker's write can go unseen
+counters_cache = response_cache("counters", 300)
+cameras_cache = response_cache("cameras", 60)
+rois_cache = response_cache("rois", 60, max_entries=256)
+users_cache = response_cache("users", 60)
+exhibitions_cache = response_cache("exhibitions", 60)
+exhibition_names_cache = response_cache("exhibition_names", 60)
+
+
+def invalidate_camera_caches(camera_id: Optional[int] = None):
+    cameras_cache.invalidate()
+    if camera_id is None:
+        rois_cache.invalidate()
+    else:
+        rois_cache.invalidate((camera_id,))
+
+
+def invalidate_exhibition_caches():
+    exhibitions_cache.invalidate()
+    exhibition_names_cache.invalidate()
+    # Cameras carry their exhibition
+    cameras_cache.invalidate()
+
+
 # Function to get counter list
+@cached_read(counters_cache)
 def get_counter_list(db: Session):
     counters = db.query(Counter).all()  # a Counter model
     return counters
@@ -143,39 +199,29 @@ def get_logged_in_user(username: str, db: Session):
 
 # Function to find the least visited counter today and calculate the average duration
 def least_visited_counter(db: Session):
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    least_visited_result = (
-        db.query(
-            Visitor.counter_id,
-            func.count(Visitor.person_id).label('visitor_count'),
-            func.sum(Visitor.person_duration_in_roi).label('total_duration')
-        )
-        # the filter to restrict the query to today's visits
-        # .filter(Visitor.current_datetime >= today_start)
-        .group_by(Visitor.counter_id)
-        .order_by(func.count(Visitor.person_id).asc())  # Least visited first
-        .first()
-    )
-    
-    if least_visited_result:
-        counter_id, visitor_count, total_duration = least_visited_result
-        average_duration = round(total_duration / visitor_count, 2) if visitor_count > 0 else 0.00
-        return {
-            "counter_id": counter_id,
-            "visitor_count": visitor_count,
-            "average_duration": average_duration
-        }
+    # Per-counter totals over all visits
+    counter_totals = query_visitor_rollups(db, dimensions=('counter_id',))
+
+    return _least_visited_summary(counter_totals)
+
+
+# Least visited counter from per-counter rollup totals
+def _least_visited_summary(counter_totals):
+    if counter_totals:
+        # Least visited first
+        least_visited_result = min(counter_totals, key=lambda row: (row['visitor_count'], row['counter_id'] or 0))
+        return _counter_summary(least_visited_result['counter_id'], least_visited_result['visitor_count'],
+                                least_visited_result['total_duration'])
     
     return {"message": "No visitors found today."}
 
 # Function to get total number of visitors
 def get_total_visitors(db: Session):
-    # Count the total number of visitors
-    total_visitors = db.query(func.count(Visitor.person_id)).filter(Visitor.person_id.isnot(None)).scalar()
-    
-    # Sum the total duration of all visitors in the ROI
-    total_duration = db.query(func.sum(Visitor.person_duration_in_roi)).scalar()
+    totals = query_visitor_rollups(db)
+
+    # Count the total number of visitors and sum their duration in the ROI
+    total_visitors = totals[0]['visitor_count'] if totals else 0
+    total_duration = totals[0]['total_duration'] if totals else 0
     
     # Calculate the average duration per visitor, rounded to two decimal places
     average_duration = round(total_duration / total_visitors, 2) if total_visitors > 0 else 0.00
@@ -207,310 +253,314 @@ def most_visited_counter_no_slot_time_for_latest_date_func(db: Session):
     
     if most_visited_result:
         counter_id, visitor_count, total_duration = most_visited_result
-        average_duration = round(total_duration / visitor_count, 2) if visitor_count > 0 else 0.00
-        return {
-            "counter_id": counter_id,
-            "visitor_count": visitor_count,
-            "average_duration": average_duration
-        }
+        return _counter_summary(counter_id, visitor_count, total_duration)
     
     return {"message": "No visitors found today."}
 
 
+def _counter_summary(counter_id, visitor_count, total_duration):
+    average_duration = round((total_duration or 0) / visitor_count, 2) if visitor_count > 0 else 0.00
+    return {
+        "counter_id": counter_id,
+        "visitor_count": visitor_count,
+        "average_duration": average_duration
+    }
+
+
 
 
 
 
-def most_visited_counter_for_each_slot_time_in_latest_date_func(db: Session):
-    # Get the latest datetime from the current_datetime field
+# Opening hours and slot width used by the slot-time dashboard services
+SLOT_OPENING_HOUR = int(os.getenv("SLOT_OPENING_HOUR", 8))
+SLOT_CLOSING_HOUR = int(os.getenv("SLOT_CLOSING_HOUR", 22))
+SLOT_MINUTES = int(os.getenv("SLOT_MINUTES", 30))
+
+
+# Function to get the latest date that has visitor records
+def get_latest_visit_date(db: Session):
     latest_datetime = db.query(func.max(Visitor.current_datetime)).scalar()
-    
-    if not latest_datetime:
-        return {"message": "No data available in the database."}
-    
-    # Extract the latest date (ignoring the time component)
-    latest_date = latest_datetime.date()
-    
-    # Define start and end time for the time slots (8 AM to 10 PM) on the latest date
-    start_time = datetime.combine(latest_date, datetime.min.time()).replace(hour=8, minute=0, second=0, microsecond=0)
-    end_time = datetime.combine(latest_date, datetime.min.time()).replace(hour=22, minute=0, second=0, microsecond=0)
-    
-    # Define time slot interval (30 minutes)
+    return latest_datetime.date() if latest_datetime else None
+
+
+# Build the (slot_start, slot_end) pairs of a day between the opening and closing hours
+def build_time_slots(day, opening_hour: int = SLOT_OPENING_HOUR, closing_hour: int = SLOT_CLOSING_HOUR, slot_minutes: int = SLOT_MINUTES):
+    if slot_minutes <= 0:
+        raise ValueError("Slot width must be a positive number of minutes.")
+
+    day_start = datetime.combine(day, datetime.min.time())
+    start_time = day_start + timedelta(hours=opening_hour)
+    end_time = day_start + timedelta(hours=closing_hour)
+
     time_slots = []
     while start_time < end_time:
-        end_slot_time = start_time + timedelta(minutes=30)
+        end_slot_time = min(start_time + timedelta(minutes=slot_minutes), end_time)
         time_slots.append((start_time, end_slot_time))
         start_time = end_slot_time
+    return time_slots
 
-    # Prepare the result list for each time slot
-    results = []
 
-    # Loop through each time slot and get the most visited counter
-    for slot_start, slot_end in time_slots:
-        most_visited_result = (
-            db.query(
-                Visitor.counter_id,
-                func.count(Visitor.person_id).label('visitor_count'),
-                func.sum(Visitor.person_duration_in_roi).label('total_duration'),
-                func.date(Visitor.current_datetime).label('date')
-            )
-            .filter(Visitor.current_datetime >= slot_start, Visitor.current_datetime < slot_end)
-            .group_by(Visitor.counter_id, func.date(Visitor.current_datetime))  # Add date to GROUP BY
-            .order_by(func.count(Visitor.person_id).desc())
-            .first()
+# Aggregate visitor count and duration per (time slot, counter) of a day in one bucketed query
+def aggregate_slot_counts(db: Session, day, opening_hour: int = SLOT_OPENING_HOUR, closing_hour: int = SLOT_CLOSING_HOUR, slot_minutes: int = SLOT_MINUTES):
+    time_slots = build_time_slots(day, opening_hour, closing_hour, slot_minutes)
+    slot_counts = [[] for _ in time_slots]
+    if not time_slots:
+        return time_slots, slot_counts
+
+    range_start = time_slots[0][0]
+    range_end = time_slots[-1][1]
+
+    # Slot index = floor((epoch(current_datetime) - epoch(range_start)) / slot width)
+    range_start_epoch = (range_start - datetime(1970, 1, 1)).total_seconds()
+    slot_index = cast(
+        func.floor((func.extract('epoch', Visitor.current_datetime) - range_start_epoch) / (slot_minutes * 60)),
+        Integer
+    ).label('slot_index')
+
+    rows = (
+        db.query(
+            slot_index,
+            Visitor.counter_id,
+            func.count(Visitor.person_id).label('visitor_count'),
+            func.sum(Visitor.person_duration_in_roi).label('total_duration')
         )
+        .filter(Visitor.current_datetime >= range_start, Visitor.current_datetime < range_end)
+        .group_by(slot_index, Visitor.counter_id)
+        .all()
+    )
 
-        if most_visited_result:
-            counter_id, visitor_count, total_duration, visit_date = most_visited_result
-            average_duration = round(total_duration / visitor_count, 2) if visitor_count > 0 else 0.00
-            results.append({
-                "time_slot": f"{slot_start.strftime('%H:%M')}-{slot_end.strftime('%H:%M')}",
-                "counter_id": counter_id,
-                "visitor_count": visitor_count,
-                "average_duration": average_duration,
-                "visit_date": visit_date.strftime('%Y-%m-%d')
-            })
-        else:
-            results.append({
-                "time_slot": f"{slot_start.strftime('%H:%M')}-{slot_end.strftime('%H:%M')}",
-                "message": "No visitors"
-            })
+    for index, counter_id, visitor_count, total_duration in rows:
+        if 0 <= index < len(slot_counts):
+            slot_counts[index].append((counter_id, visitor_count, total_duration or 0))
 
-    return results
+    return time_slots, slot_counts
 
 
+# Pick the most (or least) visited counter of a slot, ties go to the lowest counter_id
+def _pick_slot_counter(counts, most_visited: bool = True):
+    counts = [row for row in counts if row[1] > 0]
+    if not counts:
+        return None
+    if most_visited:
+        return min(counts, key=lambda row: (-row[1], row[0] or 0))
+    return min(counts, key=lambda row: (row[1], row[0] or 0))
 
 
+def _format_time_slot(slot_start: datetime, slot_end: datetime) -> str:
+    return f"{slot_start.strftime('%H:%M')}-{slot_end.strftime('%H:%M')}"
 
 
+def _slot_counter_summary(slot_start: datetime, slot_end: datetime, counter_row):
+    counter_id, visitor_count, total_duration = counter_row
+    average_duration = round(total_duration / visitor_count, 2) if visitor_count > 0 else 0.00
+    return {
+        "time_slot": _format_time_slot(slot_start, slot_end),
+        "counter_id": counter_id,
+        "visitor_count": visitor_count,
+        "average_duration": average_duration
+    }
 
 
+def most_visited_counter_for_each_slot_time_in_latest_date_func(
+    db: Session,
+    opening_hour: int = SLOT_OPENING_HOUR,
+    closing_hour: int = SLOT_CLOSING_HOUR,
+    slot_minutes: int = SLOT_MINUTES
+):
+    # Get the latest date (ignoring the time component) from the current_datetime field
+    latest_date = get_latest_visit_date(db)
 
+    if not latest_date:
+        return {"message": "No data available in the database."}
 
+    # Per-slot, per-counter counts for the latest date
+    time_slots, slot_counts = aggregate_slot_counts(db, latest_date, opening_hour, closing_hour, slot_minutes)
 
+    return slot_most_visited_each(latest_date, time_slots, slot_counts)
 
 
+# Most visited counter of every slot of `day`, from aggregate_slot_counts
+def slot_most_visited_each(day, time_slots, slot_counts):
+    results = []
+    for (slot_start, slot_end), counts in zip(time_slots, slot_counts):
+        most_visited_result = _pick_slot_counter(counts, most_visited=True)
 
+        if most_visited_result:
+            summary = _slot_counter_summary(slot_start, slot_end, most_visited_result)
+            summary["visit_date"] = day.strftime('%Y-%m-%d')
+            results.append(summary)
+        else:
+            results.append({
+                "time_slot": _format_time_slot(slot_start, slot_end),
+                "message": "No visitors"
+            })
 
+    return results
 
 
 # This function identifies the most visited counter during specific time slots on the latest date stored in the database.
-def most_visited_counter_for_latest_date_slot_time_func(db: Session):
-
+def most_visited_counter_for_latest_date_slot_time_func(
+    db: Session,
+    opening_hour: int = SLOT_OPENING_HOUR,
+    closing_hour: int = SLOT_CLOSING_HOUR,
+    slot_minutes: int = SLOT_MINUTES
+):
     # Get the latest date from the current_datetime field in the database
-    latest_date = db.query(func.max(Visitor.current_datetime)).scalar()
-    
+    latest_date = get_latest_visit_date(db)
+
     if not latest_date:
         return {"message": "No data available."}
 
-    # Extract the date part of the latest datetime (ignore time)
-    latest_date = latest_date.date()
-    
-    # Define start and end time for the time slots (8 AM to 10 PM) for the latest date
-    start_time = datetime.combine(latest_date, datetime.min.time()).replace(hour=8, minute=0, second=0, microsecond=0)
-    end_time = datetime.combine(latest_date, datetime.min.time()).replace(hour=22, minute=0, second=0, microsecond=0)
-    
-    # Define time slot interval (30 minutes)
-    time_slots = []
-    while start_time < end_time:
-        end_slot_time = start_time + timedelta(minutes=30)
-        time_slots.append((start_time, end_slot_time))
-        start_time = end_slot_time
+    time_slots, slot_counts = aggregate_slot_counts(db, latest_date, opening_hour, closing_hour, slot_minutes)
+    return slot_extreme_overall(time_slots, slot_counts, most_visited=True)
+
+
+# The (slot, counter) with the most (or fewest) visitors of the day, the earliest slot wins on equal counts
+def slot_extreme_overall(time_slots, slot_counts, most_visited: bool = True):
+    best = None
+    best_count = None
+
+    for (slot_start, slot_end), counts in zip(time_slots, slot_counts):
+        slot_result = _pick_slot_counter(counts, most_visited=most_visited)
+        if slot_result is None:
+            continue
+        if best_count is None or (slot_result[1] > best_count if most_visited else slot_result[1] < best_count):
+            best = _slot_counter_summary(slot_start, slot_end, slot_result)
+            best_count = slot_result[1]
+
+    if best:
+        return best
 
-    # Track the most visited counter overall
-    most_visited_overall = None
-    max_visitor_count = 0  # Variable to store the highest visitor count
-    
-    # Loop through each time slot and get the most visited counter
-    for slot_start, slot_end in time_slots:
-        most_visited_result = (
-            db.query(
-                Visitor.counter_id,
-                func.count(Visitor.person_id).label('visitor_count'),
-                func.sum(Visitor.person_duration_in_roi).label('total_duration')
-            )
-            .filter(Visitor.current_datetime >= slot_start, Visitor.current_datetime < slot_end)
-            .group_by(Visitor.counter_id)
-            .order_by(func.count(Visitor.person_id).desc())  # Most visited first
-            .first()
-        )
-        
-        if most_visited_result:
-            counter_id, visitor_count, total_duration = most_visited_result
-            average_duration = round(total_duration / visitor_count, 2) if visitor_count > 0 else 0.00
-            
-            # Update the overall most visited if this slot has more visitors
-            if visitor_count > max_visitor_count:
-                most_visited_overall = {
-                    "time_slot": f"{slot_start.strftime('%H:%M')}-{slot_end.strftime('%H:%M')}",
-                    "counter_id": counter_id,
-                    "visitor_count": visitor_count,
-                    "average_duration": average_duration
-                }
-                max_visitor_count = visitor_count
-
-    # Return the most visited counter overall (if found)
-    if most_visited_overall:
-        return most_visited_overall
-    
     # If no visitors found in any slot
     return {"message": "No visitors found in any time slot."}
 
 
-
 # Function to identify the minimum visited counter in time slots for the latest date
-def minimum_visited_counter_for_latest_date_slot_time_func(db: Session):
+def minimum_visited_counter_for_latest_date_slot_time_func(
+    db: Session,
+    opening_hour: int = SLOT_OPENING_HOUR,
+    closing_hour: int = SLOT_CLOSING_HOUR,
+    slot_minutes: int = SLOT_MINUTES
+):
     # Step 1: Get the latest date from the current_datetime field in the database
-    latest_date = db.query(func.max(Visitor.current_datetime)).scalar()
-    
+    latest_date = get_latest_visit_date(db)
+
     if not latest_date:
         return {"message": "No data available."}
 
-    # Extract the date part of the latest datetime (ignore time)
-    latest_date = latest_date.date()
-
-    # Step 2: Define start and end time for the time slots (8 AM to 10 PM) for the latest date
-    start_time = datetime.combine(latest_date, datetime.min.time()).replace(hour=8, minute=0, second=0, microsecond=0)
-    end_time = datetime.combine(latest_date, datetime.min.time()).replace(hour=22, minute=0, second=0, microsecond=0)
+    # Step 2: Per-slot, per-counter counts for the latest date
+    time_slots, slot_counts = aggregate_slot_counts(db, latest_date, opening_hour, closing_hour, slot_minutes)
 
-    # Step 3: Define time slot interval (30 minutes)
-    time_slots = []
-    while start_time < end_time:
-        end_slot_time = start_time + timedelta(minutes=30)
-        time_slots.append((start_time, end_slot_time))
-        start_time = end_slot_time
+    # Step 3: The least visited counter of each slot, keeping the overall minimum
+    return slot_extreme_overall(time_slots, slot_counts, most_visited=False)
 
-    # Track the minimum visited counter overall
-    min_visited_overall = None
-    min_visitor_count = float('inf')  # Initialize to a very high value
-
-    # Step 4: Loop through each time slot and find the minimum visited counter
-    for slot_start, slot_end in time_slots:
-        min_visited_result = (
-            db.query(
-                Visitor.counter_id,
-                func.count(Visitor.person_id).label('visitor_count'),
-                func.sum(Visitor.person_duration_in_roi).label('total_duration')
-            )
-            .filter(Visitor.current_datetime >= slot_start, Visitor.current_datetime < slot_end)
-            .group_by(Visitor.counter_id)
-            .order_by(func.count(Visitor.person_id).asc())  # Least visited first
-            .first()
-        )
 
-        if min_visited_result:
-            counter_id, visitor_count, total_duration = min_visited_result
-            average_duration = round(total_duration / visitor_count, 2) if visitor_count > 0 else 0.00
+###################################################################################################
+################### End of Most Visisted Counter Ideetifications Services #########################
+###################################################################################################
 
-            # Update the overall minimum visited if this slot has fewer visitors
-            if visitor_count < min_visitor_count:
-                min_visited_overall = {
-                    "time_slot": f"{slot_start.strftime('%H:%M')}-{slot_end.strftime('%H:%M')}",
-                    "counter_id": counter_id,
-                    "visitor_count": visitor_count,
-                    "average_duration": average_duration
-                }
-                min_visitor_count = visitor_count
 
-    # Step 5: Return the minimum visited counter overall (if found)
-    if min_visited_overall:
-        return min_visited_overall
 
-    # If no visitors found in any slot
-    return {"message": "No visitors found in any time slot."}
+# Age groups and genders reported by the monitoring charts
+AGE_GROUPS = ['Child', 'Teenager', 'Young', 'Adult', 'Middle Age', 'Elderly']
+GENDERS = ['male', 'female']
 
+# Results of age/gender monitoring are kept for a short time per normalized date range
+MONITORING_CACHE_TTL_SECONDS = float(os.getenv("MONITORING_CACHE_TTL_SECONDS", 30))
+MONITORING_CACHE_MAX_ENTRIES = int(os.getenv("MONITORING_CACHE_MAX_ENTRIES", 128))
+monitoring_cache = response_cache("monitoring", MONITORING_CACHE_TTL_SECONDS, MONITORING_CACHE_MAX_ENTRIES)
 
-###################################################################################################
-################### End of Most Visisted Counter Ideetifications Services #########################
-###################################################################################################
 
+# Drop all cached monitoring results (e.g. after bulk visitor changes)
+def clear_monitoring_cache():
+    monitoring_cache.invalidate()
 
 
-# Function to find the number of age groups of visitors for each counter within the specified date-time
-def age_monitoring(selected_date_range: dict, db: Session):
-    # Parse the 'start_date' from the request
+# Parse the monitoring date range, the start is always moved to 8 AM
+def _parse_monitoring_range(selected_date_range: dict):
     start_date = datetime.strptime(selected_date_range['start_date'], '%Y-%m-%d %H:%M:%S')
-    # Set the time to 8 AM
     start_date = start_date.replace(hour=8, minute=0, second=0)
-
-    # Parse the 'end_date' from the request
     end_date = datetime.strptime(selected_date_range['end_date'], '%Y-%m-%d %H:%M:%S')
+    return start_date, end_date
 
-    # Age groups as strings
-    age_groups = ['Child', 'Teenager', 'Young', 'Adult', 'Middle Age', 'Elderly']
 
-    # Get distinct counter_ids from the Visitor table
-    counters = db.query(Visitor.counter_id).distinct().all()
+# Count visitors per (counter_id, column value) in the date range with a single grouped query
+def _count_per_counter_and_column(db: Session, column, start_date: datetime, end_date: datetime):
+    # Every counter that ever had a visitor is reported, even with zero visits in the range
+    counters = [row[0] for row in db.query(Visitor.counter_id).distinct().order_by(Visitor.counter_id).all()]
 
-    # Initialize result list
-    result = []
+    rows = (
+        db.query(Visitor.counter_id, column, func.count(Visitor.id))
+        .filter(Visitor.current_datetime.between(start_date, end_date))
+        .group_by(Visitor.counter_id, column)
+        .all()
+    )
 
-    # Loop through each distinct counter_id
-    for counter_tuple in counters:
-        counter = counter_tuple[0]  # Extract the counter_id from the tuple
-        counter_data = {'counter_id': counter, 'age_groups': {group: 0 for group in age_groups}}
-        
-        # Loop through each age group and perform the count query
-        for group in age_groups:
-            count = db.query(func.count(Visitor.id)).filter(
-                Visitor.counter_id == counter,
-                Visitor.person_age_group == group,  # Compare to the string directly
-                Visitor.current_datetime.between(start_date, end_date)  # Filter by datetime range
-            ).scalar()  # Use scalar() to get the count result
-        
-            # Add the count to the counter data under the corresponding age group
-            counter_data['age_groups'][group] = count
+    counts = {}
+    for counter_id, value, count in rows:
+        counts[(counter_id, value)] = count
+    return counters, counts
 
-        # Append the counter data for each counter to the result list
-        result.append(counter_data)
 
-    # Return the aggregated result
-    return result
+# Function to find the number of age groups of visitors for each counter within the specified date-time
+def age_monitoring(selected_date_range: dict, db: Session):
+    start_date, end_date = _parse_monitoring_range(selected_date_range)
 
-# Function to find the number of male and femal visitors for each counter within the specified date-time
-def gender_monitoring(selected_date_range: dict, db: Session):
-    # Parse the 'start_date' from the request and set the time to 8 AM
-    start_date = datetime.strptime(selected_date_range['start_date'], '%Y-%m-%d %H:%M:%S')
-    start_date = start_date.replace(hour=8, minute=0, second=0)
+    cache_key = ('age', start_date, end_date)
+    cached = monitoring_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-    # Parse the 'end_date' from the request
-    end_date = datetime.strptime(selected_date_range['end_date'], '%Y-%m-%d %H:%M:%S')
+    counters, counts = _count_per_counter_and_column(db, Visitor.person_age_group, start_date, end_date)
+    result = _pivot_age_counts(counters, counts)
 
-    # Get all distinct counter_ids
-    counters = db.query(Visitor.counter_id).distinct().all()
+    monitoring_cache.set(cache_key, result)
+    return result
 
-    result = []
 
-    # Loop through each counter and count male/female visitors in the selected date range
-    for counter in counters:
-        counter_id = counter[0]  # Extract the counter_id
+# Pivot (counter_id, age group) counts into one entry per counter
+def _pivot_age_counts(counters, counts):
+    return [
+        {
+            'counter_id': counter,
+            'age_groups': {group: counts.get((counter, group), 0) for group in AGE_GROUPS}
+        }
+        for counter in counters
+    ]
 
-        male_count = db.query(Visitor).filter(
-            Visitor.counter_id == counter_id,
-            Visitor.person_gender == 'male',
-            Visitor.current_datetime.between(start_date, end_date)
-        ).count()
+# Function to find the number of male and femal visitors for each counter within the specified date-time
+def gender_monitoring(selected_date_range: dict, db: Session):
+    start_date, end_date = _parse_monitoring_range(selected_date_range)
 
-        female_count = db.query(Visitor).filter(
-            Visitor.counter_id == counter_id,
-            Visitor.person_gender == 'female',
-            Visitor.current_datetime.between(start_date, end_date)
-        ).count()
+    cache_key = ('gender', start_date, end_date)
+    cached = monitoring_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-        # Add the results for the current counter to the response in the desired structure
-        result.append({
-            "counter_id": counter_id,
-            "male": male_count,
-            "female": female_count
-        })
+    counters, counts = _count_per_counter_and_column(db, Visitor.person_gender, start_date, end_date)
+    result = _pivot_gender_counts(counters, counts)
 
+    monitoring_cache.set(cache_key, result)
     return result
 
 
-def get_system_info():
+# Pivot (counter_id, gender) counts into one entry per counter
+def _pivot_gender_counts(counters, counts):
+    return [
+        {
+            "counter_id": counter_id,
+            "male": counts.get((counter_id, 'male'), 0),
+            "female": counts.get((counter_id, 'female'), 0)
+        }
+        for counter_id in counters
+    ]
+
+
+def get_system_info(cpu_interval: Optional[float] = 1):
     """
     Combines both hardware specifications and current usage status
-    into a single dictionary.
+    into a single dictionary. cpu_interval=None reports the CPU usage
+    since the previous call instead of sampling for a second.
     """
     # Hardware specifications
     cpu_model = platform.processor()
@@ -522,7 +572,7 @@ def get_system_info():
     gpu_model = gpus[0].name if gpus else "N/A"
 
     # Current usage status
-    cpu_usage = psutil.cpu_percent(interval=1)
+    cpu_usage = psutil.cpu_percent(interval=cpu_interval)
     memory_usage = memory_info.percent
     disk_usage = psutil.disk_usage('/').percent
     gpu_usage = gpus[0].load * 100 if gpus else 0  # Use first GPU if available
@@ -562,6 +612,160 @@ def get_latest_disabled_camera(db: Session):
         return {"message": "No camera is out of reach."}  # Return this message if all cameras are enabled
 
 
+###################################################################################################
+################################### Dashboard snapshot ############################################
+###################################################################################################
+
+# Each snapshot part is fn(db, options) -> {section key: value}. The parts share nothing, so every one
+# runs on its own read session and they all run at once.
+
+# Per-counter totals over all time (rollups): total visitors, least visited counter
+def _snapshot_counter_totals(db: Session, options: dict) -> dict:
+    totals = query_visitor_rollups(db, dimensions=('counter_id',))
+    visitor_count = sum(row['visitor_count'] for row in totals)
+    total_duration = sum(row['total_duration'] for row in totals)
+    return {
+        "total_visitors": {
+            "total_visitors": visitor_count,
+            "average_duration": round(total_duration / visitor_count, 2) if visitor_count > 0 else 0.00
+        },
+        "least_visited_counter": _least_visited_summary(totals),
+    }
+
+
+# Per-counter totals since midnight (rollups): most visited counter today
+def _snapshot_today_totals(db: Session, options: dict) -> dict:
+    today_start = datetime.combine(options["today"], datetime.min.time())
+    totals = [row for row in query_visitor_rollups(db, dimensions=('counter_id',), start=today_start) if row['visitor_count'] > 0]
+    sections = {
+        # Keyed by counter id so live updates can send just the counters that changed
+        "visitors_per_counter_today": {
+            str(row['counter_id']): _counter_summary(row['counter_id'], row['visitor_count'], row['total_duration'])
+            for row in sorted(totals, key=lambda row: (row['counter_id'] is None, row['counter_id']))
+        }
+    }
+    if totals:
+        # Most visited first, ties go to the lowest counter_id
+        row = min(totals, key=lambda row: (-row['visitor_count'], row['counter_id'] or 0))
+        sections["most_visited_counter_no_slot_time_for_latest_date"] = _counter_summary(
+            row['counter_id'], row['visitor_count'], row['total_duration'])
+    else:
+        sections["most_visited_counter_no_slot_time_for_latest_date"] = {"message": "No visitors found today."}
+    return sections
+
+
+# One bucketed slot query for the latest date: the three slot-time summaries
+def _snapshot_slot_time(db: Session, options: dict) -> dict:
+    latest_date = get_latest_visit_date(db)
+    if not latest_date:
+        return {
+            "most_visited_counter_for_each_slot_time_in_latest_date": {"message": "No data available in the database."},
+            "most_visited_counter_for_latest_date_slot_time": {"message": "No data available."},
+            "minimum_visited_counter_for_latest_date_slot_time": {"message": "No data available."},
+            "visitors_per_slot": {},
+        }
+    time_slots, slot_counts = aggregate_slot_counts(
+        db, latest_date, options["opening_hour"], options["closing_hour"], options["slot_minutes"])
+    return {
+        "visitors_per_slot": {
+            "visit_date": latest_date.strftime('%Y-%m-%d'),
+            "slots": {_format_time_slot(slot_start, slot_end): sum(row[1] for row in counts)
+                      for (slot_start, slot_end), counts in zip(time_slots, slot_counts)}
+        },
+        "most_visited_counter_for_each_slot_time_in_latest_date": slot_most_visited_each(latest_date, time_slots, slot_counts),
+        "most_visited_counter_for_latest_date_slot_time": slot_extreme_overall(time_slots, slot_counts, most_visited=True),
+        "minimum_visited_counter_for_latest_date_slot_time": slot_extreme_overall(time_slots, slot_counts, most_visited=False),
+    }
+
+
+# One (counter, age group, gender) query over the monitoring range: age and gender charts
+def _snapshot_monitoring(db: Session, options: dict) -> dict:
+    start_date, end_date = _parse_monitoring_range(options["selected_date_range"])
+    age_result = monitoring_cache.get(('age', start_date, end_date))
+    gender_result = monitoring_cache.get(('gender', start_date, end_date))
+    if age_result is None or gender_result is None:
+        rows = (
+            db.query(Visitor.counter_id, Visitor.person_age_group, Visitor.person_gender, func.count(Visitor.id))
+            .filter(Visitor.current_datetime.between(start_date, end_date))
+            .group_by(Visitor.counter_id, Visitor.person_age_group, Visitor.person_gender)
+            .all()
+        )
+        age_counts, gender_counts = {}, {}
+        for counter_id, age_group, gender, count in rows:
+            age_counts[(counter_id, age_group)] = age_counts.get((counter_id, age_group), 0) + count
+            gender_counts[(counter_id, gender)] = gender_counts.get((counter_id, gender), 0) + count
+        # The chart lists every counter with any visitor, cheapest from the rollups
+        counters = sorted((row['counter_id'] for row in query_visitor_rollups(db, dimensions=('counter_id',))),
+                          key=lambda counter: (counter is None, counter))
+        age_result = _pivot_age_counts(counters, age_counts)
+        gender_result = _pivot_gender_counts(counters, gender_counts)
+        monitoring_cache.set(('age', start_date, end_date), age_result)
+        monitoring_cache.set(('gender', start_date, end_date), gender_result)
+    return {"age_monitoring": age_result, "gender_monitoring": gender_result}
+
+
+# The latest disabled camera
+def _snapshot_camera_notification(db: Session, options: dict) -> dict:
+    return {"camera_notification": get_latest_disabled_camera(db)}
+
+
+# (part name, section keys it fills, fn)
+DASHBOARD_SNAPSHOT_PARTS = (
+    ("counter_totals", ("total_visitors", "least_visited_counter"), _snapshot_counter_totals),
+    ("today_totals", ("most_visited_counter_no_slot_time_for_latest_date", "visitors_per_counter_today"),
+     _snapshot_today_totals),
+    ("slot_time", ("most_visited_counter_for_each_slot_time_in_latest_date", "most_visited_counter_for_latest_date_slot_time",
+                   "minimum_visited_counter_for_latest_date_slot_time", "visitors_per_slot"), _snapshot_slot_time),
+    ("monitoring", ("age_monitoring", "gender_monitoring"), _snapshot_monitoring),
+    ("camera_notification", ("camera_notification",), _snapshot_camera_notification),
+)
+
+
+# Run one snapshot part, on failure each of its keys gets an error message. Returns (sections, time in ms)
+def _snapshot_section(db: Session, name: str, keys, fn, options: dict = None):
+    started = time.perf_counter()
+    try:
+        sections = fn(db, options)
+    except Exception as e:
+        logging.error(f"Dashboard snapshot part {name} failed: {e}")
+        sections = {key: {"message": f"Error fetching {key.replace('_', ' ')}"} for key in keys}
+    return sections, round((time.perf_counter() - started) * 1000, 1)
+
+
+# Everything the home dashboard polls, each part on its own read session (replica when configured) and
+# all parts concurrently, so the snapshot takes as long as its slowest part. Sections are keyed like the
+# endpoints they replace, plus visitors_per_counter_today and visitors_per_slot for the live dashboard;
+# a failing part carries the message its endpoint would return and leaves the others intact.
+# Returns (sections, timings in ms).
+async def dashboard_snapshot_sections(
+    selected_date_range: Optional[dict] = None,
+    opening_hour: int = SLOT_OPENING_HOUR,
+    closing_hour: int = SLOT_CLOSING_HOUR,
+    slot_minutes: int = SLOT_MINUTES
+):
+    today = datetime.now().date()
+    if selected_date_range is None:
+        selected_date_range = {'start_date': f"{today} 00:00:00", 'end_date': f"{today} 23:59:59"}
+    options = {"today": today, "selected_date_range": selected_date_range,
+               "opening_hour": opening_hour, "closing_hour": closing_hour, "slot_minutes": slot_minutes}
+
+    results = await asyncio.gather(*(
+        run_read_db(_snapshot_section, name, keys, fn, options) for name, keys, fn in DASHBOARD_SNAPSHOT_PARTS
+    ))
+    sections, timings = {}, {}
+    for (name, keys, fn), (part, elapsed_ms) in zip(DASHBOARD_SNAPSHOT_PARTS, results):
+        sections.update(part)
+        timings[name] = elapsed_ms
+    return sections, timings
+
+
+# System info for the snapshot, without the one second CPU sample
+def dashboard_snapshot_system_info():
+    sections, elapsed_ms = _snapshot_section(
+        None, "system_info", ("system_info",), lambda db, options: {"system_info": get_system_info(cpu_interval=None)})
+    return sections, {"system_info": elapsed_ms}
+
+
 ################################# REPORT PAGE ########################################
 ################################# REPORT PAGE ########################################
 ################################# REPORT PAGE ########################################
@@ -579,6 +783,91 @@ def get_visitors_by_date_range(db: Session, start_date: str, end_date: str):
     
     return visitors
 
+# Columns of the visitor report and its exports, in order
+VISITOR_RECORD_COLUMNS = (
+    "no", "counter_id", "camera_id", "person_id", "attendance_duration",
+    "gender", "age", "roi", "date_time", "exhibition_name"
+)
+
+# Rows fetched per round trip by the streaming exports (server-side cursor)
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", 5000))
+
+
+# Parse the report date range, 400 on a bad format
+def parse_visitor_records_dates(start_date: str, end_date: str):
+    try:
+        # Convert string dates to datetime objects
+        return datetime.strptime(start_date, '%Y-%m-%d'), datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use 'YYYY-MM-DD'.")
+
+
+# Visitor report query (visitor columns joined to the exhibition name) shared by the table and the exports
+def visitor_records_query(
+    start_date: datetime,
+    end_date: datetime,
+    counter_id: int = None,
+    id: int = None,
+    person_id: int = None,
+    age: str = None,
+    gender: str = None,
+    exhibition: str = None
+):
+    query = select(
+        Visitor.id,
+        Visitor.counter_id,
+        Visitor.cam_id,
+        Visitor.person_id,
+        Visitor.person_duration_in_roi,
+        Visitor.person_gender,
+        Visitor.person_age_group,
+        Visitor.roi_id,
+        Visitor.current_datetime,
+        Exhibition.name.label("exhibition_name")
+    ).join(
+        Exhibition, Visitor.exhibition_id == Exhibition.id  # Ensure there's an exhibition_id in Visitor
+    ).where(
+        Visitor.current_datetime.between(start_date, end_date)
+    )
+
+    # Apply filters if provided
+    if counter_id is not None:
+        query = query.where(Visitor.counter_id == counter_id)
+
+    if id is not None:
+        query = query.where(Visitor.id == id)
+
+    if person_id is not None:
+        query = query.where(Visitor.person_id == person_id)
+
+    if age is not None:
+        query = query.where(Visitor.person_age_group == age)
+
+    if gender is not None:
+        query = query.where(Visitor.person_gender == gender)
+
+    if exhibition is not None:
+        query = query.where(Exhibition.name == exhibition)
+
+    return query
+
+
+# One report row, numbered from 1
+def _visitor_record_row(no: int, row) -> tuple:
+    return (
+        no,
+        row.counter_id,
+        row.cam_id,
+        row.person_id,
+        row.person_duration_in_roi,
+        row.person_gender,
+        row.person_age_group,
+        row.roi_id,
+        row.current_datetime,
+        row.exhibition_name
+    )
+
+
 def get_visitor_records(
     db: Session, 
     start_date: str, 
@@ -587,66 +876,370 @@ def get_visitor_records(
     id: int = None, 
     person_id: int = None,  
     age: str = None, 
-    gender: str = None
+    gender: str = None,
+    exhibition: str = None
 ):
-    try:
-        # Convert string dates to datetime objects
-        start_date = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date = datetime.strptime(end_date, '%Y-%m-%d')
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use 'YYYY-MM-DD'.")
+    start_date, end_date = parse_visitor_records_dates(start_date, end_date)
 
     try:
-        # Base query with a join to the Exhibition table
-        query = db.query(Visitor, Exhibition.name.label("exhibition_name")).join(
-            Exhibition, Visitor.exhibition_id == Exhibition.id  # Ensure there's an exhibition_id in Visitor
-        ).filter(
-            Visitor.current_datetime.between(start_date, end_date)
-        )
+        query = visitor_records_query(start_date, end_date, counter_id, id, person_id, age, gender, exhibition)
 
-        # Apply filters if provided
-        if counter_id is not None:
-            query = query.filter(Visitor.counter_id == counter_id)
-        
-        if id is not None:
-            query = query.filter(Visitor.id == id)
-
-        if person_id is not None:
-            query = query.filter(Visitor.person_id == person_id)
-
-        if age is not None:
-            query = query.filter(Visitor.person_age_group == age)
-
-        if gender is not None:
-            query = query.filter(Visitor.person_gender == gender)
-
-        # Fetch records
-        records = query.all()
-
-        # Prepare data for return
-        data = []
-        if records:
-            for idx, (record, exhibition_name) in enumerate(records, start=1):
-                data.append({
-                    "no": idx,
-                    "counter_id": record.counter_id,
-                    "camera_id": record.cam_id,
-                    "person_id": record.person_id,
-                    "attendance_duration": record.person_duration_in_roi,
-                    "gender": record.person_gender,
-                    "age": record.person_age_group,
-                    "roi": record.roi_id,
-                    "date_time": record.current_datetime,
-                    "exhibition_name": exhibition_name
-                })
-
-        return data  # Return the data, which could be an empty list
+        # Fetch records and prepare data for return (could be an empty list)
+        return [
+            dict(zip(VISITOR_RECORD_COLUMNS, _visitor_record_row(idx, row)))
+            for idx, row in enumerate(db.execute(query), start=1)
+        ]
     
     except SQLAlchemyError as e:
         logging.error(f"Error fetching visitor records: {e}")
         raise HTTPException(status_code=500, detail="Error fetching visitor records")
 
 
+# Page size of the visitor report table
+REPORT_PAGE_SIZE_DEFAULT = int(os.getenv("REPORT_PAGE_SIZE_DEFAULT", 500))
+REPORT_PAGE_SIZE_MAX = int(os.getenv("REPORT_PAGE_SIZE_MAX", 5000))
+
+
+# Short fingerprint of the report filters, a cursor is only valid for the filters it was issued for
+def _visitor_records_filters_key(*filters) -> str:
+    return hashlib.sha1(json.dumps(filters, default=str).encode()).hexdigest()[:12]
+
+
+# Opaque cursor: position (current_datetime, id) of the last row sent, its `no` and the filters fingerprint
+def encode_visitor_records_cursor(last_datetime: datetime, last_id: int, last_no: int, filters_key: str) -> str:
+    payload = json.dumps([last_datetime.isoformat(), last_id, last_no, filters_key], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_visitor_records_cursor(cursor: str, filters_key: str):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_datetime, last_id, last_no, cursor_filters_key = json.loads(payload)
+        position = (datetime.fromisoformat(last_datetime), int(last_id), int(last_no))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if cursor_filters_key != filters_key:
+        raise HTTPException(status_code=400, detail="Cursor does not match the report filters.")
+    return position
+
+
+# Row count of the report without counting rows: exact from the rollups when the filters allow it,
+# otherwise the planner's estimate (pg_class/pg_statistic). Returns (total, source) or (None, None).
+def estimate_visitor_records_total(db: Session, query, start_date: datetime, end_date: datetime,
+                                   counter_id: int = None, id: int = None, person_id: int = None,
+                                   age: str = None, gender: str = None, exhibition: str = None):
+    if id is None and person_id is None:
+        filters = {
+            name: value for name, value in (
+                ('counter_id', counter_id), ('person_age_group', age), ('person_gender', gender)
+            ) if value is not None
+        }
+        # The report joins tbl_exhibitions, so only rows of an existing (matching) exhibition count
+        exhibitions = select(Exhibition.id)
+        if exhibition is not None:
+            exhibitions = exhibitions.where(Exhibition.name == exhibition)
+        exhibition_ids = set(db.execute(exhibitions).scalars())
+
+        rows = query_visitor_rollups(db, ('exhibition_id',), start_date, end_date, filters=filters)
+        return sum(row['row_count'] for row in rows if row['exhibition_id'] in exhibition_ids), 'rollups'
+
+    if db.get_bind().dialect.name == 'postgresql':
+        compiled = query.compile(dialect=db.get_bind().dialect)
+        plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"]), 'planner'
+
+    return None, None
+
+
+# One page of the visitor report, keyset paginated on (current_datetime, id):
+# every page is an index range scan whatever its position, `no` keeps counting across pages
+def get_visitor_records_page(
+    db: Session,
+    start_date: str,
+    end_date: str,
+    counter_id: int = None,
+    id: int = None,
+    person_id: int = None,
+    age: str = None,
+    gender: str = None,
+    exhibition: str = None,
+    cursor: str = None,
+    page_size: int = REPORT_PAGE_SIZE_DEFAULT,
+    include_total: bool = False
+):
+    start, end = parse_visitor_records_dates(start_date, end_date)
+    page_size = max(1, min(page_size, REPORT_PAGE_SIZE_MAX))
+    filters_key = _visitor_records_filters_key(start_date, end_date, counter_id, id, person_id, age, gender, exhibition)
+
+    try:
+        query = visitor_records_query(start, end, counter_id, id, person_id, age, gender, exhibition)
+        page_query = query
+        last_no = 0
+        if cursor:
+            last_datetime, last_id, last_no = decode_visitor_records_cursor(cursor, filters_key)
+            page_query = page_query.where(tuple_(Visitor.current_datetime, Visitor.id) > tuple_(last_datetime, last_id))
+
+        # One extra row tells whether there is a next page
+        rows = db.execute(
+            page_query.order_by(Visitor.current_datetime, Visitor.id).limit(page_size + 1)
+        ).all()
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        visitors = [
+            dict(zip(VISITOR_RECORD_COLUMNS, _visitor_record_row(no, row)))
+            for no, row in enumerate(rows, start=last_no + 1)
+        ]
+
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            next_cursor = encode_visitor_records_cursor(last.current_datetime, last.id, last_no + len(rows), filters_key)
+
+        page = {"visitors": visitors, "next_cursor": next_cursor, "page_size": page_size}
+        if include_total:
+            page["total"], page["total_source"] = estimate_visitor_records_total(
+                db, query, start, end, counter_id, id, person_id, age, gender, exhibition
+            )
+        return page
+
+    except SQLAlchemyError as e:
+        logging.error(f"Error fetching visitor records: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching visitor records")
+
+
+# Stream the visitor report rows through a server-side cursor, EXPORT_FETCH_SIZE rows at a time.
+# Uses its own session: the request's session is closed before a StreamingResponse body is sent.
+def iter_visitor_record_chunks(query, fetch_size: int = EXPORT_FETCH_SIZE) -> Generator:
+    db = read_session()
+    try:
+        result = db.execute(
+            query.order_by(Visitor.current_datetime, Visitor.id),
+            execution_options={"yield_per": fetch_size}
+        )
+        no = 0
+        for partition in result.partitions():
+            chunk = []
+            for row in partition:
+                no += 1
+                chunk.append(_visitor_record_row(no, row))
+            yield chunk
+    finally:
+        db.rollback()
+        db.close()
+
+
+# Streaming CSV export: rows are encoded chunk by chunk, memory stays flat whatever the row count
+def stream_visitor_records_csv(query, fetch_size: int = EXPORT_FETCH_SIZE) -> Generator:
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(VISITOR_RECORD_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+
+    try:
+        for chunk in iter_visitor_record_chunks(query, fetch_size):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(chunk)
+            yield buffer.getvalue().encode("utf-8")
+    except SQLAlchemyError as e:
+        # The status line is already sent, the truncated file is the only signal left
+        logging.error(f"Error streaming visitor records: {e}")
+        raise
+
+
+
+# Excel sheet limit (header included) and the spooled XLSX settings
+EXCEL_MAX_ROWS = 1048576
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", 16 * 1024 * 1024))  # Larger files spill to disk
+EXPORT_PROGRESS_EVERY_ROWS = int(os.getenv("EXPORT_PROGRESS_EVERY_ROWS", 100000))
+EXPORT_PROGRESS_MAX_ENTRIES = 100
+
+# Progress of the running/recent Excel exports, keyed by the client supplied export_id
+_export_progress = OrderedDict()
+_export_progress_lock = threading.Lock()
+
+
+def _set_export_progress(export_id: Optional[str], **progress):
+    if export_id is None:
+        return
+    with _export_progress_lock:
+        entry = _export_progress.pop(export_id, {})
+        entry.update(progress)
+        _export_progress[export_id] = entry
+        while len(_export_progress) > EXPORT_PROGRESS_MAX_ENTRIES:
+            _export_progress.popitem(last=False)
+
+
+# Progress of an Excel export started with export_id, None if unknown
+def get_export_progress(export_id: str) -> Optional[dict]:
+    with _export_progress_lock:
+        progress = _export_progress.get(export_id)
+        return dict(progress) if progress is not None else None
+
+
+# Build the XLSX export with a write-only workbook (rows go straight to temp files, not to memory).
+# A new sheet is started whenever Excel's row limit is reached. Returns the spooled file, rewound, and the row count.
+def build_visitor_records_excel(
+    query,
+    fetch_size: int = EXPORT_FETCH_SIZE,
+    export_id: Optional[str] = None,
+    max_rows_per_sheet: int = EXCEL_MAX_ROWS
+):
+    workbook = Workbook(write_only=True)
+    sheet, sheets, sheet_rows = None, 0, max_rows_per_sheet
+    rows_written = 0
+    started = time.monotonic()
+    _set_export_progress(export_id, rows=0, sheets=0, done=False, error=None)
+
+    try:
+        for chunk in iter_visitor_record_chunks(query, fetch_size):
+            for row in chunk:
+                if sheet_rows >= max_rows_per_sheet:
+                    sheets += 1
+                    sheet = workbook.create_sheet('Visitor Records' if sheets == 1 else f'Visitor Records {sheets}')
+                    sheet.append(VISITOR_RECORD_COLUMNS)
+                    sheet_rows = 1
+                sheet.append(row)
+                sheet_rows += 1
+
+            previous = rows_written
+            rows_written += len(chunk)
+            _set_export_progress(export_id, rows=rows_written, sheets=sheets)
+            if rows_written // EXPORT_PROGRESS_EVERY_ROWS > previous // EXPORT_PROGRESS_EVERY_ROWS:
+                elapsed = time.monotonic() - started
+                logging.info(f"Excel export: {rows_written} rows in {sheets} sheet(s), {rows_written / max(elapsed, 1e-6):,.0f} rows/s")
+
+        if sheet is None:
+            # No rows, still a valid workbook with the header
+            workbook.create_sheet('Visitor Records').append(VISITOR_RECORD_COLUMNS)
+            sheets = 1
+
+        spooled = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+        workbook.save(spooled)
+        spooled.seek(0)
+    except Exception as e:
+        _set_export_progress(export_id, done=True, error=str(e))
+        raise
+
+    _set_export_progress(export_id, rows=rows_written, sheets=sheets, done=True)
+    logging.info(f"Excel export finished: {rows_written} rows in {sheets} sheet(s), {time.monotonic() - started:.1f}s")
+    return spooled, rows_written
+
+
+# Stream a file in blocks and close it once sent
+def iter_file_chunks(file, block_size: int = 64 * 1024) -> Generator:
+    try:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        file.close()
+
+
+# Rows per Parquet row group (the cursor chunks are gathered up to this size)
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", 100000))
+
+
+# Parquet/Arrow exports need pyarrow (in requirements.txt; its import above is optional so the rest of the
+# service keeps working without it)
+def require_columnar_exports():
+    if pa is None:
+        raise HTTPException(status_code=501, detail="Columnar exports need the pyarrow package.")
+
+
+# Typed Arrow schema of the visitor report, low-cardinality strings are dictionary encoded
+def visitor_records_arrow_schema():
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("no", pa.int64()),
+        ("counter_id", pa.int32()),
+        ("camera_id", pa.int32()),
+        ("person_id", pa.int32()),
+        ("attendance_duration", pa.float64()),
+        ("gender", category),
+        ("age", category),
+        ("roi", pa.int32()),
+        ("date_time", pa.timestamp("us")),
+        ("exhibition_name", category),
+    ])
+
+
+# Column-wise record batch from report rows
+def _visitor_records_batch(chunk, schema):
+    columns = list(zip(*chunk))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+# Write-only sink that hands out what the Arrow writers produced so far, tell() keeps the absolute offset
+class _DrainingSink:
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# Streaming Parquet ('parquet') or Arrow IPC stream ('arrow') export.
+# Row groups / record batches are written and sent as the cursor advances.
+def stream_visitor_records_columnar(query, file_format: str = "parquet", fetch_size: int = EXPORT_FETCH_SIZE) -> Generator:
+    schema = visitor_records_arrow_schema()
+    sink = _DrainingSink()
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+
+    pending, pending_rows = [], 0
+    try:
+        for chunk in iter_visitor_record_chunks(query, fetch_size):
+            if not chunk:
+                continue
+            batch = _visitor_records_batch(chunk, schema)
+            if file_format == "parquet":
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                if pending_rows < PARQUET_ROW_GROUP_ROWS:
+                    continue
+                writer.write_table(pa.Table.from_batches(pending), row_group_size=pending_rows)
+                pending, pending_rows = [], 0
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending), row_group_size=pending_rows)
+        writer.close()
+        yield sink.drain()
+    except SQLAlchemyError as e:
+        # The status line is already sent, the truncated file is the only signal left
+        logging.error(f"Error streaming visitor records: {e}")
+        raise
 
 def export_visitor_records_to_csv(data):
     df = pd.DataFrame(data)
@@ -662,6 +1255,36 @@ def export_visitor_records_to_excel(data):
     buffer.seek(0)
     return buffer
 
+# Resolve the report date/time filters into a datetime range (None = unbounded).
+# Returns False when the filters cannot match any row (a time filter without both dates).
+def _report_datetime_range(start_date: str = None, end_date: str = None, start_time: str = None, end_time: str = None):
+    # Date and time parsing, if provided
+    if start_date:
+        start_date = datetime.strptime(start_date, '%Y-%m-%d')
+    if end_date:
+        end_date = datetime.strptime(end_date, '%Y-%m-%d')
+
+    if start_time:
+        start_time = datetime.strptime(start_time, '%H:%M:%S').time()
+    if end_time:
+        end_time = datetime.strptime(end_time, '%H:%M:%S').time()
+
+    range_start, range_end = None, None
+
+    # Apply date filters if provided
+    if start_date and end_date:
+        range_start, range_end = start_date, end_date
+
+    # Apply time filters if provided, they narrow the date range
+    if start_time and end_time:
+        if not (start_date and end_date):
+            return False
+        range_start = max(range_start, datetime.combine(start_date, start_time))
+        range_end = min(range_end, datetime.combine(end_date, end_time))
+
+    return range_start, range_end
+
+
 # Function to fetch people count per counter from the Visitor table
 def get_people_count_per_counter(
     db: Session,
@@ -671,44 +1294,24 @@ def get_people_count_per_counter(
     end_time: str = None
 ):
     try:
-        # Date and time parsing, if provided
-        if start_date:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d')
-        if end_date:
-            end_date = datetime.strptime(end_date, '%Y-%m-%d')
-
-        if start_time:
-            start_time = datetime.strptime(start_time, '%H:%M:%S').time()
-        if end_time:
-            end_time = datetime.strptime(end_time, '%H:%M:%S').time()
-
-        # Build the query to fetch records where person_id is not None
-        query = db.query(Visitor).filter(Visitor.person_id.isnot(None))
-
-        # Apply date and time filters if provided
-        if start_date and end_date:
-            query = query.filter(Visitor.current_datetime.between(start_date, end_date))
-
-        if start_time and end_time:
-            query = query.filter(
-                Visitor.current_datetime.between(
-                    datetime.combine(start_date, start_time) if start_date else None,
-                    datetime.combine(end_date, end_time) if end_date else None
-                )
-            )
+        datetime_range = _report_datetime_range(start_date, end_date, start_time, end_time)
 
         # Group by counter_id and count total persons
-        records = query.with_entities(
-            Visitor.counter_id,
-            func.count(Visitor.person_id).label("total_persons")
-        ).group_by(Visitor.counter_id).all()
+        records = []
+        if datetime_range:
+            range_start, range_end = datetime_range
+            counter_totals = query_visitor_rollups(db, dimensions=('counter_id',), start=range_start, end=range_end)
+            records = [row for row in counter_totals if row['visitor_count'] > 0]
 
         # Check if no records are found
         if not records:
             raise HTTPException(status_code=404, detail="No records found for the specified criteria.")
         
         # Return the result as a list of dicts
-        result = [{"counter_id": record.counter_id, "total_persons": record.total_persons} for record in records]
+        result = [
+            {"counter_id": record['counter_id'], "total_persons": record['visitor_count']}
+            for record in sorted(records, key=lambda row: row['counter_id'] or 0)
+        ]
         return result
     
     except ValueError as e:
@@ -729,44 +1332,23 @@ def get_people_duration_per_counter(
     end_time: str = None
 ):
     try:
-        # Date and time parsing, if provided
-        if start_date:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d')
-        if end_date:
-            end_date = datetime.strptime(end_date, '%Y-%m-%d')
-
-        if start_time:
-            start_time = datetime.strptime(start_time, '%H:%M:%S').time()
-        if end_time:
-            end_time = datetime.strptime(end_time, '%H:%M:%S').time()
-
-        # Build the query to fetch records where person_duration_in_roi is not None
-        query = db.query(Visitor).filter(Visitor.person_duration_in_roi.isnot(None))
-
-        # Apply date and time filters if provided
-        if start_date and end_date:
-            query = query.filter(Visitor.current_datetime.between(start_date, end_date))
-
-        if start_time and end_time:
-            query = query.filter(
-                Visitor.current_datetime.between(
-                    datetime.combine(start_date, start_time) if start_date else None,
-                    datetime.combine(end_date, end_time) if end_date else None
-                )
-            )
+        datetime_range = _report_datetime_range(start_date, end_date, start_time, end_time)
 
         # Group by counter_id and sum total attendance duration
-        records = query.with_entities(
-            Visitor.counter_id,
-            func.sum(Visitor.person_duration_in_roi).label("total_duration")
-        ).group_by(Visitor.counter_id).all()
+        records = []
+        if datetime_range:
+            range_start, range_end = datetime_range
+            records = query_visitor_rollups(db, dimensions=('counter_id',), start=range_start, end=range_end)
 
         # Check if no records are found
         if not records:
             raise HTTPException(status_code=404, detail="No records found for the specified criteria.")
         
         # Return the result as a list of dicts
-        result = [{"counter_id": record.counter_id, "total_duration": record.total_duration} for record in records]
+        result = [
+            {"counter_id": record['counter_id'], "total_duration": record['total_duration']}
+            for record in sorted(records, key=lambda row: row['counter_id'] or 0)
+        ]
         return result
     
     except ValueError as e:
@@ -797,8 +1379,13 @@ def report_details_of_selected_counter(db: Session, counter_id: int):
         if counter_id <= 0:
             raise HTTPException(status_code=400, detail="Invalid counter_id. It must be a positive integer.")
 
+        # Totals for the selected counter per age group, answered from the rollups
+        age_group_totals = query_visitor_rollups(
+            db, dimensions=('person_age_group',), filters={'counter_id': counter_id}
+        )
+
         # Count total visits for the selected counter
-        total_visits = db.query(Visitor).filter(Visitor.counter_id == counter_id, Visitor.person_id.isnot(None)).count()
+        total_visits = sum(row['visitor_count'] for row in age_group_totals)
 
         # Fetch the most visited date and time
         most_visited_record = db.query(
@@ -821,20 +1408,15 @@ def report_details_of_selected_counter(db: Session, counter_id: int):
         least_visited_record = least_visited_record[0] if least_visited_record else None
 
         # Calculate total duration of visits in minutes
-        total_duration_seconds = db.query(func.sum(Visitor.person_duration_in_roi)).filter(
-            Visitor.counter_id == counter_id, Visitor.person_duration_in_roi.isnot(None)
-        ).scalar() or 0
+        total_duration_seconds = sum(row['total_duration'] for row in age_group_totals) or 0
         total_duration_minutes = total_duration_seconds / 60
 
         # Determine the most visited age group
-        most_visited_age_group = db.query(
-            Visitor.person_age_group
-        ).filter(Visitor.counter_id == counter_id, Visitor.person_age_group.isnot(None)) \
-         .group_by(Visitor.person_age_group) \
-         .order_by(func.count(Visitor.person_age_group).desc()).first()
+        known_age_groups = [row for row in age_group_totals if row['person_age_group'] is not None]
+        most_visited_age_group = max(known_age_groups, key=lambda row: row['row_count']) if known_age_groups else None
 
         # Handle case where no age group data is found
-        most_visited_age_group = most_visited_age_group[0] if most_visited_age_group else None
+        most_visited_age_group = most_visited_age_group['person_age_group'] if most_visited_age_group else None
 
         return {
             "total_visits": total_visits,
@@ -855,6 +1437,7 @@ def report_details_of_selected_counter(db: Session, counter_id: int):
 ##################################################################################
 
 
+@cached_read(cameras_cache)
 def get_cameras_details(db: Session):
     try:
         # Query all cameras from the Camera table
@@ -885,64 +1468,34 @@ def get_cameras_details(db: Session):
         raise HTTPException(status_code=500, detail=f"An error occurred while fetching cameras: {str(e)}")
 
 
-VIDEOS_DIRECTORY = "Videos"
+VIDEOS_DIRECTORY = RECORDINGS_DIRECTORY
 
 def get_most_recent_video(id: int) -> str:
-    folder_path = os.path.join(VIDEOS_DIRECTORY, str(id))
-    
-    if not os.path.exists(folder_path):
+    # Sorted per-camera index, rescanned only when the camera's directory changes
+    recordings = recording_catalog.camera(id)
+    if recordings is None:
         raise HTTPException(status_code=404, detail=f"Folder for camera {id} not found.")
-    
-    # Retrieve all video files in the folder
-    video_files = [f for f in os.listdir(folder_path) if f.endswith(('.mp4', '.avi'))]
-    
-    if not video_files:
-        raise HTTPException(status_code=404, detail=f"No video files found for camera {id}.")
-    
-    # Parse file names to sort by timestamp
-    def extract_timestamp(file_name: str) -> datetime:
-        # Format: <id>_YYYY-MM-DD_HH-MM-SS.mp4
-        try:
-            timestamp_str = file_name.split('_')[1] + "_" + file_name.split('_')[2].split('.')[0]
-            return datetime.strptime(timestamp_str, "%Y-%m-%d_%H-%M-%S")
-        except Exception:
-            raise HTTPException(status_code=400, detail=f"Invalid video file format for {file_name}.")
-    
-    # Sort by date/time descending to get the most recent video
-    video_files.sort(key=extract_timestamp, reverse=True)
-    most_recent_video = video_files[0]
-    most_recent_video_path = os.path.join(folder_path, most_recent_video)
-    
-    return most_recent_video_path
-
-
-
 
+    most_recent_video = recordings.latest()
+    if most_recent_video is None:
+        raise HTTPException(status_code=404, detail=f"No video files found for camera {id}.")
 
+    return most_recent_video.path
 
-# Stream video frames with the option to resize
-def stream_video_frames(video_path: str, width: int = 640, height: int = 480) -> Generator:
-    cap = cv2.VideoCapture(video_path)
 
-    if not cap.isOpened():
-        raise HTTPException(status_code=500, detail="Unable to open video file.")
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Resize the frame to the specified width and height
-        frame = cv2.resize(frame, (width, height))
 
-        # Encode the frame as a JPEG
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
 
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
-    cap.release()
+# Stream video frames with the option to resize.
+# Cached recordings replay from the encoded-frame cache (frame_cache, built in the background on first view);
+# otherwise viewers of the same video/size/quality share one decoder (frame_hub). A bad file raises here, before streaming.
+async def stream_video_frames(video_path: str, width: int = 640, height: int = 480, quality: int = MJPEG_JPEG_QUALITY,
+                              fps: Optional[float] = None, adaptive: bool = False) -> AsyncGenerator:
+    cached = open_cached_frames(video_path, width, height, quality)
+    if cached is not None:
+        return mjpeg_stream(CachedFrameStream(cached, fps, adaptive))
+    return mjpeg_stream(await subscribe_frames(video_path, width, height, quality, fps, adaptive))
 
 
     
@@ -973,6 +1526,7 @@ def insert_camera(db: Session, cam_name: str, cam_ip: str, cam_mac: str, cam_ena
         # Add and commit the new camera
         db.add(new_camera)
         db.commit()
+        invalidate_camera_caches()
         db.refresh(new_camera)  # Refresh to get the auto-generated ID
         print(f"New camera inserted with id={new_camera.id}")  # Log the new camera ID
     except IntegrityError as e:
@@ -1000,6 +1554,7 @@ def delete_camera_by_id(db: Session, id: int):
         # If it exists, proceed to delete
         db.delete(camera)  # Delete the camera instance
         db.commit()
+        invalidate_camera_caches(id)
         print(f"Camera with id={id} deleted successfully.")
     
     except Exception as e:
@@ -1076,6 +1631,7 @@ def camera_edit_save(
 
         # Commit the changes to the database
         db.commit()
+        invalidate_camera_caches(id)
         print(f"Camera with id={camera.id} updated successfully.")
 
     except ValueError as ve:
@@ -1091,6 +1647,7 @@ def camera_edit_save(
 #################################### ROIS ###########################################
 
 ## List ROIs function for the selected camera
+@cached_read(rois_cache)
 def list_rois_for_camera(db: Session, camera_id: int):
     try:
         # Fetch the camera and its ROIs
@@ -1132,6 +1689,8 @@ def delete_roi_for_camera(db: Session, camera_id: int, roi_id: int):
         # Delete the ROI
         db.delete(roi)
         db.commit()
+        roi_cache.invalidate(camera_id)
+        rois_cache.invalidate((camera_id,))
 
         return True
 
@@ -1166,6 +1725,8 @@ def roi_edit_save(
 
         # Commit the changes to the database
         db.commit()
+        roi_cache.invalidate(camera_id)
+        rois_cache.invalidate((camera_id,))
         print(f"ROI with id={roi_id} for Camera ID {camera_id} updated successfully.")
 
     except ValueError as ve:
@@ -1184,6 +1745,7 @@ def roi_edit_save(
 ################################# ACCOUNT  ########################################
 
 # Function to get account list
+@cached_read(users_cache)
 def get_all_users(db: Session):
     try:
         # Query all users from the Account table
@@ -1241,6 +1803,7 @@ def insert_account(
         
         db.add(new_account)
         db.commit()
+        users_cache.invalidate()
         db.refresh(new_account)  # Refresh the instance to get the auto-generated id
         print(f"New account inserted with user_name={user_name} and id={new_account.id}")
         return new_account  # Return the new account object
@@ -1267,6 +1830,7 @@ def delete_user(db: Session, id: int):
         # Delete the user from the database
         db.delete(user)
         db.commit()  # Commit the transaction to delete the user
+        users_cache.invalidate()
 
         return {"message": f"User with id={id} has been successfully deleted."}
 
@@ -1339,6 +1903,7 @@ def user_edit_save(
         user.user_status = user_status
 
         db.commit()  # Save the changes to the database
+        users_cache.invalidate()
         return {"message": f"User with id={id} updated successfully."}
     except Exception as e:
         db.rollback()  # Rollback in case of any error
@@ -1364,6 +1929,7 @@ def add_exhibition(db: Session, name: str, description: str, start_date: str, en
         )
         db.add(new_exhibition)
         db.commit()
+        invalidate_exhibition_caches()
         db.refresh(new_exhibition)
         return new_exhibition
 
@@ -1379,6 +1945,7 @@ def add_exhibition(db: Session, name: str, description: str, start_date: str, en
         db.close()
 
 
+@cached_read(exhibitions_cache)
 def list_exhibitions(db: Session):
     try:
         return db.query(Exhibition).all()
@@ -1395,6 +1962,7 @@ def edit_exhibition(db: Session, exhibition_id: int, name: str, description: str
             exhibition.start_date = start_date
             exhibition.end_date = end_date
             db.commit()
+            invalidate_exhibition_caches()
             db.refresh(exhibition)
             return exhibition
         else:
@@ -1411,6 +1979,7 @@ def delete_exhibition(db: Session, exhibition_id: int):
         if exhibition:
             db.delete(exhibition)
             db.commit()
+            invalidate_exhibition_caches()
             return True
         else:
             logging.warning(f"Exhibition with ID {exhibition_id} not found.")
@@ -1421,6 +1990,7 @@ def delete_exhibition(db: Session, exhibition_id: int):
         return False
 
 
+@cached_read(exhibition_names_cache)
 def get_exhibition_names(db: Session):
     try:
         exhibitions = db.query(Exhibition.name).all()  # Fetch only the 'name' field
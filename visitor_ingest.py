@@ -0,0 +1,255 @@
+import io
+import os
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime, timedelta
+from typing import Optional, List
+from fastapi import HTTPException
+from pydantic import BaseModel, TypeAdapter, field_validator
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from db_configure import SessionLocal
+from db_initialize import Visitor
+from visitor_rollups import apply_visitor_rows_to_rollups
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+# Ingestion limits, tune per node
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 5000))  # Rows per COPY chunk / client request
+INGEST_MAX_ROWS = int(os.getenv("INGEST_MAX_ROWS", 100000))  # Rows accepted in one request
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", 4))  # Concurrent ingest transactions
+INGEST_QUEUE_TIMEOUT_SECONDS = float(os.getenv("INGEST_QUEUE_TIMEOUT_SECONDS", 2))  # Wait for a slot before answering 503
+INGEST_WRITE_METHOD = os.getenv("INGEST_WRITE_METHOD", "copy")  # 'copy' or 'insert'
+
+# Columns written by the ingestion path, in COPY order
+INGEST_COLUMNS = (
+    'person_id', 'roi_id', 'counter_id', 'cam_id', 'person_duration_in_roi',
+    'person_age_group', 'person_gender', 'current_datetime', 'exhibition_id'
+)
+
+_ingest_slots = threading.BoundedSemaphore(INGEST_MAX_CONCURRENCY)
+
+
+# One visitor row as sent by the detectors
+class VisitorRecord(BaseModel):
+    person_id: Optional[int] = None
+    roi_id: Optional[int] = None
+    counter_id: Optional[int] = None
+    cam_id: Optional[int] = None
+    person_duration_in_roi: float
+    person_age_group: Optional[str] = None
+    person_gender: Optional[str] = None
+    current_datetime: datetime
+    exhibition_id: Optional[int] = None
+
+    # tbl_visitors stores naive local time; an offset would shift the row to another hour bucket and
+    # give the same instant a different rollup key than its naive twin
+    @field_validator("current_datetime")
+    @classmethod
+    def to_naive_local_time(cls, value: datetime) -> datetime:
+        if value.tzinfo is not None:
+            value = value.astimezone().replace(tzinfo=None)
+        return value
+
+
+_visitor_records_adapter = TypeAdapter(List[VisitorRecord])
+
+
+# Validate a JSON array or NDJSON body in one pydantic-core pass
+def parse_visitor_payload(body: bytes, content_type: str = "application/json") -> List[VisitorRecord]:
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        lines = [line for line in body.splitlines() if line.strip()]
+        body = b"[" + b",".join(lines) + b"]"
+    elif body.lstrip().startswith(b"{"):
+        # {"visitors": [...]} wrapper
+        payload = json.loads(body)
+        if not isinstance(payload, dict) or "visitors" not in payload:
+            raise ValueError("Expected a JSON array of visitors or an object with a 'visitors' array.")
+        return _visitor_records_adapter.validate_python(payload["visitors"])
+    return _visitor_records_adapter.validate_json(body)
+
+
+###########################################################################################
+################################### Writers ###############################################
+###########################################################################################
+
+def _copy_text_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, str):
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Stream a batch into tbl_visitors with COPY FROM STDIN (text format)
+def _copy_batch(db: Session, records):
+    buffer = io.StringIO()
+    for record in records:
+        buffer.write("\t".join(_copy_text_value(getattr(record, column)) for column in INGEST_COLUMNS))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {Visitor.__tablename__} ({', '.join(INGEST_COLUMNS)}) FROM STDIN WITH (FORMAT text)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+# Multi-row INSERT (executemany with insertmanyvalues batching)
+def _insert_batch(db: Session, records):
+    db.execute(
+        insert(Visitor.__table__),
+        [{column: getattr(record, column) for column in INGEST_COLUMNS} for record in records]
+    )
+
+
+# Write visitor records in one transaction, together with their rollups. The rollups of the whole request
+# are applied once, after the last batch: the hot hour/day bucket rows stay locked only until the commit,
+# and always in the same key order, whatever the batching.
+def ingest_visitors(db: Session, records, batch_size: int = INGEST_BATCH_SIZE, write_method: str = INGEST_WRITE_METHOD, commit: bool = True):
+    if len(records) > INGEST_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {INGEST_MAX_ROWS} visitors per request.")
+    if not records:
+        return 0
+
+    # Backpressure: only a few ingest transactions at a time, callers retry after a 503
+    if not _ingest_slots.acquire(timeout=INGEST_QUEUE_TIMEOUT_SECONDS):
+        raise HTTPException(status_code=503, detail="Ingestion is busy, retry later.", headers={"Retry-After": "1"})
+
+    write_batch = _copy_batch if write_method == "copy" else _insert_batch
+    try:
+        for offset in range(0, len(records), batch_size):
+            batch = records[offset:offset + batch_size]
+            write_batch(db, batch)
+        apply_visitor_rows_to_rollups(db.connection(), records)
+        if commit:
+            db.commit()
+        return len(records)
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Error ingesting visitors: {e}")
+        raise HTTPException(status_code=500, detail="Error ingesting visitors")
+    finally:
+        _ingest_slots.release()
+
+
+###########################################################################################
+################################### Client ################################################
+###########################################################################################
+
+# Send visitors to /visitors/bulk as NDJSON batches, waiting and retrying while the server answers 503
+def post_visitors_bulk(
+    base_url: str,
+    visitors,
+    token: Optional[str] = None,
+    batch_size: int = INGEST_BATCH_SIZE,
+    max_retries: int = 5,
+    timeout: float = 30
+) -> int:
+    url = base_url.rstrip("/") + "/visitors/bulk"
+    headers = {"Content-Type": "application/x-ndjson"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    def encode(visitor) -> bytes:
+        if isinstance(visitor, BaseModel):
+            return visitor.model_dump_json().encode()
+        return json.dumps(visitor, default=str).encode()
+
+    visitors = list(visitors)
+    inserted = 0
+    for offset in range(0, len(visitors), batch_size):
+        body = b"\n".join(encode(visitor) for visitor in visitors[offset:offset + batch_size])
+
+        for attempt in range(max_retries + 1):
+            request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    inserted += json.loads(response.read())["inserted"]
+                break
+            except urllib.error.HTTPError as e:
+                if e.code != 503 or attempt == max_retries:
+                    raise
+                time.sleep(float(e.headers.get("Retry-After", 1)))
+    return inserted
+
+
+###########################################################################################
+################################### Benchmark #############################################
+###########################################################################################
+
+def _synthetic_visitors(count: int):
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    age_groups = ['Child', 'Teenager', 'Young', 'Adult', 'Middle Age', 'Elderly']
+    return [
+        {
+            "person_id": index,
+            "roi_id": random.randint(1, 4),
+            "counter_id": random.randint(1, 10),
+            "cam_id": random.randint(1, 5),
+            "person_duration_in_roi": round(random.uniform(1, 300), 2),
+            "person_age_group": random.choice(age_groups),
+            "person_gender": random.choice(['male', 'female']),
+            "current_datetime": str(start + timedelta(milliseconds=index)),
+            "exhibition_id": None
+        }
+        for index in range(count)
+    ]
+
+
+# Measure validation and write throughput; the written rows are rolled back unless keep=True
+def run_benchmark(rows: int, batch_size: int, write_method: str, url: Optional[str] = None, token: Optional[str] = None, keep: bool = False):
+    visitors = _synthetic_visitors(rows)
+
+    if url:
+        started = time.perf_counter()
+        inserted = post_visitors_bulk(url, visitors, token=token, batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        print(f"HTTP: {inserted} rows in {elapsed:.2f}s -> {inserted / elapsed:,.0f} rows/s")
+        return
+
+    body = b"\n".join(json.dumps(visitor).encode() for visitor in visitors)
+    started = time.perf_counter()
+    records = parse_visitor_payload(body, "application/x-ndjson")
+    elapsed = time.perf_counter() - started
+    print(f"Validation: {len(records)} rows in {elapsed:.2f}s -> {len(records) / elapsed:,.0f} rows/s")
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        inserted = ingest_visitors(db, records, batch_size=batch_size, write_method=write_method, commit=keep)
+        elapsed = time.perf_counter() - started
+        print(f"Write ({write_method}): {inserted} rows in {elapsed:.2f}s -> {inserted / elapsed:,.0f} rows/s")
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bulk visitor ingestion.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--method", choices=["copy", "insert"], default=INGEST_WRITE_METHOD)
+    parser.add_argument("--url", help="Benchmark a running server through /visitors/bulk instead of the database directly")
+    parser.add_argument("--token", help="Bearer token for --url")
+    parser.add_argument("--keep", action="store_true", help="Commit the benchmark rows instead of rolling them back")
+    args = parser.parse_args()
+
+    INGEST_MAX_ROWS = max(INGEST_MAX_ROWS, args.rows)
+    run_benchmark(args.rows, args.batch_size, args.method, args.url, args.token, args.keep)
@@ -0,0 +1,351 @@
+import os
+import re
+import argparse
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from db_configure import engine
+from db_initialize import Visitor, VisitorRollup
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Partitioning policy of tbl_visitors, run this module daily (e.g. from cron) to apply it
+VISITOR_PARTITION_INTERVAL = os.getenv("VISITOR_PARTITION_INTERVAL", "month")  # 'month' or 'day'
+VISITOR_PARTITIONS_AHEAD = int(os.getenv("VISITOR_PARTITIONS_AHEAD", 3))  # Upcoming partitions kept ready
+VISITOR_RETENTION_DAYS = int(os.getenv("VISITOR_RETENTION_DAYS", 0))  # 0 keeps every partition
+VISITOR_RETENTION_ACTION = os.getenv("VISITOR_RETENTION_ACTION", "detach")  # 'detach' (archive) or 'drop'
+VISITOR_PARTITION_LOCK_TIMEOUT_MS = int(os.getenv("VISITOR_PARTITION_LOCK_TIMEOUT_MS", 5000))  # DDL gives up instead of queueing writers behind it
+
+VISITOR_TABLE = Visitor.__tablename__
+DEFAULT_PARTITION = f"{VISITOR_TABLE}_default"
+LEGACY_PARTITION = f"{VISITOR_TABLE}_legacy"
+
+_BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+###########################################################################################
+################################ Partition periods ########################################
+###########################################################################################
+
+def period_start(value: datetime, interval: str = VISITOR_PARTITION_INTERVAL) -> datetime:
+    if interval == 'month':
+        return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'day':
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown partition interval: {interval}")
+
+
+def next_period(start: datetime, interval: str = VISITOR_PARTITION_INTERVAL) -> datetime:
+    if interval == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if interval == 'day':
+        return start + timedelta(days=1)
+    raise ValueError(f"Unknown partition interval: {interval}")
+
+
+def partition_name(start: datetime, interval: str = VISITOR_PARTITION_INTERVAL) -> str:
+    suffix = start.strftime('%Y_%m') if interval == 'month' else start.strftime('%Y_%m_%d')
+    return f"{VISITOR_TABLE}_p{suffix}"
+
+
+def _timestamp_literal(value: datetime) -> str:
+    return "'" + value.strftime('%Y-%m-%d %H:%M:%S') + "'"
+
+
+def _parse_bound(bound: str):
+    bound = bound.strip()
+    if bound in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.strptime(bound.strip("'")[:19], '%Y-%m-%d %H:%M:%S')
+
+
+###########################################################################################
+################################ Partition catalog ########################################
+###########################################################################################
+
+def is_partitioned(connection) -> bool:
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name"
+    ), {"name": VISITOR_TABLE}).first() is not None
+
+
+# Attached partitions as dicts of name, start and end (None for MINVALUE/MAXVALUE/DEFAULT)
+def list_partitions(connection):
+    rows = connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:name AS regclass) ORDER BY c.relname"
+    ), {"name": VISITOR_TABLE})
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_PATTERN.search(bound or "")
+        partitions.append({
+            "name": name,
+            "default": bound == "DEFAULT",
+            "start": _parse_bound(match.group(1)) if match else None,
+            "end": _parse_bound(match.group(2)) if match else None,
+        })
+    return partitions
+
+
+###########################################################################################
+################################ Partition maintenance ####################################
+###########################################################################################
+
+# Create the partition for [start, end); rows of that range already in the default partition are moved into it
+def create_partition(connection, start: datetime, end: datetime, name: str):
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+        return False
+
+    has_default = connection.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar() is not None
+    bounds = f"FROM ({_timestamp_literal(start)}) TO ({_timestamp_literal(end)})"
+
+    try:
+        if has_default:
+            # Attaching checks the default partition, so stray rows must leave it first. The lock keeps
+            # inserts from landing new rows of the range in the default partition before the ATTACH.
+            connection.execute(text(f"SET LOCAL lock_timeout = {VISITOR_PARTITION_LOCK_TIMEOUT_MS}"))
+            connection.execute(text(f'LOCK TABLE "{DEFAULT_PARTITION}" IN SHARE ROW EXCLUSIVE MODE'))
+            connection.execute(text(f'CREATE TABLE "{name}" (LIKE {VISITOR_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+            connection.execute(text(
+                f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" '
+                f'WHERE current_datetime >= {_timestamp_literal(start)} AND current_datetime < {_timestamp_literal(end)} '
+                f'RETURNING *) INSERT INTO "{name}" SELECT * FROM moved'
+            ))
+            connection.execute(text(f'ALTER TABLE {VISITOR_TABLE} ATTACH PARTITION "{name}" FOR VALUES {bounds}'))
+        else:
+            connection.execute(text(f'CREATE TABLE "{name}" PARTITION OF {VISITOR_TABLE} FOR VALUES {bounds}'))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    logger.info(f"Created partition {name} for [{start}, {end})")
+    return True
+
+
+# Pre-create the partitions of the current and upcoming periods, and of any period stranded in the default partition
+def ensure_partitions(connection, now: datetime = None, ahead: int = VISITOR_PARTITIONS_AHEAD, interval: str = VISITOR_PARTITION_INTERVAL):
+    now = now or datetime.now()
+    attached = list_partitions(connection)
+
+    periods = []
+    start = period_start(now, interval)
+    for _ in range(ahead + 1):
+        periods.append(start)
+        start = next_period(start, interval)
+
+    if any(partition["default"] for partition in attached):
+        stranded = connection.execute(text(
+            f"SELECT DISTINCT date_trunc('{interval}', current_datetime) FROM \"{DEFAULT_PARTITION}\""
+        ))
+        periods.extend(row[0] for row in stranded)
+
+    created = []
+    for start in sorted(set(periods)):
+        end = next_period(start, interval)
+        # Skip periods already covered by an attached (e.g. legacy) partition
+        if any(
+            not partition["default"]
+            and (partition["start"] is None or partition["start"] < end)
+            and (partition["end"] is None or start < partition["end"])
+            for partition in attached
+        ):
+            continue
+        name = partition_name(start, interval)
+        if create_partition(connection, start, end, name):
+            created.append(name)
+    return created
+
+
+# Detach (and archive or drop) the partitions that ended before the retention cutoff, and delete the
+# hour/day rollups of their range so the totals stop counting them. DETACH ... CONCURRENTLY is not
+# allowed next to the default partition, so each partition is detached in its own short transaction
+# with a lock timeout; no visitor row is deleted one by one.
+def apply_retention(connection, now: datetime = None, retention_days: int = VISITOR_RETENTION_DAYS, action: str = VISITOR_RETENTION_ACTION):
+    if retention_days <= 0:
+        return []
+    if action not in ('detach', 'drop'):
+        raise ValueError(f"Unknown retention action: {action}")
+
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    expired = [
+        partition for partition in list_partitions(connection)
+        if not partition["default"] and partition["end"] is not None and partition["end"] <= cutoff
+    ]
+
+    connection.commit()
+    rollups = VisitorRollup.__table__
+    for partition in expired:
+        try:
+            connection.execute(text(f"SET LOCAL lock_timeout = {VISITOR_PARTITION_LOCK_TIMEOUT_MS}"))
+            connection.execute(text(f'ALTER TABLE {VISITOR_TABLE} DETACH PARTITION "{partition["name"]}"'))
+            # Partition bounds fall on day boundaries, so every hour/day bucket is wholly inside or outside
+            expired_buckets = rollups.c.bucket_start < partition["end"]
+            if partition["start"] is not None:
+                expired_buckets &= rollups.c.bucket_start >= partition["start"]
+            deleted = connection.execute(rollups.delete().where(expired_buckets)).rowcount
+            if action == 'drop':
+                connection.execute(text(f'DROP TABLE "{partition["name"]}"'))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        if action == 'drop':
+            logger.info(f"Dropped expired partition {partition['name']} and {deleted} rollup rows")
+        else:
+            logger.info(f"Detached expired partition {partition['name']} and deleted {deleted} rollup rows, "
+                        f"archive it with pg_dump then drop it")
+    return [partition["name"] for partition in expired]
+
+
+# Unique constraint on the partition key columns, matched by ATTACH against the parent's primary key
+LEGACY_KEY_CONSTRAINT = f"{LEGACY_PARTITION}_id_datetime_key"
+
+
+# Everything ATTACH PARTITION would otherwise do under its lock, done while writes continue: a validated
+# CHECK constraint for the partition bound (ATTACH then skips its scan) and every index of the parent
+# built CONCURRENTLY (ATTACH then adopts them instead of building them)
+def _prepare_legacy_partition(connection, boundary: datetime):
+    connection.commit()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as autocommit:
+        autocommit.execute(text(f"SET lock_timeout = {VISITOR_PARTITION_LOCK_TIMEOUT_MS}"))
+        autocommit.execute(text(f"ALTER TABLE {VISITOR_TABLE} DROP CONSTRAINT IF EXISTS {LEGACY_PARTITION}_bound"))
+        autocommit.execute(text(
+            f"ALTER TABLE {VISITOR_TABLE} ADD CONSTRAINT {LEGACY_PARTITION}_bound "
+            f"CHECK (current_datetime IS NOT NULL AND current_datetime < {_timestamp_literal(boundary)}) NOT VALID"
+        ))
+        # Takes SHARE UPDATE EXCLUSIVE only, inserts and reads carry on during the scan
+        autocommit.execute(text(f"ALTER TABLE {VISITOR_TABLE} VALIDATE CONSTRAINT {LEGACY_PARTITION}_bound"))
+
+        for index in Visitor.__table__.indexes:
+            ddl = str(CreateIndex(index).compile(dialect=autocommit.dialect))
+            autocommit.execute(text(ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY IF NOT EXISTS", 1)))
+        if not autocommit.execute(text(
+            "SELECT 1 FROM pg_constraint WHERE conname = :name"
+        ), {"name": LEGACY_KEY_CONSTRAINT}).first():
+            autocommit.execute(text(
+                f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{LEGACY_KEY_CONSTRAINT}" '
+                f"ON {VISITOR_TABLE} (id, current_datetime)"
+            ))
+            autocommit.execute(text(
+                f'ALTER TABLE {VISITOR_TABLE} ADD CONSTRAINT "{LEGACY_KEY_CONSTRAINT}" UNIQUE USING INDEX "{LEGACY_KEY_CONSTRAINT}"'
+            ))
+
+
+# Turn an existing plain tbl_visitors into a partitioned table without copying rows: the old table
+# becomes the partition of everything before the period after the current one. The bound check and
+# the indexes are prepared online first, so the ACCESS EXCLUSIVE step only renames and attaches.
+def convert_to_partitioned(connection, interval: str = VISITOR_PARTITION_INTERVAL):
+    if is_partitioned(connection):
+        logger.info(f"{VISITOR_TABLE} is already partitioned.")
+        return False
+
+    latest = connection.execute(text(f"SELECT max(current_datetime) FROM {VISITOR_TABLE}")).scalar()
+    boundary = next_period(period_start(max(latest or datetime.now(), datetime.now()), interval), interval)
+    _prepare_legacy_partition(connection, boundary)
+
+    try:
+        connection.execute(text(f"SET LOCAL lock_timeout = {VISITOR_PARTITION_LOCK_TIMEOUT_MS}"))
+        connection.execute(text(f"LOCK TABLE {VISITOR_TABLE} IN ACCESS EXCLUSIVE MODE"))
+
+        # Free the names used by the new parent table
+        index_names = [row[0] for row in connection.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :name"
+        ), {"name": VISITOR_TABLE})]
+        connection.execute(text(f"ALTER TABLE {VISITOR_TABLE} RENAME TO {LEGACY_PARTITION}"))
+        for index_name in index_names:
+            connection.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{(index_name + "_legacy")[:63]}"'))
+        connection.execute(text(f"ALTER SEQUENCE IF EXISTS {VISITOR_TABLE}_id_seq RENAME TO {LEGACY_PARTITION}_id_seq"))
+
+        # New partitioned parent (with its default partition), ids continue after the legacy rows
+        Visitor.__table__.create(bind=connection)
+        connection.execute(text(
+            f"SELECT setval('{VISITOR_TABLE}_id_seq', COALESCE((SELECT max(id) FROM {LEGACY_PARTITION}), 0) + 1, false)"
+        ))
+
+        # Catalog-only: the validated CHECK proves the bound and the matching indexes are adopted
+        connection.execute(text(
+            f"ALTER TABLE {VISITOR_TABLE} ATTACH PARTITION {LEGACY_PARTITION} "
+            f"FOR VALUES FROM (MINVALUE) TO ({_timestamp_literal(boundary)})"
+        ))
+        connection.execute(text(f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT {LEGACY_PARTITION}_bound"))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    logger.info(f"{VISITOR_TABLE} converted, existing rows live in {LEGACY_PARTITION} up to {boundary}.")
+    return True
+
+
+###########################################################################################
+################################ Partition pruning check ##################################
+###########################################################################################
+
+# Collect the partitions of tbl_visitors read by a JSON plan
+def _scanned_partitions(plan_node):
+    relations = []
+    relation = plan_node.get("Relation Name")
+    if relation and relation.startswith(VISITOR_TABLE + "_"):
+        relations.append(relation)
+    for child in plan_node.get("Plans", []):
+        relations.extend(_scanned_partitions(child))
+    return relations
+
+
+# EXPLAIN the report queries and report how many partitions each one reads
+def verify_pruning(start_date: str, end_date: str):
+    import service_functions as sf
+    from db_migrate import capture_selects, explain_statement
+
+    checks = {
+        "get_visitor_records": lambda db: sf.get_visitor_records(db, start_date, end_date),
+        "get_visitors_by_date_range": lambda db: sf.get_visitors_by_date_range(db, start_date, end_date),
+    }
+
+    report = {}
+    with engine.connect() as connection:
+        total_partitions = len(list_partitions(connection))
+        db = Session(bind=connection)
+        try:
+            for name, check in checks.items():
+                scanned = set()
+                for statement, parameters in capture_selects(connection, db, check):
+                    scanned.update(_scanned_partitions(explain_statement(connection, statement, parameters)))
+                report[name] = sorted(scanned)
+                logger.info(f"{name}: reads {len(scanned)} of {total_partitions} partitions {sorted(scanned)}")
+        finally:
+            db.rollback()
+            db.close()
+    return report
+
+
+def run_partition_maintenance():
+    with engine.connect() as connection:
+        if not is_partitioned(connection):
+            logger.warning(f"{VISITOR_TABLE} is not partitioned, run with --convert first.")
+            return
+        ensure_partitions(connection)
+        apply_retention(connection)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the time partitions of tbl_visitors.")
+    parser.add_argument("--convert", action="store_true", help="Convert an existing plain tbl_visitors into a partitioned table")
+    parser.add_argument("--verify-pruning", nargs=2, metavar=("START_DATE", "END_DATE"),
+                        help="EXPLAIN the report queries for a YYYY-MM-DD range and list the partitions they read")
+    args = parser.parse_args()
+
+    if args.convert:
+        with engine.connect() as connection:
+            convert_to_partitioned(connection)
+    if args.verify_pruning:
+        verify_pruning(*args.verify_pruning)
+    else:
+        run_partition_maintenance()
@@ -0,0 +1,379 @@
+import os
+import argparse
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, cast, String, literal, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from db_configure import SessionLocal
+from db_initialize import Visitor, VisitorRollup, VisitorRollupState
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+
+# Set VISITOR_ROLLUPS_ENABLED=0 to always answer analytics from raw tbl_visitors rows
+VISITOR_ROLLUPS_ENABLED = os.getenv("VISITOR_ROLLUPS_ENABLED", "1") != "0"
+
+# Dimensions kept in the rollup tables, in dim_key order
+ROLLUP_DIMENSIONS = ('counter_id', 'cam_id', 'roi_id', 'exhibition_id', 'person_age_group', 'person_gender')
+ROLLUP_GRANULARITIES = ('hour', 'day')
+
+# Aggregates returned by query_visitor_rollups for every group
+ROLLUP_MEASURES = ('row_count', 'visitor_count', 'total_duration', 'min_duration', 'max_duration')
+
+# Set once the rollups are known to be backfilled, avoids a state lookup per request
+_rollups_ready = False
+
+
+###########################################################################################
+################################ Bucket helpers ###########################################
+###########################################################################################
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    if granularity == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown rollup granularity: {granularity}")
+
+
+def _bucket_ceil(value: datetime, granularity: str) -> datetime:
+    start = bucket_start(value, granularity)
+    if start == value:
+        return start
+    return start + (timedelta(hours=1) if granularity == 'hour' else timedelta(days=1))
+
+
+# Build the dim_key of a visitor row, must match _dim_key_expression()
+def dim_key(values) -> str:
+    return '|'.join('' if value is None else str(value) for value in values)
+
+
+def _dim_key_expression(columns):
+    return func.concat_ws('|', *[func.coalesce(cast(column, String), literal('')) for column in columns])
+
+
+###########################################################################################
+############################ Incremental maintenance ######################################
+###########################################################################################
+
+# Fold a batch of visitor rows (ORM objects or dicts) into the hour and day rollups
+def apply_visitor_rows_to_rollups(connection, rows):
+    buckets = {}
+    for row in rows:
+        get = row.get if isinstance(row, dict) else (lambda name, _row=row: getattr(_row, name, None))
+        current_datetime = get('current_datetime')
+        if current_datetime is None:
+            continue
+
+        dims = tuple(get(name) for name in ROLLUP_DIMENSIONS)
+        duration = get('person_duration_in_roi')
+        has_person = get('person_id') is not None
+
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (granularity, bucket_start(current_datetime, granularity), dims)
+            aggregate = buckets.get(key)
+            if aggregate is None:
+                aggregate = buckets[key] = {'row_count': 0, 'visitor_count': 0, 'total_duration': 0.0,
+                                            'min_duration': None, 'max_duration': None}
+            aggregate['row_count'] += 1
+            aggregate['visitor_count'] += 1 if has_person else 0
+            if duration is not None:
+                aggregate['total_duration'] += duration
+                aggregate['min_duration'] = duration if aggregate['min_duration'] is None else min(aggregate['min_duration'], duration)
+                aggregate['max_duration'] = duration if aggregate['max_duration'] is None else max(aggregate['max_duration'], duration)
+
+    if not buckets:
+        return 0
+
+    values = []
+    for (granularity, start, dims), aggregate in buckets.items():
+        value = {'granularity': granularity, 'bucket_start': start, 'dim_key': dim_key(dims)}
+        value.update(zip(ROLLUP_DIMENSIONS, dims))
+        value.update(aggregate)
+        values.append(value)
+    # PostgreSQL locks the conflicting rows in VALUES order: a fixed order keeps concurrent writers of the
+    # same buckets (ingests, analytics, the ORM hook) from deadlocking on each other
+    values.sort(key=lambda value: (value['granularity'], value['bucket_start'], value['dim_key']))
+
+    # One multi-row upsert; the batch is pre-aggregated so no key appears twice
+    table = VisitorRollup.__table__
+    statement = pg_insert(table).values(values)
+    excluded = statement.excluded
+    statement = statement.on_conflict_do_update(
+        constraint='uq_visitor_rollups_bucket_dims',
+        set_={
+            'row_count': table.c.row_count + excluded.row_count,
+            'visitor_count': table.c.visitor_count + excluded.visitor_count,
+            'total_duration': table.c.total_duration + excluded.total_duration,
+            'min_duration': func.least(table.c.min_duration, excluded.min_duration),
+            'max_duration': func.greatest(table.c.max_duration, excluded.max_duration),
+        }
+    )
+    connection.execute(statement)
+    return len(values)
+
+
+# Keep the rollups in step with Visitor rows added through any ORM session
+@event.listens_for(Session, "after_flush")
+def _rollup_new_visitors(session, flush_context):
+    new_visitors = [obj for obj in session.new if isinstance(obj, Visitor)]
+    if new_visitors:
+        apply_visitor_rows_to_rollups(session.connection(), new_visitors)
+
+
+###########################################################################################
+################################## Backfill ###############################################
+###########################################################################################
+
+# Rebuild the rollups from tbl_visitors, either entirely or for the days in [start_date, end_date)
+def backfill_visitor_rollups(db: Session, start_date: datetime = None, end_date: datetime = None):
+    global _rollups_ready
+
+    if start_date is not None:
+        start_date = bucket_start(start_date, 'day')
+    if end_date is not None:
+        end_date = _bucket_ceil(end_date, 'day')
+
+    try:
+        # Block concurrent visitor inserts so no row is counted twice or missed
+        db.execute(text("LOCK TABLE tbl_visitors IN SHARE MODE"))
+
+        delete_query = db.query(VisitorRollup)
+        raw_filters = []
+        if start_date is not None:
+            delete_query = delete_query.filter(VisitorRollup.bucket_start >= start_date)
+            raw_filters.append(Visitor.current_datetime >= start_date)
+        if end_date is not None:
+            delete_query = delete_query.filter(VisitorRollup.bucket_start < end_date)
+            raw_filters.append(Visitor.current_datetime < end_date)
+        deleted = delete_query.delete(synchronize_session=False)
+
+        # Hour rollups straight from the raw rows
+        dimension_columns = [getattr(Visitor, name) for name in ROLLUP_DIMENSIONS]
+        hour_bucket = func.date_trunc('hour', Visitor.current_datetime)
+        hour_select = (
+            db.query(
+                literal('hour'),
+                hour_bucket,
+                *dimension_columns,
+                _dim_key_expression(dimension_columns),
+                func.count(),
+                func.count(Visitor.person_id),
+                func.coalesce(func.sum(Visitor.person_duration_in_roi), 0),
+                func.min(Visitor.person_duration_in_roi),
+                func.max(Visitor.person_duration_in_roi)
+            )
+            .filter(*raw_filters)
+            .group_by(hour_bucket, *dimension_columns)
+        )
+
+        # Day rollups from the hour rollups just written
+        rollup_dimensions = [getattr(VisitorRollup, name) for name in ROLLUP_DIMENSIONS]
+        day_bucket = func.date_trunc('day', VisitorRollup.bucket_start)
+        day_filters = [VisitorRollup.granularity == 'hour']
+        if start_date is not None:
+            day_filters.append(VisitorRollup.bucket_start >= start_date)
+        if end_date is not None:
+            day_filters.append(VisitorRollup.bucket_start < end_date)
+        day_select = (
+            db.query(
+                literal('day'),
+                day_bucket,
+                *rollup_dimensions,
+                VisitorRollup.dim_key,
+                func.sum(VisitorRollup.row_count),
+                func.sum(VisitorRollup.visitor_count),
+                func.sum(VisitorRollup.total_duration),
+                func.min(VisitorRollup.min_duration),
+                func.max(VisitorRollup.max_duration)
+            )
+            .filter(*day_filters)
+            .group_by(day_bucket, *rollup_dimensions, VisitorRollup.dim_key)
+        )
+
+        target_columns = ['granularity', 'bucket_start', *ROLLUP_DIMENSIONS, 'dim_key', *ROLLUP_MEASURES]
+        table = VisitorRollup.__table__
+        db.execute(table.insert().from_select(target_columns, hour_select.statement))
+        db.execute(table.insert().from_select(target_columns, day_select.statement))
+
+        # Only a full backfill makes the rollups authoritative for every range
+        if start_date is None and end_date is None:
+            state = db.query(VisitorRollupState).filter(VisitorRollupState.id == 1).first()
+            if state is None:
+                db.add(VisitorRollupState(id=1, backfilled_at=datetime.now()))
+            else:
+                state.backfilled_at = datetime.now()
+
+        db.commit()
+        logging.info("Visitor rollups backfilled (%s old rollup rows replaced).", deleted)
+    except Exception:
+        db.rollback()
+        raise
+
+    if start_date is None and end_date is None:
+        _rollups_ready = True
+
+
+# Remove every rollup row, to be called in the same transaction that empties tbl_visitors
+def reset_visitor_rollups(db: Session):
+    db.query(VisitorRollup).delete(synchronize_session=False)
+
+
+###########################################################################################
+################################ Query planner ############################################
+###########################################################################################
+
+# Check whether the rollups may answer analytics queries
+def rollups_ready(db: Session) -> bool:
+    global _rollups_ready
+    if not VISITOR_ROLLUPS_ENABLED:
+        return False
+    if not _rollups_ready:
+        _rollups_ready = db.query(VisitorRollupState.id).first() is not None
+    return _rollups_ready
+
+
+# Split [start, end] into raw edges, hour buckets and day buckets, coarsest first
+def plan_rollup_segments(start: datetime = None, end: datetime = None):
+    # Rollup segments are half-open [lo, hi); None means unbounded
+    hour_lo = _bucket_ceil(start, 'hour') if start is not None else None
+    hour_hi = bucket_start(end, 'hour') if end is not None else None
+
+    if hour_lo is not None and hour_hi is not None and hour_lo >= hour_hi:
+        return [('raw', start, end)]
+
+    day_lo = _bucket_ceil(hour_lo, 'day') if hour_lo is not None else None
+    day_hi = bucket_start(hour_hi, 'day') if hour_hi is not None else None
+
+    segments = []
+    if day_lo is None or day_hi is None or day_lo < day_hi:
+        segments.append(('day', day_lo, day_hi))
+        if hour_lo is not None and hour_lo < day_lo:
+            segments.append(('hour', hour_lo, day_lo))
+        if hour_hi is not None and day_hi < hour_hi:
+            segments.append(('hour', day_hi, hour_hi))
+    else:
+        segments.append(('hour', hour_lo, hour_hi))
+
+    # Ragged edges below one hour are read from the raw rows
+    if start is not None and start < hour_lo:
+        segments.append(('raw', start, hour_lo))
+    if end is not None:
+        segments.append(('raw', hour_hi, end))
+    return segments
+
+
+def _raw_segment_query(db: Session, dimensions, lo, hi, end_inclusive, filters):
+    columns = [getattr(Visitor, name) for name in dimensions]
+    query = db.query(
+        *columns,
+        func.count(),
+        func.count(Visitor.person_id),
+        func.sum(Visitor.person_duration_in_roi),
+        func.min(Visitor.person_duration_in_roi),
+        func.max(Visitor.person_duration_in_roi)
+    )
+    if lo is not None:
+        query = query.filter(Visitor.current_datetime >= lo)
+    if hi is not None:
+        query = query.filter(Visitor.current_datetime <= hi if end_inclusive else Visitor.current_datetime < hi)
+    for name, value in filters.items():
+        query = query.filter(getattr(Visitor, name) == value)
+    return query.group_by(*columns) if columns else query
+
+
+def _rollup_segment_query(db: Session, dimensions, granularity, lo, hi, filters):
+    columns = [getattr(VisitorRollup, name) for name in dimensions]
+    query = db.query(
+        *columns,
+        func.sum(VisitorRollup.row_count),
+        func.sum(VisitorRollup.visitor_count),
+        func.sum(VisitorRollup.total_duration),
+        func.min(VisitorRollup.min_duration),
+        func.max(VisitorRollup.max_duration)
+    ).filter(VisitorRollup.granularity == granularity)
+    if lo is not None:
+        query = query.filter(VisitorRollup.bucket_start >= lo)
+    if hi is not None:
+        query = query.filter(VisitorRollup.bucket_start < hi)
+    for name, value in filters.items():
+        query = query.filter(getattr(VisitorRollup, name) == value)
+    return query.group_by(*columns) if columns else query
+
+
+# Aggregate visitors in [start, end] grouped by the given dimensions.
+# Whole days and hours are read from the rollups, sub-hour edges from tbl_visitors.
+def query_visitor_rollups(
+    db: Session,
+    dimensions=(),
+    start: datetime = None,
+    end: datetime = None,
+    end_inclusive: bool = True,
+    filters: dict = None
+):
+    filters = filters or {}
+    for name in list(dimensions) + list(filters):
+        if name not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"Unknown rollup dimension: {name}")
+
+    if rollups_ready(db):
+        segments = plan_rollup_segments(start, end)
+    else:
+        segments = [('raw', start, end)]
+
+    totals = {}
+    for source, lo, hi in segments:
+        if source == 'raw':
+            # Only the trailing edge (ending at `end`) honours end_inclusive
+            inclusive = end_inclusive and hi == end
+            rows = _raw_segment_query(db, dimensions, lo, hi, inclusive, filters).all()
+        else:
+            rows = _rollup_segment_query(db, dimensions, source, lo, hi, filters).all()
+
+        for row in rows:
+            key = tuple(row[:len(dimensions)])
+            row_count, visitor_count, total_duration, min_duration, max_duration = row[len(dimensions):]
+            if not row_count:
+                continue
+            total = totals.get(key)
+            if total is None:
+                totals[key] = {
+                    'row_count': row_count,
+                    'visitor_count': visitor_count,
+                    'total_duration': total_duration or 0,
+                    'min_duration': min_duration,
+                    'max_duration': max_duration
+                }
+                continue
+            total['row_count'] += row_count
+            total['visitor_count'] += visitor_count
+            total['total_duration'] += total_duration or 0
+            if min_duration is not None:
+                total['min_duration'] = min_duration if total['min_duration'] is None else min(total['min_duration'], min_duration)
+            if max_duration is not None:
+                total['max_duration'] = max_duration if total['max_duration'] is None else max(total['max_duration'], max_duration)
+
+    result = []
+    for key, total in totals.items():
+        entry = dict(zip(dimensions, key))
+        entry.update(total)
+        result.append(entry)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the visitor rollup tables from tbl_visitors.")
+    parser.add_argument("--start", help="First day to rebuild (YYYY-MM-DD), default: all history")
+    parser.add_argument("--end", help="Day after the last day to rebuild (YYYY-MM-DD), default: all history")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        backfill_visitor_rollups(
+            session,
+            datetime.strptime(args.start, '%Y-%m-%d') if args.start else None,
+            datetime.strptime(args.end, '%Y-%m-%d') if args.end else None
+        )
+    finally:
+        session.close()